@@ -1,7 +1,19 @@
+import logging
+from django.conf import settings
 from django.contrib import admin
+from django.contrib import messages
+from django.db import transaction
+from django.db.models import Q
 from django.contrib.auth.admin import UserAdmin
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from .models import User
+from .models import User, RosterImport
+from .roster import file_checksum
+from .tasks import import_roster
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROSTER_IMPORT_STALE_AFTER = 15 * 60
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -23,4 +35,87 @@ class CustomUserAdmin(UserAdmin):
         }),
     )
     search_fields = ('username', 'first_name', 'last_name', 'email')
-    ordering = ('username',)
\ No newline at end of file
+    ordering = ('username',)
+
+def queue_import(request, roster_import):
+    """Start an import in the background; returns False if it couldn't be queued"""
+    try:
+        import_roster.delay(roster_import.pk)
+    except Exception as e:
+        logger.error(f"Could not queue {roster_import}: {e}")
+        messages.error(request, f'Could not start {roster_import}: {e}. Use "Resume selected imports" to retry.')
+        return False
+    return True
+
+def resumable_imports():
+    """
+    Imports that may be resumed: failed or never started, or running with
+    no progress for ROSTER_IMPORT_STALE_AFTER seconds (their worker died)
+    """
+    stale_after = getattr(settings, 'ROSTER_IMPORT_STALE_AFTER', DEFAULT_ROSTER_IMPORT_STALE_AFTER)
+    return RosterImport.objects.exclude(file='').filter(
+        Q(status__in=[RosterImport.Status.PENDING, RosterImport.Status.FAILED])
+        | Q(status=RosterImport.Status.RUNNING,
+            updated_at__lt=timezone.now() - timezone.timedelta(seconds=stale_after))
+    )
+
+def resume_roster_import_action(modeladmin, request, queryset):
+    """Admin action to resume failed or interrupted imports"""
+    for roster_import in queryset:
+        # Claim the import by marking it running, so a second click (or
+        # another admin) can't start a concurrent run over the same rows
+        claimed = resumable_imports().filter(pk=roster_import.pk).update(
+            status=RosterImport.Status.RUNNING, updated_at=timezone.now()
+        )
+        if not claimed:
+            messages.warning(request, f'{roster_import} is already running or completed')
+        elif queue_import(request, roster_import):
+            messages.success(request, f'Resuming {roster_import} after row {roster_import.rows_processed}')
+        else:
+            RosterImport.objects.filter(pk=roster_import.pk).update(status=roster_import.status)
+
+resume_roster_import_action.short_description = "Resume selected imports"
+
+@admin.register(RosterImport)
+class RosterImportAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'source', 'status', 'rows_processed', 'created_count',
+                    'duplicate_count', 'invalid_count', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('source', 'checksum', 'status', 'rows_processed', 'created_count', 'duplicate_count',
+                       'invalid_count', 'issues', 'error', 'created_at', 'updated_at', 'finished_at')
+    actions = [resume_roster_import_action]
+    
+    def get_fields(self, request, obj=None):
+        # Only the upload is editable, and only when creating an import
+        if obj is None:
+            return ('file',)
+        return ('file',) + self.readonly_fields
+    
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if obj is None:
+            form.base_fields['file'].required = True
+            # Generated passwords can't be handed out from a background
+            # import, so uploads need one per row
+            form.base_fields['file'].help_text = _(
+                "CSV with username, email, first_name, last_name, phone_number and password columns"
+            )
+        return form
+    
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return ()
+        return ('file',) + self.readonly_fields
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.source = obj.file.name
+            obj.checksum = file_checksum(obj.file)
+        super().save_model(request, obj, form, change)
+        if not change:
+            # The import runs in the background; this page shows its progress
+            def start_import():
+                if queue_import(request, obj):
+                    messages.info(request, 'The import has started. Reload this page to follow its progress.')
+            
+            transaction.on_commit(start_import)
@@ -0,0 +1,135 @@
+"""
+Token authentication served from memory.
+
+Resolved tokens are kept in a bounded per-process LRU and in the shared
+cache. Every entry carries the user's auth version, a counter in the shared
+cache that is bumped whenever the user is saved or deleted or one of their
+tokens is deleted; a process-local hit costs one cache read and no queries.
+Entries hold a few user fields, never the password hash, and the user is
+rebuilt from them with every other field deferred.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+DEFAULT_TOKEN_CACHE_SIZE = 10000
+DEFAULT_TOKEN_CACHE_TTL = 300
+
+# What requests read from request.user: permission checks and the profile
+# returned by the user and login endpoints
+CACHED_USER_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name', 'phone_number',
+    'role', 'is_active', 'is_staff', 'is_superuser',
+)
+
+def auth_version_key(user_id):
+    return f'accounts:auth-version:{user_id}'
+
+def get_auth_version(user_id):
+    """
+    Current auth version of a user. Starts from a timestamp so an evicted
+    key can't bring back entries cached under an older version.
+    """
+    key = auth_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version if version is not None else time.time_ns()
+
+def bump_auth_version(user_id):
+    """Invalidate every cached token of the user, in all processes"""
+    try:
+        cache.incr(auth_version_key(user_id))
+    except ValueError:
+        cache.set(auth_version_key(user_id), time.time_ns(), timeout=None)
+
+def token_cache_key(key):
+    # Keep raw tokens out of the shared cache's key space
+    return f'accounts:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+def forget_token(key):
+    cache.delete(token_cache_key(key))
+    with _lock:
+        _tokens.pop(key, None)
+
+# Process-local LRU of token key -> (user fields, token created, auth version, expiry)
+_tokens = OrderedDict()
+_lock = threading.Lock()
+
+def clear_local_tokens():
+    with _lock:
+        _tokens.clear()
+
+def build_user(values):
+    """A user instance with the given fields loaded and the rest deferred"""
+    model = get_user_model()
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(None, names, [values[name] for name in names])
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for ``TokenAuthentication`` that avoids the
+    token/user query on every request
+    """
+    def authenticate_credentials(self, key):
+        entry = self._get_local(key)
+        if entry is None:
+            entry = self._get_shared(key)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            # An edit racing this load is picked up once the entry expires
+            fields = tuple(getattr(user, name) for name in CACHED_USER_FIELDS)
+            entry = (fields, token.created, get_auth_version(user.pk))
+            cache.set(token_cache_key(key), entry, self.ttl)
+        self._set_local(key, entry)
+
+        fields, created, _ = entry
+        if not fields[CACHED_USER_FIELDS.index('is_active')]:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        # Fresh instances per request, as views may modify request.user
+        user = build_user(dict(zip(CACHED_USER_FIELDS, fields)))
+        token = self.get_model().from_db(None, ['key', 'user_id', 'created'], [key, user.pk, created])
+        return user, token
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'TOKEN_CACHE_TTL', DEFAULT_TOKEN_CACHE_TTL)
+
+    def _get_local(self, key):
+        with _lock:
+            cached = _tokens.get(key)
+            if cached is None:
+                return None
+            if cached[3] < time.monotonic():
+                del _tokens[key]
+                return None
+            _tokens.move_to_end(key)
+        fields, created, version, _ = cached
+        if version != get_auth_version(fields[0]):
+            return None
+        return fields, created, version
+
+    def _get_shared(self, key):
+        entry = cache.get(token_cache_key(key))
+        if entry is None:
+            return None
+        fields, created, version = entry
+        if version != get_auth_version(fields[0]):
+            return None
+        return entry
+
+    def _set_local(self, key, entry):
+        size = getattr(settings, 'TOKEN_CACHE_SIZE', DEFAULT_TOKEN_CACHE_SIZE)
+        with _lock:
+            _tokens[key] = (*entry, time.monotonic() + self.ttl)
+            _tokens.move_to_end(key)
+            while len(_tokens) > size:
+                _tokens.popitem(last=False)
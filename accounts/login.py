@@ -0,0 +1,92 @@
+"""
+Login under load.
+
+Password hashing is deliberately slow, so logins run it on a bounded thread
+pool (hashlib releases the GIL while hashing) instead of in request
+threads. When more logins are waiting than the pool can clear quickly the
+request is refused straight away with a 503, keeping workers free for
+everything else. Successful logins are remembered briefly so that repeat
+submissions of the same credentials return the existing token unhashed.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils.crypto import salted_hmac
+from rest_framework.authtoken.models import Token
+
+DEFAULT_RECENT_LOGIN_TTL = 60
+
+class LoginOverloaded(Exception):
+    """Raised when the hashing pool already has its maximum of pending logins"""
+
+class HashingPool:
+    """
+    Thread pool for credential checks with a cap on pending jobs
+    (queued plus running)
+    """
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash')
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise LoginOverloaded()
+            self.pending += 1
+        try:
+            # In the caller's context, like sync_to_async, so per-request state
+            # (e.g. the metrics query timer) follows the job onto the pool
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, func, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_hashing_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            workers = getattr(settings, 'LOGIN_HASH_WORKERS', None) or os.cpu_count() or 1
+            max_pending = getattr(settings, 'LOGIN_MAX_PENDING', None) or workers * 4
+            _pool = HashingPool(workers, max_pending)
+        return _pool
+
+def check_credentials(username, password):
+    """
+    Verify credentials and return ``(user, token key)``, or ``(None, None)``.
+    Runs on a pool thread, so it manages its own database connection.
+    """
+    close_old_connections()
+    try:
+        user = authenticate(username=username, password=password)
+        if user is None:
+            return None, None
+        token, _ = Token.objects.get_or_create(user=user)
+        return user, token.key
+    finally:
+        close_old_connections()
+
+def recent_login_key(username, password):
+    # Keyed HMAC: the cache never sees the password or a plain hash of it
+    digest = salted_hmac('accounts.recent-login', f'{username}\0{password}', algorithm='sha256').hexdigest()
+    return f'accounts:recent-login:{digest}'
+
+async def get_recent_login(username, password):
+    """``(user_id, token key, auth version)`` of a recent login with these credentials"""
+    return await cache.aget(recent_login_key(username, password))
+
+async def remember_login(username, password, user_id, token_key, auth_version):
+    ttl = getattr(settings, 'RECENT_LOGIN_TTL', DEFAULT_RECENT_LOGIN_TTL)
+    await cache.aset(recent_login_key(username, password), (user_id, token_key, auth_version), ttl)
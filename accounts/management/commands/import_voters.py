@@ -0,0 +1,110 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from accounts.models import RosterImport
+from accounts.roster import RosterImporter, DEFAULT_CHUNK_SIZE, file_checksum, open_text
+
+def _init_worker():
+    """Set Django up in pool workers started with the spawn method"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+class Command(BaseCommand):
+    help = 'Import voters from a CSV file, resuming an interrupted import of the same file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with username, email, first_name, last_name, phone_number, password')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Processes used to hash passwords'
+        )
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows per transaction')
+        parser.add_argument(
+            '--credentials',
+            help='Generate one-time passwords for rows without one and append them to this CSV'
+        )
+        parser.add_argument('--report', help='Write duplicate and invalid rows to this CSV')
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Start over instead of resuming an unfinished import of the same file'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'File {path} does not exist')
+
+        with open(path, 'rb') as f:
+            checksum = file_checksum(f)
+
+        roster_import = None
+        if not options['restart']:
+            roster_import = (
+                RosterImport.objects
+                .filter(checksum=checksum)
+                .exclude(status=RosterImport.Status.COMPLETED)
+                .order_by('-created_at')
+                .first()
+            )
+        if roster_import is not None:
+            self.stdout.write(f'Resuming import {roster_import.pk} after row {roster_import.rows_processed}')
+        else:
+            roster_import = RosterImport.objects.create(source=os.path.abspath(path), checksum=checksum)
+            self.stdout.write(f'Started import {roster_import.pk}')
+
+        credentials = open(options['credentials'], 'a', newline='') if options['credentials'] else None
+        report = open(options['report'], 'a', newline='') if options['report'] else None
+        credentials_writer = csv.writer(credentials) if credentials else None
+        report_writer = csv.writer(report) if report else None
+        executor = None
+        if options['workers'] > 1:
+            executor = ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker)
+            # Start the workers now, with no database connection open for
+            # them to inherit; they only hash passwords
+            connections.close_all()
+            executor.submit(int).result()
+
+        def on_progress(progress):
+            if credentials:
+                credentials.flush()
+            self.stdout.write(
+                f'  {progress.rows_processed} rows: {progress.created_count} created, '
+                f'{progress.duplicate_count} duplicates, {progress.invalid_count} invalid'
+            )
+
+        importer = RosterImporter(
+            roster_import,
+            executor=executor,
+            chunk_size=options['chunk_size'],
+            on_credentials=(lambda *row: credentials_writer.writerow(row)) if credentials else None,
+            on_issue=(lambda *row: report_writer.writerow(row)) if report else None,
+            on_progress=on_progress,
+        )
+        try:
+            with open(path, 'rb') as f:
+                importer.run(open_text(f))
+        except Exception as e:
+            raise CommandError(f'Import {roster_import.pk} stopped at row {roster_import.rows_processed}: {str(e)}')
+        finally:
+            if executor:
+                executor.shutdown()
+            for f in (credentials, report):
+                if f:
+                    f.close()
+
+        if roster_import.status == RosterImport.Status.FAILED:
+            raise CommandError(roster_import.error)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Import {roster_import.pk} completed: {roster_import.created_count} voters created, '
+                f'{roster_import.duplicate_count} duplicates, {roster_import.invalid_count} invalid rows'
+            )
+        )
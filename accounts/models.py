@@ -23,4 +23,33 @@ class User(AbstractUser):
         return self.role == self.Role.ADMIN or self.is_superuser
     
     def is_voter(self):
-        return self.role == self.Role.VOTER
\ No newline at end of file
+        return self.role == self.Role.VOTER
+class RosterImport(models.Model):
+    """
+    A bulk voter import from a CSV file. ``rows_processed`` is the
+    checkpoint: it only moves forward once a chunk of rows is committed,
+    so an interrupted import resumes from there.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', _('Pending')
+        RUNNING = 'RUNNING', _('Running')
+        COMPLETED = 'COMPLETED', _('Completed')
+        FAILED = 'FAILED', _('Failed')
+    
+    file = models.FileField(upload_to='roster-imports/', blank=True,
+                            help_text=_("CSV with username, email, first_name, last_name, phone_number and optional password columns"))
+    source = models.CharField(max_length=255, blank=True, help_text=_("Path the file was imported from"))
+    checksum = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    duplicate_count = models.PositiveIntegerField(default=0)
+    invalid_count = models.PositiveIntegerField(default=0)
+    issues = models.JSONField(default=list, blank=True, help_text=_("First problems found, as row number and reason"))
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Roster import {self.pk} ({self.get_status_display()})"
@@ -0,0 +1,198 @@
+"""
+Streaming voter roster import.
+
+The CSV is read one chunk of rows at a time. Each chunk is validated,
+checked for duplicates, has its passwords hashed in parallel, and is written
+(users, their API tokens and the import checkpoint) in one transaction, so
+memory use doesn't grow with the file and a rerun picks up after the last
+committed chunk.
+"""
+import csv
+import hashlib
+import io
+import itertools
+import secrets
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from .models import User, RosterImport
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_RECORDED_ISSUES = 1000
+
+FIELDS = ('username', 'email', 'first_name', 'last_name', 'phone_number', 'password')
+
+def file_checksum(stream, block_size=1 << 20):
+    """sha256 of a binary stream, read in blocks; rewinds the stream"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def generate_password():
+    return secrets.token_urlsafe(9)
+
+def _clean_row(row):
+    """Validated user fields of a CSV row, or raise ValidationError"""
+    data = {field: (row.get(field) or '').strip() for field in FIELDS}
+    if not data['username']:
+        raise ValidationError("username is required")
+    User.username_validator(data['username'])
+    if len(data['username']) > User._meta.get_field('username').max_length:
+        raise ValidationError("username is too long")
+    if data['email']:
+        validate_email(data['email'])
+    if len(data['phone_number']) > User._meta.get_field('phone_number').max_length:
+        raise ValidationError("phone_number is too long")
+    return data
+
+class RosterImporter:
+    """
+    Runs (or resumes) a ``RosterImport``.
+
+    ``executor`` is any ``concurrent.futures`` executor used for password
+    hashing. ``on_credentials(username, password)`` receives generated
+    one-time passwords; without it, rows that have no password get an
+    unusable one, or are reported as invalid if ``require_passwords``.
+    """
+    def __init__(self, roster_import, executor=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 on_credentials=None, on_issue=None, on_progress=None, require_passwords=False):
+        self.roster_import = roster_import
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.on_credentials = on_credentials
+        self.require_passwords = require_passwords
+        self.on_issue = on_issue
+        self.on_progress = on_progress
+
+    def run(self, text_stream):
+        roster_import = self.roster_import
+        roster_import.status = RosterImport.Status.RUNNING
+        roster_import.error = ''
+        roster_import.save(update_fields=['status', 'error', 'updated_at'])
+
+        reader = csv.DictReader(text_stream)
+        if reader.fieldnames is None or 'username' not in reader.fieldnames:
+            return self._fail("The CSV needs a header row with at least a 'username' column")
+
+        # Row numbers count the header as line 1, as spreadsheets do
+        rows = enumerate(reader, start=2)
+        # Resume: skip rows committed by an earlier run without re-validating them
+        rows = itertools.islice(rows, roster_import.rows_processed, None)
+        try:
+            while chunk := list(itertools.islice(rows, self.chunk_size)):
+                self._import_chunk(chunk)
+                if self.on_progress:
+                    self.on_progress(roster_import)
+        except Exception as e:
+            self._fail(str(e))
+            raise
+
+        roster_import.status = RosterImport.Status.COMPLETED
+        roster_import.finished_at = timezone.now()
+        roster_import.save(update_fields=['status', 'finished_at', 'updated_at'])
+        return roster_import
+
+    def _fail(self, error):
+        self.roster_import.status = RosterImport.Status.FAILED
+        self.roster_import.error = error
+        self.roster_import.save(update_fields=['status', 'error', 'updated_at'])
+        return self.roster_import
+
+    def _issue(self, line, reason, kind):
+        roster_import = self.roster_import
+        if kind == 'duplicate':
+            roster_import.duplicate_count += 1
+        else:
+            roster_import.invalid_count += 1
+        if len(roster_import.issues) < MAX_RECORDED_ISSUES:
+            roster_import.issues.append({'row': line, 'reason': reason})
+        if self.on_issue:
+            self.on_issue(line, kind, reason)
+
+    def _import_chunk(self, chunk):
+        valid = []
+        for line, row in chunk:
+            try:
+                data = _clean_row(row)
+                if self.require_passwords and not data['password'] and not self.on_credentials:
+                    raise ValidationError("password is required")
+                valid.append((line, data))
+            except ValidationError as e:
+                self._issue(line, '; '.join(e.messages), 'invalid')
+
+        # Duplicates: within this chunk, or against rows already stored
+        usernames = {data['username'] for _, data in valid}
+        emails = {data['email'].lower() for _, data in valid if data['email']}
+        taken_usernames = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        # Emails are compared case-insensitively on both sides
+        taken_emails = set(
+            User.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in=emails).values_list('email_lower', flat=True)
+        ) if emails else set()
+
+        rows = []
+        for line, data in valid:
+            email = data['email'].lower()
+            if data['username'] in taken_usernames:
+                self._issue(line, f"username '{data['username']}' already exists", 'duplicate')
+            elif email and email in taken_emails:
+                self._issue(line, f"email '{data['email']}' already exists", 'duplicate')
+            else:
+                taken_usernames.add(data['username'])
+                if email:
+                    taken_emails.add(email)
+                rows.append(data)
+
+        generated = {}
+        for data in rows:
+            if not data['password'] and self.on_credentials:
+                data['password'] = generated[data['username']] = generate_password()
+
+        to_hash = [data['password'] for data in rows if data['password']]
+        if self.executor is not None and to_hash:
+            hashes = iter(self.executor.map(make_password, to_hash, chunksize=max(1, len(to_hash) // 16)))
+        else:
+            hashes = iter(map(make_password, to_hash))
+
+        users = [
+            User(
+                username=data['username'],
+                email=data['email'],
+                first_name=data['first_name'],
+                last_name=data['last_name'],
+                phone_number=data['phone_number'] or None,
+                role=User.Role.VOTER,
+                # None gives an unusable password
+                password=next(hashes) if data['password'] else make_password(None),
+            )
+            for data in rows
+        ]
+
+        # Hand out generated passwords before committing: if the commit
+        # fails, a resumed import issues new ones and the later entry wins
+        for username, password in generated.items():
+            self.on_credentials(username, password)
+
+        roster_import = self.roster_import
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            if users and users[0].pk is None:
+                # Backends that can't return ids from a bulk insert
+                users = list(User.objects.filter(username__in=[user.username for user in users]))
+            Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+
+            roster_import.rows_processed += len(chunk)
+            roster_import.created_count += len(users)
+            roster_import.save(update_fields=[
+                'rows_processed', 'created_count', 'duplicate_count', 'invalid_count', 'issues', 'updated_at',
+            ])
+
+def open_text(binary_stream):
+    """Text view of an uploaded or local binary CSV file (BOM tolerant)"""
+    return io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
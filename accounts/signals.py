@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import bump_auth_version, forget_token
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """
+    Drop cached authentication for a user whenever they change, so
+    deactivation and role changes apply on the next request. Bumped once
+    the change is committed, so a request can't cache the old row under
+    the new version.
+    """
+    user_id = instance.pk
+    transaction.on_commit(lambda: bump_auth_version(user_id))
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_auth_version(user_id))
@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from celery import shared_task
+from .models import RosterImport
+from .roster import RosterImporter, open_text
+
+@shared_task
+def import_roster(roster_import_id):
+    """
+    Run or resume an uploaded roster import. Celery workers are daemonic
+    and can't start a process pool, so passwords are hashed on threads
+    (hashlib releases the GIL while hashing). Nobody is there to receive
+    generated passwords, so rows without one are rejected.
+    """
+    roster_import = RosterImport.objects.get(pk=roster_import_id)
+    if roster_import.status == RosterImport.Status.COMPLETED:
+        return f"Roster import {roster_import_id} already completed"
+    
+    with ThreadPoolExecutor() as executor, roster_import.file.open('rb') as f:
+        RosterImporter(roster_import, executor=executor, require_passwords=True).run(open_text(f))
+    
+    return (
+        f"Roster import {roster_import_id}: {roster_import.created_count} created, "
+        f"{roster_import.duplicate_count} duplicates, {roster_import.invalid_count} invalid"
+    )
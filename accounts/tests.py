@@ -1,3 +1,268 @@
-from django.test import TestCase
+from django.core.cache import cache
+import io
+import shutil
+import tempfile
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from asgiref.sync import iscoroutinefunction
+from .authentication import CachedTokenAuthentication, clear_local_tokens, get_auth_version, token_cache_key
+from .login import HashingPool, check_credentials
+from .models import User, RosterImport
+from .roster import RosterImporter
+from .views import LoginView
 
-# Create your tests here.
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_tokens()
+        self.user = User.objects.create_user('voter')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('user-detail')
+
+    def test_resolved_tokens_skip_the_database(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_role_change_and_deactivation_apply_immediately(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.role = User.Role.ADMIN
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).json()['role'], 'ADMIN')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_cached_entries_leave_out_the_password(self):
+        self.client.get(self.url)
+
+        fields, _, _ = cache.get(token_cache_key(self.token.key))
+        self.assertNotIn(self.user.password, fields)
+
+        user, token = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual((user.pk, user.role, token.user_id), (self.user.pk, User.Role.VOTER, self.user.pk))
+        self.assertIn('password', user.get_deferred_fields())
+
+    def test_auth_version_moves_only_once_changes_commit(self):
+        version = get_auth_version(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            # Other requests still see the committed row, so entries they
+            # cache now must stay under the old version
+            self.assertEqual(get_auth_version(self.user.pk), version)
+
+        self.assertNotEqual(get_auth_version(self.user.pk), version)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class LoginTests(TransactionTestCase):
+    # Credentials are checked on pool threads, which need committed data
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('voter', password='correct-horse')
+        self.client = APIClient()
+        self.url = reverse('login')
+
+    def login(self, password='correct-horse'):
+        return self.client.post(self.url, {'username': 'voter', 'password': password}, format='json')
+
+    def test_repeat_login_reuses_token_without_rehashing(self):
+        with mock.patch('accounts.views.check_credentials', wraps=check_credentials) as check:
+            first = self.login()
+            second = self.login()
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['token'], second.json()['token'])
+        self.assertEqual(check.call_count, 1)
+
+    def test_password_change_invalidates_remembered_login(self):
+        self.login()
+
+        self.user.set_password('new-password')
+        self.user.save()
+
+        self.assertEqual(self.login().status_code, 401)
+        self.assertEqual(self.login('new-password').status_code, 200)
+
+    def test_full_pool_sheds_load_with_retry_after(self):
+        with mock.patch('accounts.views.get_hashing_pool', return_value=HashingPool(1, 0)):
+            response = self.login()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_login_keeps_the_drf_request_contract(self):
+        self.assertTrue(iscoroutinefunction(LoginView.as_view()))
+
+        malformed = self.client.post(self.url, '{"username":', content_type='application/json')
+        form = self.client.post(self.url, {'username': 'voter', 'password': 'correct-horse'})
+        missing = self.client.post(self.url, {'username': 'voter'}, format='json')
+
+        self.assertEqual(malformed.status_code, 400)
+        self.assertIn('JSON parse error', malformed.json()['detail'])
+        self.assertEqual(form.status_code, 415)
+        self.assertEqual(missing.json(), {'password': ['This field is required.']})
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RosterImportTests(TestCase):
+    csv = (
+        "username,email,first_name,last_name,password\n"
+        "ann,ann@example.com,Ann,A,secret-1\n"
+        "bob,bob@example.com,Bob,B,\n"
+        "ann,other@example.com,Ann,A,secret-2\n"
+        "not valid,x@example.com,X,X,\n"
+        "cat,cat@example.com,Cat,C,\n"
+    )
+
+    def test_import_creates_users_with_tokens_and_reports_bad_rows(self):
+        credentials = {}
+        roster_import = RosterImport.objects.create(source='roster.csv')
+
+        RosterImporter(roster_import, chunk_size=2, on_credentials=credentials.__setitem__).run(io.StringIO(self.csv))
+
+        roster_import.refresh_from_db()
+        self.assertEqual(roster_import.status, RosterImport.Status.COMPLETED)
+        self.assertEqual((roster_import.created_count, roster_import.duplicate_count, roster_import.invalid_count), (3, 1, 1))
+        self.assertEqual(sorted(issue['row'] for issue in roster_import.issues), [4, 5])
+        self.assertEqual(set(credentials), {'bob', 'cat'})
+        self.assertTrue(User.objects.get(username='ann').check_password('secret-1'))
+        self.assertTrue(User.objects.get(username='bob').check_password(credentials['bob']))
+        self.assertEqual(User.objects.filter(auth_token__isnull=False).count(), 3)
+
+    def test_interrupted_import_resumes_from_checkpoint(self):
+        roster_import = RosterImport.objects.create(source='roster.csv')
+
+        def interrupt(progress):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            RosterImporter(roster_import, chunk_size=2, on_progress=interrupt).run(io.StringIO(self.csv))
+        roster_import.refresh_from_db()
+        self.assertEqual(roster_import.rows_processed, 2)
+
+        RosterImporter(roster_import, chunk_size=2).run(io.StringIO(self.csv))
+
+        roster_import.refresh_from_db()
+        self.assertEqual(roster_import.rows_processed, 5)
+        self.assertEqual((roster_import.created_count, roster_import.duplicate_count), (3, 1))
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+
+    def test_emails_are_duplicates_whatever_their_case(self):
+        User.objects.create_user('existing', email='Ann@Example.com')
+        roster_import = RosterImport.objects.create(source='roster.csv')
+
+        RosterImporter(roster_import).run(io.StringIO(
+            "username,email\n"
+            "ann,ann@example.com\n"
+            "dan,dan@example.com\n"
+            "dan2,DAN@example.com\n"
+        ))
+
+        roster_import.refresh_from_db()
+        self.assertEqual((roster_import.created_count, roster_import.duplicate_count), (1, 2))
+        self.assertEqual([issue['row'] for issue in roster_import.issues], [2, 4])
+
+    def test_rows_without_password_are_rejected_when_passwords_are_required(self):
+        roster_import = RosterImport.objects.create(source='roster.csv')
+
+        RosterImporter(roster_import, require_passwords=True).run(io.StringIO(self.csv))
+
+        roster_import.refresh_from_db()
+        self.assertEqual((roster_import.created_count, roster_import.invalid_count), (1, 3))
+        self.assertIn({'row': 3, 'reason': 'password is required'}, roster_import.issues)
+        self.assertTrue(User.objects.get(username='ann').has_usable_password())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+@mock.patch('accounts.admin.import_roster.delay', side_effect=OSError('broker down'))
+class RosterImportAdminTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(User.objects.create_superuser('root', 'root@example.com', 'pw'))
+
+    def messages(self, response):
+        return [(m.level_tag, m.message) for m in get_messages(response.wsgi_request)]
+
+    def test_upload_reports_a_broker_failure(self, delay):
+        with self.assertLogs('accounts.admin', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('admin:accounts_rosterimport_add'),
+                {'file': SimpleUploadedFile('roster.csv', b'username,email\n')},
+            )
+
+        roster_import = RosterImport.objects.get()
+        self.assertEqual(response.status_code, 302)
+        delay.assert_called_once_with(roster_import.pk)
+        levels = [level for level, _ in self.messages(response)]
+        self.assertIn('error', levels)
+        self.assertNotIn('info', levels)
+
+    def test_resume_reports_a_broker_failure(self, delay):
+        roster_import = RosterImport.objects.create(source='roster.csv', file='roster-imports/roster.csv')
+
+        with self.assertLogs('accounts.admin', 'ERROR'):
+            response = self.client.post(
+                reverse('admin:accounts_rosterimport_changelist'),
+                {'action': 'resume_roster_import_action', '_selected_action': [roster_import.pk]},
+            )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([level for level, _ in self.messages(response)], ['error'])
+        roster_import.refresh_from_db()
+        self.assertEqual(roster_import.status, RosterImport.Status.PENDING)
+
+    def test_resume_claims_imports_once(self, delay):
+        delay.side_effect = None
+        running = RosterImport.objects.create(source='a.csv', file='roster-imports/a.csv',
+                                              status=RosterImport.Status.RUNNING)
+        failed = RosterImport.objects.create(source='b.csv', file='roster-imports/b.csv',
+                                             status=RosterImport.Status.FAILED)
+
+        def resume():
+            return self.client.post(
+                reverse('admin:accounts_rosterimport_changelist'),
+                {'action': 'resume_roster_import_action', '_selected_action': [running.pk, failed.pk]},
+            )
+
+        self.assertEqual(sorted(level for level, _ in self.messages(resume())), ['success', 'warning'])
+        delay.assert_called_once_with(failed.pk)
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, RosterImport.Status.RUNNING)
+
+        # Both are running now; once one stalls it can be resumed again
+        resume()
+        self.assertEqual(delay.call_count, 1)
+        RosterImport.objects.filter(pk=running.pk).update(updated_at=timezone.now() - timezone.timedelta(hours=1))
+        resume()
+        delay.assert_called_with(running.pk)
+        self.assertEqual(delay.call_count, 2)
@@ -1,11 +1,16 @@
+import asyncio
+from asgiref.sync import sync_to_async
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
-from django.contrib.auth import authenticate
+from django.conf import settings
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from .serializers import UserSerializer, RegisterSerializer, LoginSerializer
+from .authentication import CachedTokenAuthentication, get_auth_version
+from .login import LoginOverloaded, get_hashing_pool, check_credentials, get_recent_login, remember_login
 from drf_spectacular.utils import extend_schema
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -28,35 +33,104 @@ class RegisterView(generics.CreateAPIView):
             "token": token.key
         }, status=status.HTTP_201_CREATED)
 
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers may be coroutines. Parsing, authentication,
+    permissions, throttling and exception handling are DRF's own; the
+    checks that touch the database or cache run via sync_to_async.
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
 @method_decorator(csrf_exempt, name='dispatch')
-class LoginView(APIView):
+class LoginView(AsyncAPIView):
+    """
+    Authenticate a user and return a token.
+
+    Async so that a request waiting for password hashing doesn't hold a
+    worker; hashing runs on the bounded pool in accounts.login, and repeat
+    submissions of recently verified credentials skip it entirely. Under
+    ASGI, Django runs sync-only middleware (WhiteNoise) through a thread
+    per request, which the login then holds while it waits; everything
+    else in the stack is async-capable.
+    """
     permission_classes = [permissions.AllowAny]
     serializer_class = LoginSerializer
     
     @extend_schema(
         summary="Login user",
-        description="Authenticate a user and return a token",
+        description="Authenticate a user and return a token. Answers 503 with Retry-After when too many "
+                    "logins are already being checked.",
         responses={200: {"type": "object", "properties": {"token": {"type": "string"}}}}
     )
-    def post(self, request):
+    async def post(self, request):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
+        username = serializer.validated_data['username']
+        password = serializer.validated_data['password']
+        
+        recent = await get_recent_login(username, password)
+        if recent is not None:
+            user = await sync_to_async(self.resolve_recent_login)(*recent)
+            if user is not None:
+                return self.login_response(user, recent[1])
         
-        user = authenticate(
-            username=serializer.validated_data['username'],
-            password=serializer.validated_data['password']
-        )
+        try:
+            user, token_key = await get_hashing_pool().run(check_credentials, username, password)
+        except LoginOverloaded:
+            return Response(
+                {"error": "Too many logins in progress, please try again shortly"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(getattr(settings, 'LOGIN_RETRY_AFTER', 2))}
+            )
         
-        if user:
-            token, created = Token.objects.get_or_create(user=user)
-            return Response({
-                "user": UserSerializer(user).data,
-                "token": token.key
-            })
-        return Response(
-            {"error": "Invalid credentials"}, 
-            status=status.HTTP_401_UNAUTHORIZED
-        )
+        if user is None:
+            return Response(
+                {"error": "Invalid credentials"}, 
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        
+        auth_version = await sync_to_async(get_auth_version)(user.pk)
+        await remember_login(username, password, user.pk, token_key, auth_version)
+        return self.login_response(user, token_key)
+    
+    def resolve_recent_login(self, user_id, token_key, auth_version):
+        """
+        The user behind a remembered login, or None if the token was revoked
+        or the user changed (e.g. new password) since
+        """
+        try:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(token_key)
+        except AuthenticationFailed:
+            return None
+        if user.pk != user_id or get_auth_version(user_id) != auth_version:
+            return None
+        return user
+    
+    def login_response(self, user, token_key):
+        return Response({
+            "user": UserSerializer(user).data,
+            "token": token_key
+        })
 
 class UserDetailView(generics.RetrieveAPIView):
     serializer_class = UserSerializer
@@ -2,6 +2,7 @@
 ASGI config for voting_system_project project of alx-project-nexus.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve through it to use the streaming endpoints in ``polls.streams``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'drf_spectacular',
     'corsheaders',
+    'django_filters',
     
     # Local apps
     'accounts',
@@ -48,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.metrics.MetricsMiddleware',
+    'polls.routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -91,36 +94,35 @@ WSGI_APPLICATION = 'alx-project-nexus.wsgi.application'
 
 # load_dotenv()
 
-
-# # Database configuration
-# if os.getenv('DATABASE_URL'):
-#     # Production database configuration
-#     DATABASES = {
-#         'default': dj_database_url.config(
-#             default=os.getenv('DATABASE_URL'),
-#             conn_max_age=600,
-#             conn_health_checks=True,
-#         )
-#     }
-# else:
-#     Development database configuration (SQLite)
+# DATABASE_URL selects the primary database (a local SQLite file by
+# default). Connections are kept open for DB_CONN_MAX_AGE seconds and
+# checked before being reused.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '600'))
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': dj_database_url.config(
+        default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
 }
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': os.getenv('DB_ENGINE'),
-#         'NAME': os.getenv('DB_NAME'),
-#         'USER': os.getenv('DB_USER'),
-#         'PASSWORD': os.getenv('DB_PASSWORD'),
-#         'HOST': os.getenv('DB_HOST'),
-#         'PORT': os.getenv('DB_PORT'),
-#     }
-# }
+# Read replicas: comma-separated database URLs. Read-only requests (GET,
+# HEAD, OPTIONS) read polls and results from them, see polls.routing;
+# everything else uses the primary. Two SQLite files work for local testing.
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(',')), start=1):
+    alias = f'replica{index}'
+    DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True)
+    # Tests read the primary through the replica connections
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['polls.routing.ReplicaRouter']
+# Seconds a user's reads stay on the primary after they write (vote, edit),
+# so they see their own changes despite replication lag
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '15'))
+# Seconds an unreachable replica is skipped before it is tried again
+REPLICA_RETRY_SECONDS = int(os.getenv('REPLICA_RETRY_SECONDS', '30'))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -164,6 +166,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Serve MEDIA_URL from Django (with long-lived cache headers for picture variants)
+SERVE_MEDIA = os.getenv('SERVE_MEDIA', str(DEBUG)).lower() in ('true', '1', 'yes', 'on')
+# Square sizes, in pixels, generated for candidate pictures
+CANDIDATE_IMAGE_WIDTHS = (96, 150, 300)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -172,11 +178,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Custom user model
 AUTH_USER_MODEL = 'accounts.User'
+# Seconds without progress after which a running roster import counts as
+# interrupted and can be resumed from the admin
+ROSTER_IMPORT_STALE_AFTER = int(os.getenv('ROSTER_IMPORT_STALE_AFTER', '900'))
 
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -236,3 +245,140 @@ CELERY_TIMEZONE = TIME_ZONE
 # Disable Celery if Redis is not available
 CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False').lower() in ('true', '1', 'yes', 'on')
 CELERY_TASK_EAGER_PROPAGATES = True
+
+# Vote tallies
+# Each candidate's running count is spread across this many shard rows so
+# concurrent votes don't serialize on a single counter row
+VOTE_TALLY_SHARDS = int(os.getenv('VOTE_TALLY_SHARDS', '8'))
+
+# Cache
+# Shared cache for rendered poll payloads; falls back to per-process memory
+# when no cache server is configured
+CACHE_URL = os.getenv('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a rendered poll detail payload is shared before being rebuilt
+POLL_DETAIL_CACHE_TIMEOUT = int(os.getenv('POLL_DETAIL_CACHE_TIMEOUT', '300'))
+# Seconds each process keeps a poll's ballot metadata for vote validation
+# before re-reading it, even if no edit was signalled
+BALLOT_METADATA_TTL = int(os.getenv('BALLOT_METADATA_TTL', '60'))
+
+# Vote ingestion
+# 'sync' writes each vote in the request; 'queued' acknowledges validated
+# votes immediately and writes them in batches from a Celery consumer
+VOTE_INGESTION_MODE = os.getenv('VOTE_INGESTION_MODE', 'sync')
+# redis://... in production; memory:// keeps the queue in-process, so queued
+# mode refuses it unless CELERY_TASK_ALWAYS_EAGER runs tasks in-process (tests)
+VOTE_INGESTION_QUEUE_URL = os.getenv('VOTE_INGESTION_QUEUE_URL', 'memory://')
+VOTE_INGESTION_BATCH_SIZE = int(os.getenv('VOTE_INGESTION_BATCH_SIZE', '500'))
+# Seconds between queue drains
+VOTE_INGESTION_FLUSH_INTERVAL = float(os.getenv('VOTE_INGESTION_FLUSH_INTERVAL', '1.0'))
+# Seconds before votes claimed by a drain that never acked them are redelivered
+VOTE_INGESTION_CLAIM_TIMEOUT = int(os.getenv('VOTE_INGESTION_CLAIM_TIMEOUT', '300'))
+# Seconds after a poll ends before its results are frozen, so queued votes can drain
+VOTE_INGESTION_CLOSE_GRACE = int(os.getenv('VOTE_INGESTION_CLOSE_GRACE', '30'))
+
+# Turnout rollups
+# Seconds between runs of the job adding new votes to the per-minute
+# turnout buckets
+TURNOUT_ROLLUP_INTERVAL = float(os.getenv('TURNOUT_ROLLUP_INTERVAL', '30'))
+# Seconds a vote id must have been visible before it is rolled up, so
+# slower transactions holding lower ids have committed
+TURNOUT_ROLLUP_SETTLE = float(os.getenv('TURNOUT_ROLLUP_SETTLE', '5'))
+# Votes read per rollup transaction
+TURNOUT_ROLLUP_BATCH_SIZE = int(os.getenv('TURNOUT_ROLLUP_BATCH_SIZE', '10000'))
+
+# Poll lifecycle timers
+# Seconds between sweeps for due poll openings and closings
+POLL_TIMER_SWEEP_INTERVAL = float(os.getenv('POLL_TIMER_SWEEP_INTERVAL', '15'))
+# Timers run per sweep; the rest wait for the next one
+POLL_TIMER_SWEEP_LIMIT = int(os.getenv('POLL_TIMER_SWEEP_LIMIT', '500'))
+# Failed timers are retried with a growing delay, then marked failed
+POLL_TIMER_MAX_ATTEMPTS = int(os.getenv('POLL_TIMER_MAX_ATTEMPTS', '5'))
+
+CELERY_BEAT_SCHEDULE = {
+    'sweep-poll-timers': {
+        'task': 'polls.tasks.sweep_poll_timers',
+        'schedule': POLL_TIMER_SWEEP_INTERVAL,
+    },
+    'roll-up-turnout': {
+        'task': 'polls.tasks.roll_up_turnout',
+        'schedule': TURNOUT_ROLLUP_INTERVAL,
+    },
+}
+if VOTE_INGESTION_MODE == 'queued':
+    CELERY_BEAT_SCHEDULE['drain-vote-queue'] = {
+        'task': 'polls.tasks.drain_vote_queue',
+        'schedule': VOTE_INGESTION_FLUSH_INTERVAL,
+    }
+
+# Live results stream
+# redis://... shares vote events across processes; memory:// keeps them in-process
+RESULTS_BUS_URL = os.getenv('RESULTS_BUS_URL', 'memory://')
+# Seconds between keep-alive comments on idle streams
+RESULTS_STREAM_HEARTBEAT_INTERVAL = int(os.getenv('RESULTS_STREAM_HEARTBEAT_INTERVAL', '15'))
+# Seconds between full snapshot recomputations for streamed polls
+RESULTS_STREAM_RESYNC_INTERVAL = int(os.getenv('RESULTS_STREAM_RESYNC_INTERVAL', '30'))
+# Seconds a stream token from /results/stream/token/ can be used to connect
+RESULTS_STREAM_TOKEN_MAX_AGE = int(os.getenv('RESULTS_STREAM_TOKEN_MAX_AGE', '60'))
+
+# Email
+# Results notifications go out through this backend; the console backend
+# prints them during development
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '25'))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False').lower() in ('true', '1', 'yes', 'on')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@example.com')
+# Voters per notification batch; each batch is one task and one SMTP connection
+RESULTS_NOTIFICATION_CHUNK_SIZE = int(os.getenv('RESULTS_NOTIFICATION_CHUNK_SIZE', '500'))
+# Seconds after which a batch claimed by a worker that never finished it may be sent again
+RESULTS_NOTIFICATION_CLAIM_TIMEOUT = int(os.getenv('RESULTS_NOTIFICATION_CLAIM_TIMEOUT', '900'))
+
+# Metrics
+# Per-view request timings, query counts and Celery task timings, exposed
+# at /api/metrics/ in the Prometheus text format; opt in with METRICS_ENABLED
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False').lower() in ('true', '1', 'yes', 'on')
+# Scrapers must send "Authorization: Bearer <token>" or connect from one of
+# the METRICS_ALLOWED_IPS addresses or networks (comma separated, e.g.
+# "10.0.0.0/8,127.0.0.1"); anyone else is refused unless DEBUG is on
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+# Seconds between each process publishing its totals to the shared cache
+METRICS_PUBLISH_INTERVAL = int(os.getenv('METRICS_PUBLISH_INTERVAL', '10'))
+
+# Token authentication cache
+# Resolved tokens kept per process (LRU) and in the shared cache
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+# Seconds a resolved token is trusted before it is looked up again
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '300'))
+
+# Login
+# Threads that hash passwords for logins (defaults to the CPU count)
+LOGIN_HASH_WORKERS = int(os.getenv('LOGIN_HASH_WORKERS', '0')) or None
+# Logins allowed to wait for or run on the pool before new ones get a 503
+# (defaults to four per worker)
+LOGIN_MAX_PENDING = int(os.getenv('LOGIN_MAX_PENDING', '0')) or None
+# Retry-After seconds sent with those 503s
+LOGIN_RETRY_AFTER = int(os.getenv('LOGIN_RETRY_AFTER', '2'))
+# Seconds a successful login is remembered for repeat submissions
+RECENT_LOGIN_TTL = int(os.getenv('RECENT_LOGIN_TTL', '60'))
+
+# Admin
+# Vote and candidate lists skip COUNT(*) when PostgreSQL estimates more rows
+# than this, and show the estimate instead
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', '100000'))
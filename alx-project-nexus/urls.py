@@ -1,8 +1,8 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.views.generic import TemplateView
 from django.conf import settings
-from django.conf.urls.static import static
+from polls.images import serve_media
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 urlpatterns = [
@@ -26,6 +26,8 @@ urlpatterns = [
     path('register.html', TemplateView.as_view(template_name='register.html'), name='register-page'),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Serve media files in development, or when no web server or CDN fronts them
+if settings.SERVE_MEDIA:
+    urlpatterns += [
+        re_path(rf'^{settings.MEDIA_URL.strip("/")}/(?P<path>.*)$', serve_media, name='media'),
+    ]
\ No newline at end of file
@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.contrib import messages
 from django.utils import timezone
-from django.db.models import Count
-from .models import Poll, Position, Candidate, Vote
+from .models import Poll, Position, Candidate, Vote, PollResultSnapshot, ResultNotificationBatch, PollTimer
+from .results import freeze_poll_results
+from .exports import export_response
+from .pagination import EstimatedCountPaginator
 
 class PositionInline(admin.TabularInline):
     model = Position
@@ -21,29 +23,17 @@ def calculate_poll_results_action(modeladmin, request, queryset):
             continue
         
         try:
-            results = {}
-            
-            # Calculate results for each position
-            for position in poll.positions.all():
-                candidates = position.candidates.annotate(
-                    vote_count=Count('votes')
-                ).order_by('-vote_count')
-                
-                winner = candidates.first()
-                
-                if winner and winner.vote_count > 0:
-                    results[position.title] = {
-                        'winner': winner.name,
-                        'vote_count': winner.vote_count,
-                    }
-            
-            # Update poll status to 'Ended'
-            poll.status = 'Ended'
-            poll.save()
+            # Freeze the final results; later reads are served from the snapshot
+            snapshot = freeze_poll_results(poll)
+            if snapshot is None:
+                messages.warning(request, f'Poll "{poll.title}" still has queued votes to write, try again shortly')
+                continue
+            decided = sum(1 for position in snapshot.results['positions'] if position['winner'])
             
             messages.success(
                 request, 
-                f'Results calculated for poll "{poll.title}". Status updated to Ended.'
+                f'Results calculated for poll "{poll.title}": {snapshot.turnout} voters, '
+                f'{decided} positions decided.'
             )
             
         except Exception as e:
@@ -54,6 +44,35 @@ def calculate_poll_results_action(modeladmin, request, queryset):
 
 calculate_poll_results_action.short_description = "Calculate poll results"
 
+def export_action(table, output, gzip=False):
+    """Admin action streaming the selected polls' votes or tallies"""
+    def action(modeladmin, request, queryset):
+        return export_response(list(queryset.values_list('id', flat=True)), table=table, output=output, gzip=gzip)
+    
+    action.__name__ = f'export_{table}_{output}'
+    action.short_description = f"Export {table} as {output.upper()}" + (" (gzipped)" if gzip else "")
+    return action
+
+class PollPositionFilter(admin.SimpleListFilter):
+    """
+    Positions of the poll chosen in the poll filter. Listing every position
+    of every poll doesn't scale; use search or autocomplete to find others.
+    """
+    title = 'position'
+    parameter_name = 'position'
+    poll_parameter = 'position__poll__id__exact'
+    
+    def lookups(self, request, model_admin):
+        poll_id = request.GET.get(self.poll_parameter, '')
+        if not poll_id.isdigit():
+            return ()
+        return Position.objects.filter(poll_id=poll_id).order_by('id').values_list('id', 'title')
+    
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(position_id=self.value())
+        return queryset
+
 @admin.register(Poll)
 class PollAdmin(admin.ModelAdmin):
     list_display = ('title', 'start_time', 'duration', 'status')
@@ -61,7 +80,12 @@ class PollAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description')
     inlines = [PositionInline]
     readonly_fields = ('status',)
-    actions = [calculate_poll_results_action]
+    actions = [
+        calculate_poll_results_action,
+        export_action('votes', 'csv', gzip=True),
+        export_action('votes', 'ndjson', gzip=True),
+        export_action('tallies', 'csv'),
+    ]
     
     def status(self, obj):
         return obj.status
@@ -70,24 +94,79 @@ class PollAdmin(admin.ModelAdmin):
 class PositionAdmin(admin.ModelAdmin):
     list_display = ('title', 'poll')
     list_filter = ('poll',)
-    search_fields = ('title', 'description')
+    search_fields = ('title', 'description', 'poll__title')
+    autocomplete_fields = ('poll',)
     inlines = [CandidateInline]
+    
+    def get_queryset(self, request):
+        # __str__ shows the poll title, including in autocomplete results
+        return super().get_queryset(request).select_related('poll')
 
 @admin.register(Candidate)
 class CandidateAdmin(admin.ModelAdmin):
     list_display = ('name', 'position', 'poll')
-    list_filter = ('position', 'position__poll')
-    search_fields = ('name', 'description')
+    list_filter = ('position__poll', PollPositionFilter)
+    list_select_related = ('position__poll',)
+    search_fields = ('name', 'description', 'position__title')
+    autocomplete_fields = ('position',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
+    @admin.display(ordering='position__poll')
     def poll(self, obj):
         return obj.poll
 
 @admin.register(Vote)
 class VoteAdmin(admin.ModelAdmin):
     list_display = ('voter', 'poll', 'position', 'candidate', 'timestamp')
-    list_filter = ('position__poll', 'position', 'timestamp')
+    list_filter = ('position__poll', PollPositionFilter, 'timestamp')
+    # One joined query per page instead of three lookups per row
+    list_select_related = ('voter', 'position__poll', 'candidate__position')
     search_fields = ('voter__username', 'candidate__name')
     readonly_fields = ('voter', 'position', 'candidate', 'timestamp')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
+    @admin.display(ordering='position__poll')
     def poll(self, obj):
-        return obj.poll
\ No newline at end of file
+        return obj.poll
+
+@admin.register(PollResultSnapshot)
+class PollResultSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('poll', 'total_votes', 'turnout', 'computed_at')
+    readonly_fields = ('poll', 'results', 'total_votes', 'turnout', 'etag', 'computed_at')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ResultNotificationBatch)
+class ResultNotificationBatchAdmin(admin.ModelAdmin):
+    list_display = ('poll', 'first_voter_id', 'last_voter_id', 'recipients', 'sent_at')
+    list_filter = ('poll',)
+    readonly_fields = ('poll', 'first_voter_id', 'last_voter_id', 'recipients', 'sent_at', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+
+def rearm_timers_action(modeladmin, request, queryset):
+    """Admin action to run failed timers again on the next sweep"""
+    count = queryset.exclude(status=PollTimer.Status.PENDING).update(
+        status=PollTimer.Status.PENDING, run_at=timezone.now(), attempts=0, last_error='',
+    )
+    messages.success(request, f'{count} timers will run on the next sweep')
+
+rearm_timers_action.short_description = "Run again on the next sweep"
+
+@admin.register(PollTimer)
+class PollTimerAdmin(admin.ModelAdmin):
+    list_display = ('poll', 'event', 'due_at', 'status', 'attempts', 'run_at', 'fired_at')
+    list_filter = ('status', 'event')
+    list_select_related = ('poll',)
+    readonly_fields = ('poll', 'event', 'due_at', 'run_at', 'status', 'attempts', 'last_error', 'fired_at')
+    actions = [rearm_timers_action]
+    
+    def has_add_permission(self, request):
+        return False
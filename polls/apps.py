@@ -6,4 +6,11 @@ class PollsConfig(AppConfig):
     name = 'polls'
     
     def ready(self):
-        import polls.signals
\ No newline at end of file
+        import polls.signals
+        from django.core import checks
+        from .ingest import check_vote_queue
+        from .metrics import connect_query_timing, connect_task_signals
+        
+        connect_query_timing()
+        connect_task_signals()
+        checks.register(check_vote_queue)
\ No newline at end of file
@@ -0,0 +1,256 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from .models import Poll, Position, Vote
+from .routing import use_primary
+
+DEFAULT_POLL_DETAIL_TIMEOUT = 300
+DEFAULT_BALLOT_METADATA_TTL = 60
+VOTED_POSITIONS_TIMEOUT = 60 * 60 * 24
+
+POLL_LIST_VERSION_KEY = 'polls:list-version'
+
+def get_version(key):
+    """
+    Current value of a version counter kept in the shared cache.
+
+    Versions start from a timestamp rather than 1 so that a version key
+    evicted from the cache can't resurrect entries cached under an older one.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version if version is not None else time.time_ns()
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+    cache.set(modified_key(key), time.time(), timeout=None)
+
+def modified_key(key):
+    return f'{key}:modified'
+
+def get_modified(key):
+    """
+    When a version counter was last bumped, as a timestamp. A counter that
+    was never bumped, or whose record was evicted, reads as modified now, so
+    clients revalidate once rather than miss a change.
+    """
+    modified = cache.get(modified_key(key))
+    if modified is None:
+        cache.add(modified_key(key), time.time(), timeout=None)
+        modified = cache.get(modified_key(key))
+    return modified if modified is not None else time.time()
+
+def ballot_version_key(poll_id):
+    return f'polls:ballot-version:{poll_id}'
+
+def get_ballot_version(poll_id):
+    """Current version of a poll's ballot (poll, positions and candidates)"""
+    return get_version(ballot_version_key(poll_id))
+
+def get_ballot_modified(poll_id):
+    return get_modified(ballot_version_key(poll_id))
+
+def bump_ballot_version(poll_id):
+    """Invalidate everything cached for a poll's ballot"""
+    bump_version(ballot_version_key(poll_id))
+
+def results_version_key(poll_id):
+    return f'polls:results-version:{poll_id}'
+
+def get_results_version(poll_id):
+    """Changes whenever votes for the poll are committed or deleted"""
+    return get_version(results_version_key(poll_id))
+
+def bump_results_version(poll_id):
+    bump_version(results_version_key(poll_id))
+
+def poll_detail_cache_key(poll_id, variant=''):
+    return f'polls:detail:{poll_id}:{get_ballot_version(poll_id)}:{variant}'
+
+def poll_detail_timeout(poll):
+    """
+    Seconds a rendered poll detail payload may be cached.
+
+    The payload includes the poll's status, so an entry never outlives the
+    next status change (opening or closing) even though no edit happened.
+    """
+    timeout = getattr(settings, 'POLL_DETAIL_CACHE_TIMEOUT', DEFAULT_POLL_DETAIL_TIMEOUT)
+    now = timezone.now()
+    for boundary in (poll.start_time, poll.end_time):
+        if boundary is not None and boundary > now:
+            timeout = min(timeout, (boundary - now).total_seconds())
+            break
+    return max(1, int(timeout))
+
+class BallotMetadata:
+    """
+    What the vote path needs to know about a poll: its voting window and
+    which candidate belongs to which position
+    """
+    def __init__(self, poll_id, version, start_time, end_time, candidates, positions):
+        self.poll_id = poll_id
+        self.version = version
+        self.built_at = time.monotonic()
+        self.start_time = start_time
+        self.end_time = end_time
+        self.candidates = candidates
+        self.positions = positions
+
+    def is_active(self):
+        return self.start_time <= timezone.now() <= self.end_time
+
+    def candidate_position(self, candidate_id):
+        return self.candidates.get(candidate_id)
+
+# Process-local; entries are checked against the shared ballot version on
+# every read, so an edit made through any process invalidates them. They also
+# expire after BALLOT_METADATA_TTL seconds, which bounds how long a change
+# that bypassed the signals (queryset updates, raw SQL) goes unnoticed.
+_ballot_metadata = {}
+_ballot_metadata_lock = threading.Lock()
+
+def get_ballot_metadata_ttl():
+    return getattr(settings, 'BALLOT_METADATA_TTL', DEFAULT_BALLOT_METADATA_TTL)
+
+def get_ballot_metadata(poll_id):
+    """
+    Ballot metadata for a poll, or None if the poll doesn't exist.
+
+    Costs one cache read while the ballot is unchanged and two small
+    queries to rebuild after an edit or once the entry expires. Rebuilds
+    read the primary: the entry is shared by every request in the process,
+    and a lagging replica would pin pre-edit data under the new version.
+    """
+    version = get_ballot_version(poll_id)
+    metadata = _ballot_metadata.get(poll_id)
+    expires_before = time.monotonic() - get_ballot_metadata_ttl()
+    if metadata is not None and metadata.version == version and metadata.built_at > expires_before:
+        return metadata
+
+    with use_primary():
+        poll = Poll.objects.filter(pk=poll_id).only('start_time', 'end_time').first()
+        if poll is None:
+            return None
+
+        positions = set()
+        candidates = {}
+        for position_id, candidate_id in Position.objects.filter(poll_id=poll_id).values_list('id', 'candidates__id'):
+            positions.add(position_id)
+            if candidate_id is not None:
+                candidates[candidate_id] = position_id
+
+    metadata = BallotMetadata(
+        poll_id=poll_id,
+        version=version,
+        start_time=poll.start_time,
+        end_time=poll.end_time,
+        candidates=candidates,
+        positions=positions,
+    )
+    with _ballot_metadata_lock:
+        # Drop expired entries so polls that are no longer read don't pile up
+        for stale in [key for key, entry in _ballot_metadata.items() if entry.built_at <= expires_before]:
+            del _ballot_metadata[stale]
+        _ballot_metadata[poll_id] = metadata
+    return metadata
+
+def voted_positions_key(poll_id, user_id):
+    return f'polls:voted-positions:{poll_id}:{user_id}'
+
+def get_voted_positions(poll_id, user_id):
+    """
+    IDs of the positions in a poll the user has already voted for.
+
+    Served from the cache; a miss costs one query on the
+    ('voter', 'position') unique index.
+    """
+    key = voted_positions_key(poll_id, user_id)
+    positions = cache.get(key)
+    if positions is None:
+        positions = sorted(
+            Vote.objects
+            .filter(voter_id=user_id, position__poll_id=poll_id)
+            .values_list('position_id', flat=True)
+        )
+        cache.set(key, positions, VOTED_POSITIONS_TIMEOUT)
+    return positions
+
+def add_voted_positions(poll_id, user_id, position_ids):
+    """
+    Record newly written votes in the user's cached voted set, if it is
+    cached; otherwise the next read rebuilds it from the database
+    """
+    key = voted_positions_key(poll_id, user_id)
+    positions = cache.get(key)
+    if positions is not None:
+        cache.set(key, sorted(set(positions) | set(position_ids)), VOTED_POSITIONS_TIMEOUT)
+
+def forget_voted_positions(poll_id, user_id):
+    cache.delete(voted_positions_key(poll_id, user_id))
+
+def passed_boundaries(start_time, end_time, now=None):
+    """
+    Number of lifecycle boundaries (opening, closing) a poll has passed.
+
+    Together with a version counter this identifies a poll's status
+    without serializing it.
+    """
+    now = now or timezone.now()
+    return int(start_time <= now) + int(end_time < now)
+
+def last_passed_boundary(start_time, end_time, now=None):
+    """The most recent of a poll's boundaries to have passed, or None"""
+    now = now or timezone.now()
+    if end_time < now:
+        return end_time
+    return start_time if start_time <= now else None
+
+def _schedule_is_current(schedule, now):
+    # Until the next opening or closing, nothing time-based has changed
+    return (
+        (schedule['next_start'] is None or now < schedule['next_start'])
+        and (schedule['next_end'] is None or now <= schedule['next_end'])
+    )
+
+def get_poll_list_validators():
+    """
+    Validators for the poll list: a signature made of the list version and
+    how many lifecycle boundaries have passed across all polls, and the
+    last-modified timestamp. Served from the cache until the next boundary
+    passes; a miss costs one aggregate query, on the primary as the result
+    is shared.
+    """
+    version = get_version(POLL_LIST_VERSION_KEY)
+    key = f'polls:schedule:{version}'
+    now = timezone.now()
+    schedule = cache.get(key)
+    if schedule is None or not _schedule_is_current(schedule, now):
+        with use_primary():
+            schedule = Poll.objects.aggregate(
+                started=Count('id', filter=Q(start_time__lte=now)),
+                ended=Count('id', filter=Q(end_time__lt=now)),
+                last_start=Max('start_time', filter=Q(start_time__lte=now)),
+                last_end=Max('end_time', filter=Q(end_time__lt=now)),
+                next_start=Min('start_time', filter=Q(start_time__gt=now)),
+                next_end=Min('end_time', filter=Q(end_time__gte=now)),
+                updated=Max('updated_at'),
+            )
+        cache.set(key, schedule, DEFAULT_POLL_DETAIL_TIMEOUT)
+
+    changes = [schedule['updated'], schedule['last_start'], schedule['last_end']]
+    last_modified = max(
+        [moment.timestamp() for moment in changes if moment is not None]
+        + [get_modified(POLL_LIST_VERSION_KEY)]
+    )
+    return f'{version}-{schedule["started"] + schedule["ended"]}', last_modified
+
+def bump_poll_list_version():
+    bump_version(POLL_LIST_VERSION_KEY)
@@ -0,0 +1,237 @@
+"""
+Live vote tally events.
+
+Vote writes publish per-candidate tally deltas on a results bus once their
+transaction commits. Each process keeps one ``LiveResultsHub`` holding the
+current results of every poll that has live subscribers, so any number of
+admin dashboards share a single snapshot query and a single bus subscription.
+
+The bus lives in process memory by default; set ``RESULTS_BUS_URL`` to a
+Redis URL to share events between web and worker processes.
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from .results import compute_poll_results, hide_outcome
+from .routing import use_primary
+from .cache import bump_results_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESYNC_INTERVAL = 30
+
+class InMemoryResultsBus:
+    """
+    Delivers events to listeners in the publishing process only
+    """
+    def __init__(self):
+        self._listeners = []
+
+    def publish(self, message):
+        for listener in list(self._listeners):
+            listener(message)
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+class RedisResultsBus:
+    """
+    Fans events out to every process through Redis pub/sub
+    """
+    channel = 'polls:results'
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self._listeners = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        self.client.publish(self.channel, json.dumps(message))
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='results-bus', daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for raw in pubsub.listen():
+                    message = json.loads(raw['data'])
+                    for listener in list(self._listeners):
+                        listener(message)
+            except Exception as e:
+                logger.warning(f"Results bus connection lost, reconnecting: {str(e)}")
+                time.sleep(1)
+
+class _PollState:
+    def __init__(self):
+        self.results = None
+        self.candidates = {}
+        self.subscribers = set()
+        self.synced_at = 0.0
+        self.load_lock = threading.Lock()
+
+class LiveResultsHub:
+    """
+    Shared live results for the polls this process is streaming.
+
+    Subscribers are ``(loop, asyncio.Queue)`` pairs; events are handed to
+    them thread-safely as ``{'type': ..., 'data': ...}`` dicts.
+    """
+    def __init__(self, bus):
+        self._polls = {}
+        self._lock = threading.Lock()
+        bus.add_listener(self._on_message)
+
+    def subscribe(self, poll, loop, queue):
+        """Register a subscriber and return the current results snapshot"""
+        with self._lock:
+            state = self._polls.setdefault(poll.id, _PollState())
+            state.subscribers.add((loop, queue))
+
+        if state.results is None:
+            self._load(poll, state)
+        with self._lock:
+            return copy.deepcopy(state.results)
+
+    def unsubscribe(self, poll_id, loop, queue):
+        with self._lock:
+            state = self._polls.get(poll_id)
+            if state is None:
+                return
+            state.subscribers.discard((loop, queue))
+            if not state.subscribers:
+                del self._polls[poll_id]
+
+    def resync(self, poll, interval=None):
+        """
+        Recompute a poll's snapshot if it is older than ``interval`` seconds
+        and push it to subscribers, bounding any drift from missed events
+        """
+        if interval is None:
+            interval = getattr(settings, 'RESULTS_STREAM_RESYNC_INTERVAL', DEFAULT_RESYNC_INTERVAL)
+        state = self._polls.get(poll.id)
+        if state is None or time.monotonic() - state.synced_at < interval:
+            return
+        self._load(poll, state, broadcast=True)
+
+    def _load(self, poll, state, broadcast=False):
+        # One query per poll per process, however many dashboards are open
+        if not state.load_lock.acquire(blocking=not broadcast):
+            return
+        try:
+            if state.results is not None and not broadcast:
+                return
+            # Shared by every stream of the poll in this process
+            with use_primary():
+                results = compute_poll_results(poll)
+            # Counts move with every delta; who is ahead isn't announced early
+            if not poll.has_ended:
+                hide_outcome(results)
+            with self._lock:
+                state.results = results
+                state.candidates = {
+                    candidate['id']: (position, candidate)
+                    for position in results['positions']
+                    for candidate in position['candidates']
+                }
+                state.synced_at = time.monotonic()
+                if broadcast:
+                    self._send(state, {'type': 'snapshot', 'data': copy.deepcopy(results)})
+        finally:
+            state.load_lock.release()
+
+    def _on_message(self, message):
+        with self._lock:
+            state = self._polls.get(message['poll'])
+            # Until the first snapshot loads there is nothing to apply to.
+            # The snapshot reads committed counts, which already include
+            # deltas published before it; the periodic resync repairs any
+            # published while it was being read.
+            if state is None or state.results is None:
+                return
+            self._apply(message['poll'], state, message)
+
+    def _apply(self, poll_id, state, message):
+        for candidate_id, delta in message['deltas'].items():
+            entry = state.candidates.get(int(candidate_id))
+            if entry is None:
+                # Candidate added after the snapshot; the next resync picks it up
+                continue
+            position, candidate = entry
+            candidate['vote_count'] += delta
+            position['total_votes'] += delta
+            state.results['total_votes'] += delta
+            self._send(state, {'type': 'delta', 'data': {
+                'poll': poll_id,
+                'position': position['id'],
+                'candidate': candidate['id'],
+                'delta': delta,
+                'vote_count': candidate['vote_count'],
+            }})
+
+    def _send(self, state, event):
+        for loop, queue in list(state.subscribers):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # The subscriber's event loop has already closed
+                state.subscribers.discard((loop, queue))
+
+_bus = None
+_hub = None
+_init_lock = threading.Lock()
+
+def get_results_bus():
+    global _bus
+
+    with _init_lock:
+        if _bus is None:
+            url = getattr(settings, 'RESULTS_BUS_URL', 'memory://')
+            if url.startswith('memory://'):
+                _bus = InMemoryResultsBus()
+            else:
+                _bus = RedisResultsBus(url)
+        return _bus
+
+def get_results_hub():
+    global _hub
+
+    bus = get_results_bus()
+    with _init_lock:
+        if _hub is None:
+            _hub = LiveResultsHub(bus)
+        return _hub
+
+def publish_tally_deltas(poll_id, candidate_ids, sign=1):
+    """
+    Publish vote count changes for a poll once the current transaction
+    commits, so subscribers never see votes that were rolled back. Also
+    moves the poll's results version on, invalidating live result ETags.
+    """
+    deltas = {str(pk): sign * count for pk, count in Counter(candidate_ids).items()}
+    if not deltas:
+        return
+
+    def publish():
+        bump_results_version(poll_id)
+        try:
+            get_results_bus().publish({'poll': poll_id, 'deltas': deltas})
+        except Exception as e:
+            # Live results are best-effort; the vote itself is already stored
+            logger.warning(f"Could not publish tally deltas for poll {poll_id}: {str(e)}")
+
+    transaction.on_commit(publish)
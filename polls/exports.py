@@ -0,0 +1,137 @@
+"""
+Streaming audit exports of votes and tallies.
+
+Votes are read in keyset chunks (``id > last id``, ordered by id) as plain
+tuples, so each query is short, uses the primary key index, and memory stays
+flat however many votes a poll has. Rows are encoded as CSV or NDJSON one
+chunk at a time and can be gzipped on the fly.
+"""
+import csv
+import io
+import json
+import zlib
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from .models import Poll, Vote, PollResultSnapshot
+from .results import compute_poll_results
+
+DEFAULT_CHUNK_SIZE = 5000
+
+VOTE_FIELDS = (
+    'id', 'poll_id', 'position_id', 'position', 'candidate_id', 'candidate',
+    'voter_id', 'voter', 'timestamp',
+)
+TALLY_FIELDS = (
+    'poll_id', 'position_id', 'position', 'candidate_id', 'candidate',
+    'vote_count', 'rank', 'winner',
+)
+
+TABLES = {'votes': VOTE_FIELDS, 'tallies': TALLY_FIELDS}
+OUTPUTS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+def iter_votes(poll_ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Lists of vote rows (tuples in ``VOTE_FIELDS`` order), one per chunk"""
+    last_id = 0
+    while True:
+        chunk = list(
+            Vote.objects
+            .filter(position__poll_id__in=poll_ids, id__gt=last_id)
+            .order_by('id')
+            .values_list(
+                'id', 'position__poll_id', 'position_id', 'position__title', 'candidate_id',
+                'candidate__name', 'voter_id', 'voter__username', 'timestamp',
+            )[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+def iter_tallies(poll_ids):
+    """
+    Lists of tally rows, one per poll. Ended polls report their frozen
+    snapshot so the export matches the published results.
+    """
+    snapshots = dict(
+        PollResultSnapshot.objects.filter(poll_id__in=poll_ids).values_list('poll_id', 'results')
+    )
+    for poll in Poll.objects.filter(id__in=poll_ids).order_by('id'):
+        results = snapshots.get(poll.id)
+        if results is None:
+            results = compute_poll_results(poll)
+        rows = []
+        for position in results['positions']:
+            winner_id = (position['winner'] or {}).get('id') if poll.has_ended else None
+            for candidate in position['candidates']:
+                rows.append((
+                    poll.id, position['id'], position['title'], candidate['id'], candidate['name'],
+                    candidate['vote_count'], candidate['rank'], candidate['id'] == winner_id,
+                ))
+        yield rows
+
+def _value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+def encode_csv(chunks, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in chunks:
+        writer.writerows([_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def encode_ndjson(chunks, fields):
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(fields, map(_value, row))), separators=(',', ':')) + '\n'
+            for row in rows
+        )
+
+def gzip_stream(parts, level=6):
+    """Gzip an iterable of strings as it is consumed"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for part in parts:
+        data = compressor.compress(part.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(poll_ids, table='votes', output='csv', gzip=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    ``StreamingHttpResponse`` downloading the polls' votes or tallies.
+    Raises ValueError for an unknown table or output.
+    """
+    if table not in TABLES:
+        raise ValueError(f"table must be one of: {', '.join(TABLES)}")
+    if output not in OUTPUTS:
+        raise ValueError(f"output must be one of: {', '.join(OUTPUTS)}")
+
+    poll_ids = sorted(poll_ids)
+    chunks = iter_votes(poll_ids, chunk_size) if table == 'votes' else iter_tallies(poll_ids)
+    encode = encode_csv if output == 'csv' else encode_ndjson
+    content = encode(chunks, TABLES[table])
+
+    content_type, extension = OUTPUTS[output]
+    scope = f'poll-{poll_ids[0]}' if len(poll_ids) == 1 else f'polls-{timezone.now():%Y%m%d%H%M%S}'
+    filename = f'{scope}-{table}.{extension}'
+    if gzip:
+        content = gzip_stream(content)
+        content_type = 'application/gzip'
+        filename += '.gz'
+    else:
+        content_type += '; charset=utf-8'
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private, no-store'
+    # Let a buffering proxy (nginx) pass chunks through as they are produced
+    response['X-Accel-Buffering'] = 'no'
+    return response
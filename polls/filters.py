@@ -0,0 +1,18 @@
+from django_filters import rest_framework as filters
+from .models import Poll
+
+class PollFilter(filters.FilterSet):
+    """
+    Filters for the poll list; status is evaluated in SQL on the stored end_time
+    """
+    status = filters.ChoiceFilter(
+        choices=[('active', 'Active'), ('upcoming', 'Upcoming'), ('ended', 'Ended')],
+        method='filter_status',
+    )
+    
+    class Meta:
+        model = Poll
+        fields = ['status']
+    
+    def filter_status(self, queryset, name, value):
+        return queryset.with_status(value)
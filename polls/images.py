@@ -0,0 +1,119 @@
+"""
+Candidate picture variants.
+
+Uploaded profile pictures are cropped to squares at a few fixed widths and
+saved as WebP and JPEG under content-hashed names, so a variant's URL
+changes whenever its bytes do and can be cached forever. The names are
+recorded on ``Candidate.image_variants``::
+
+    {'source': 'candidates/photo.jpg',
+     'webp': {'96': 'candidates/variants/photo-96.1a2b3c4d5e6f.webp', ...},
+     'jpeg': {'96': 'candidates/variants/photo-96.9f8e7d6c5b4a.jpg', ...}}
+"""
+import hashlib
+import io
+import os
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.views.static import serve
+from PIL import Image, ImageOps
+from .models import Position, Candidate
+from .cache import bump_ballot_version
+
+DEFAULT_WIDTHS = (96, 150, 300)
+VARIANT_DIR = 'candidates/variants'
+
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+def get_variant_widths():
+    return tuple(getattr(settings, 'CANDIDATE_IMAGE_WIDTHS', DEFAULT_WIDTHS))
+
+def needs_processing(candidate):
+    """Whether the candidate's variants are missing or were made from another file"""
+    if not candidate.profile_picture:
+        return bool(candidate.image_variants)
+    return candidate.image_variants.get('source') != candidate.profile_picture.name
+
+def _save_variant(stem, width, extension, data):
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    name = f'{VARIANT_DIR}/{stem}-{width}.{digest}.{extension}'
+    # Same content, same name: nothing to write
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+def render_variants(source, stem):
+    """Variant names by format and width for an open image file"""
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        variants = {fmt: {} for fmt in FORMATS}
+        for width in get_variant_widths():
+            resized = ImageOps.fit(image, (width, width), Image.Resampling.LANCZOS)
+            for fmt, (pil_format, extension, options) in FORMATS.items():
+                buffer = io.BytesIO()
+                resized.save(buffer, pil_format, **options)
+                variants[fmt][str(width)] = _save_variant(stem, width, extension, buffer.getvalue())
+    return variants
+
+def process_candidate_image(candidate, force=False):
+    """
+    Generate and record the candidate's variants. Returns True if anything
+    changed. The picture's own file is left untouched.
+    """
+    if not force and not needs_processing(candidate):
+        return False
+
+    variants = {}
+    if candidate.profile_picture:
+        stem = os.path.splitext(os.path.basename(candidate.profile_picture.name))[0]
+        with candidate.profile_picture.open('rb') as source:
+            variants = render_variants(source, stem)
+        variants['source'] = candidate.profile_picture.name
+
+    # update() rather than save(): saving would queue processing again
+    Candidate.objects.filter(pk=candidate.pk).update(image_variants=variants)
+    candidate.image_variants = variants
+    poll_id = Position.objects.filter(pk=candidate.position_id).values_list('poll_id', flat=True).first()
+    if poll_id is not None:
+        bump_ballot_version(poll_id)
+    return True
+
+def variant_urls(candidate, build_url=None):
+    """
+    ``{'webp': {'src': ..., 'srcset': ...}, 'jpeg': {...}}`` for the
+    candidate's variants, or None if they haven't been generated
+    """
+    variants = candidate.image_variants
+    if not variants or variants.get('source') != getattr(candidate.profile_picture, 'name', None):
+        return None
+
+    build_url = build_url or (lambda url: url)
+    images = {}
+    for fmt in FORMATS:
+        widths = sorted(variants.get(fmt, {}).items(), key=lambda item: int(item[0]))
+        if not widths:
+            continue
+        urls = [(width, build_url(default_storage.url(name))) for width, name in widths]
+        # The middle width suits the ballot's avatars when srcset isn't used
+        images[fmt] = {
+            'src': urls[len(urls) // 2][1],
+            'srcset': ', '.join(f'{url} {width}w' for width, url in urls),
+        }
+    return images
+
+def serve_media(request, path):
+    """
+    Serve uploaded media. Variants have content-hashed names, so they are
+    cached as immutable; other uploads can be replaced in place and are
+    only cached briefly.
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if path.startswith(f'{VARIANT_DIR}/'):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, max-age=3600'
+    return response
@@ -0,0 +1,454 @@
+"""
+Write-behind vote ingestion.
+
+When ``VOTE_INGESTION_MODE`` is ``'queued'`` validated votes are pushed onto a
+queue and acknowledged straight away; ``polls.tasks.drain_vote_queue`` later
+writes them in batches. Each queued vote gets a ticket whose status can be
+polled until the vote is either recorded or rejected.
+
+A drain claims items by moving them to a per-consumer processing list and
+removes them only after their batch has committed, so a worker that dies
+mid-batch loses nothing: once its claim is older than
+``VOTE_INGESTION_CLAIM_TIMEOUT`` the next drain puts the items back. A poll's
+results are frozen ``VOTE_INGESTION_CLOSE_GRACE`` seconds after it ends, and
+both the freeze and each batch lock the poll's row, so a vote drained after
+the freeze is rejected rather than missing from the final results.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Poll, Position, Candidate, Vote, PollResultSnapshot
+from .tallies import record_votes
+from .cache import add_voted_positions
+from .events import publish_tally_deltas
+
+logger = logging.getLogger(__name__)
+
+TICKET_PENDING = 'pending'
+TICKET_RECORDED = 'recorded'
+TICKET_REJECTED = 'rejected'
+
+TICKET_TIMEOUT = 60 * 60 * 24
+STATS_KEY = 'polls:vote-ingestion:stats'
+
+# Rejection reasons, worded as the synchronous VoteSerializer words them
+REASON_DUPLICATE = "You have already voted for this position."
+REASON_INACTIVE = "This poll is not currently active."
+REASON_CLOSED = "Voting has closed for this poll."
+REASON_POSITION = "This position does not belong to this poll."
+REASON_CANDIDATE = "This candidate does not belong to the specified position."
+REASON_FAILED = "Your vote could not be recorded."
+
+DEFAULT_CLAIM_TIMEOUT = 300
+DEFAULT_CLOSE_GRACE = 30
+
+def get_claim_timeout():
+    return getattr(settings, 'VOTE_INGESTION_CLAIM_TIMEOUT', DEFAULT_CLAIM_TIMEOUT)
+
+class InMemoryVoteQueue:
+    """
+    Process-local queue used for development and tests. Claimed items are
+    held until acked, like ``RedisVoteQueue``.
+    """
+    def __init__(self):
+        self._items = deque()
+        self._claimed = {}
+        self._lock = threading.Lock()
+
+    def push(self, item):
+        with self._lock:
+            self._items.append(item)
+
+    def claim(self, size):
+        with self._lock:
+            items = [self._items.popleft() for _ in range(min(size, len(self._items)))]
+            now = time.monotonic()
+            for item in items:
+                self._claimed[item['ticket']] = (item, now)
+            return items
+
+    def ack(self, items):
+        with self._lock:
+            for item in items:
+                self._claimed.pop(item['ticket'], None)
+
+    def release(self, items):
+        """Put claimed items back at the front of the queue"""
+        with self._lock:
+            for item in reversed(items):
+                if self._claimed.pop(item['ticket'], None) is not None:
+                    self._items.appendleft(item)
+
+    def requeue_stale(self, timeout=None):
+        """Requeue items claimed more than ``timeout`` seconds ago"""
+        timeout = get_claim_timeout() if timeout is None else timeout
+        cutoff = time.monotonic() - timeout
+        with self._lock:
+            stale = [ticket for ticket, (_, claimed_at) in self._claimed.items() if claimed_at <= cutoff]
+            for ticket in stale:
+                item, _ = self._claimed.pop(ticket)
+                self._items.appendleft({**item, 'redelivered': True})
+            return len(stale)
+
+    def __len__(self):
+        return len(self._items)
+
+class RedisVoteQueue:
+    """
+    Queue shared by all web and worker processes, backed by a Redis list.
+
+    Claimed items are moved (LMOVE) to a processing list owned by this
+    consumer and only removed once their batch has committed. Each consumer
+    keeps a heartbeat key alive while it works; the processing lists of
+    consumers whose heartbeat expired are put back on the queue.
+    """
+    def __init__(self, url, key='polls:vote-queue'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+        self.consumer = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.consumers_key = f'{key}:consumers'
+        # Raw payloads of claimed items by ticket, for LREM
+        self._raw = {}
+
+    def processing_key(self, consumer):
+        return f'{self.key}:processing:{consumer}'
+
+    def heartbeat_key(self, consumer):
+        return f'{self.key}:heartbeat:{consumer}'
+
+    def push(self, item):
+        self.client.rpush(self.key, json.dumps(item))
+
+    def claim(self, size):
+        processing = self.processing_key(self.consumer)
+        self.client.set(self.heartbeat_key(self.consumer), 1, ex=int(get_claim_timeout()))
+        self.client.sadd(self.consumers_key, self.consumer)
+
+        pipe = self.client.pipeline(transaction=False)
+        for _ in range(size):
+            pipe.lmove(self.key, processing, 'LEFT', 'RIGHT')
+        items = []
+        for raw in pipe.execute():
+            if raw is None:
+                break
+            item = json.loads(raw)
+            self._raw[item['ticket']] = raw
+            items.append(item)
+        return items
+
+    def ack(self, items):
+        pipe = self.client.pipeline(transaction=False)
+        for item in items:
+            raw = self._raw.pop(item['ticket'], None)
+            if raw is not None:
+                pipe.lrem(self.processing_key(self.consumer), 1, raw)
+        pipe.execute()
+
+    def release(self, items):
+        """Put claimed items back at the front of the queue"""
+        processing = self.processing_key(self.consumer)
+        for item in reversed(items):
+            raw = self._raw.pop(item['ticket'], None)
+            if raw is not None:
+                self.client.lpush(self.key, raw)
+                self.client.lrem(processing, 1, raw)
+
+    def requeue_stale(self, timeout=None):
+        """
+        Requeue the items of consumers that stopped heartbeating. An item is
+        pushed back before it is removed from the dead list, so a crash here
+        can repeat it but not lose it.
+        """
+        requeued = 0
+        for consumer in self.client.smembers(self.consumers_key):
+            consumer = consumer.decode()
+            if consumer == self.consumer or self.client.exists(self.heartbeat_key(consumer)):
+                continue
+            processing = self.processing_key(consumer)
+            for raw in self.client.lrange(processing, 0, -1):
+                self.client.lpush(self.key, json.dumps({**json.loads(raw), 'redelivered': True}))
+                self.client.lrem(processing, 1, raw)
+                requeued += 1
+            if not self.client.llen(processing):
+                self.client.srem(self.consumers_key, consumer)
+        return requeued
+
+    def __len__(self):
+        return self.client.llen(self.key)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+MEMORY_QUEUE_ERROR = (
+    "VOTE_INGESTION_MODE is 'queued' but VOTE_INGESTION_QUEUE_URL is memory://, "
+    "which Celery workers in other processes never see"
+)
+
+def memory_queue_misconfigured():
+    """
+    Queued ingestion on a process-local queue is only drained when tasks
+    run in the web process (CELERY_TASK_ALWAYS_EAGER, e.g. tests)
+    """
+    url = getattr(settings, 'VOTE_INGESTION_QUEUE_URL', 'memory://')
+    return (
+        is_queued_ingestion_enabled()
+        and url.startswith('memory://')
+        and not getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False)
+    )
+
+def check_vote_queue(app_configs=None, **kwargs):
+    if memory_queue_misconfigured():
+        return [checks.Error(MEMORY_QUEUE_ERROR, hint="Set VOTE_INGESTION_QUEUE_URL to a redis:// URL.",
+                             id='polls.E001')]
+    return []
+
+def get_vote_queue():
+    global _queue
+
+    with _queue_lock:
+        if _queue is None:
+            if memory_queue_misconfigured():
+                raise ImproperlyConfigured(MEMORY_QUEUE_ERROR)
+            url = getattr(settings, 'VOTE_INGESTION_QUEUE_URL', 'memory://')
+            if url.startswith('memory://'):
+                _queue = InMemoryVoteQueue()
+            else:
+                _queue = RedisVoteQueue(url)
+        return _queue
+
+def is_queued_ingestion_enabled():
+    return getattr(settings, 'VOTE_INGESTION_MODE', 'sync') == 'queued'
+
+def ticket_key(ticket):
+    return f'polls:vote-ticket:{ticket}'
+
+def get_ticket(ticket):
+    return cache.get(ticket_key(ticket))
+
+def _set_ticket(item, **state):
+    ticket = {**item, **state}
+    cache.set(ticket_key(item['ticket']), ticket, TICKET_TIMEOUT)
+    return ticket
+
+def enqueue_vote(poll_id, voter_id, position_id, candidate_id):
+    """
+    Queue an already validated vote and return its ticket state
+    """
+    ticket = str(uuid.uuid4())
+    item = {
+        'ticket': ticket,
+        'poll': poll_id,
+        'voter': voter_id,
+        'position': position_id,
+        'candidate': candidate_id,
+        'queued_at': time.time(),
+    }
+
+    # Record the ticket first so a fast consumer can't finish before it
+    # exists. Return it as written: the cache may already have dropped it.
+    state = _set_ticket(item, status=TICKET_PENDING)
+    get_vote_queue().push(item)
+    return state
+
+def ingestion_settled(poll, now=None):
+    """
+    Whether votes queued before the poll closed have had time to drain, so
+    its results can be frozen
+    """
+    if not is_queued_ingestion_enabled():
+        return True
+    grace = getattr(settings, 'VOTE_INGESTION_CLOSE_GRACE', DEFAULT_CLOSE_GRACE)
+    return (now or timezone.now()) >= poll.end_time + timezone.timedelta(seconds=grace)
+
+def _existing_votes(items):
+    """(voter, position) -> (vote id, candidate) of stored votes matching the batch"""
+    condition = Q()
+    for item in items:
+        condition |= Q(voter_id=item['voter'], position_id=item['position'])
+    return {
+        (voter_id, position_id): (vote_id, candidate_id)
+        for vote_id, voter_id, position_id, candidate_id in
+        Vote.objects.filter(condition).values_list('id', 'voter_id', 'position_id', 'candidate_id')
+    }
+
+def _check_items(items):
+    """
+    Re-validate a batch against the database. Returns the items to insert,
+    ``(item, reason)`` rejections, and ``(item, vote id)`` for redelivered
+    items whose vote was already written before a crash.
+    """
+    poll_ids = {item['poll'] for item in items}
+    end_times = dict(Poll.objects.filter(id__in=poll_ids).values_list('id', 'end_time'))
+    frozen = set(PollResultSnapshot.objects.filter(poll_id__in=poll_ids).values_list('poll_id', flat=True))
+    positions = dict(
+        Position.objects.filter(id__in={item['position'] for item in items}).values_list('id', 'poll_id')
+    )
+    candidates = dict(
+        Candidate.objects.filter(id__in={item['candidate'] for item in items}).values_list('id', 'position_id')
+    )
+    existing = _existing_votes(items)
+
+    accepted, rejected, recorded = [], [], []
+    seen = set()
+    for item in items:
+        pair = (item['voter'], item['position'])
+        end_time = end_times.get(item['poll'])
+        if end_time is None or item['poll'] in frozen:
+            rejected.append((item, REASON_CLOSED))
+        elif item['queued_at'] > end_time.timestamp():
+            rejected.append((item, REASON_INACTIVE))
+        elif positions.get(item['position']) != item['poll']:
+            rejected.append((item, REASON_POSITION))
+        elif candidates.get(item['candidate']) != item['position']:
+            rejected.append((item, REASON_CANDIDATE))
+        elif pair in existing:
+            vote_id, candidate_id = existing[pair]
+            if item.get('redelivered') and candidate_id == item['candidate']:
+                recorded.append((item, vote_id))
+            else:
+                rejected.append((item, REASON_DUPLICATE))
+        elif pair in seen:
+            rejected.append((item, REASON_DUPLICATE))
+        else:
+            seen.add(pair)
+            accepted.append(item)
+    return accepted, rejected, recorded
+
+def _lock_frozen_polls(poll_ids):
+    """
+    Lock the polls' rows and return those whose results are frozen.
+    ``freeze_poll_results`` takes the same lock, so a vote is either in the
+    snapshot or rejected, never written behind it.
+    """
+    list(Poll.objects.select_for_update().filter(id__in=poll_ids).values_list('id', flat=True))
+    return set(PollResultSnapshot.objects.filter(poll_id__in=poll_ids).values_list('poll_id', flat=True))
+
+def _failure_reason(item):
+    """Why a single vote insert hit an integrity error"""
+    if Vote.objects.filter(voter_id=item['voter'], position_id=item['position']).exists():
+        return REASON_DUPLICATE
+    if not Candidate.objects.filter(id=item['candidate'], position_id=item['position']).exists():
+        return REASON_CANDIDATE
+    return REASON_FAILED
+
+def _write(items):
+    """Insert items for polls that aren't frozen; returns (inserted, rejected)"""
+    frozen = _lock_frozen_polls({item['poll'] for item in items})
+    rejected = [(item, REASON_CLOSED) for item in items if item['poll'] in frozen]
+    items = [item for item in items if item['poll'] not in frozen]
+    votes = [
+        Vote(voter_id=item['voter'], position_id=item['position'], candidate_id=item['candidate'])
+        for item in items
+    ]
+    Vote.objects.bulk_create(votes)
+    record_votes(vote.candidate_id for vote in votes)
+    return list(zip(items, votes)), rejected
+
+def _insert_rows(items):
+    """
+    Insert a batch in one transaction, falling back to per-row inserts when
+    a concurrent writer causes a constraint conflict. Returns
+    ``(item, vote)`` pairs and ``(item, reason)`` rejections.
+    """
+    try:
+        with transaction.atomic():
+            return _write(items)
+    except IntegrityError:
+        pass
+
+    inserted, rejected = [], []
+    for item in items:
+        try:
+            with transaction.atomic():
+                written, closed = _write([item])
+            inserted.extend(written)
+            rejected.extend(closed)
+        except IntegrityError:
+            rejected.append((item, _failure_reason(item)))
+    return inserted, rejected
+
+def process_batch(items):
+    """
+    Write a batch of queued votes and resolve every ticket in it.
+
+    Each item is checked again against the database: votes for closed or
+    frozen polls, stale positions or candidates and duplicate (voter,
+    position) pairs are rejected with their reason; the rest are recorded.
+    """
+    accepted, rejected, recorded = _check_items(items) if items else ([], [], [])
+    inserted = []
+    if accepted:
+        inserted, failed = _insert_rows(accepted)
+        rejected.extend(failed)
+
+    polls = {}
+    for item, vote in inserted:
+        polls.setdefault(item['poll'], []).append(vote.candidate_id)
+    for poll_id, candidate_ids in polls.items():
+        publish_tally_deltas(poll_id, candidate_ids)
+
+    processed_at = time.time()
+    for item, vote_id in [(item, vote.pk) for item, vote in inserted] + recorded:
+        _set_ticket(item, status=TICKET_RECORDED, vote_id=vote_id, processed_at=processed_at)
+        add_voted_positions(item['poll'], item['voter'], [item['position']])
+    for item, reason in rejected:
+        _set_ticket(item, status=TICKET_REJECTED, processed_at=processed_at, error=reason)
+
+    return len(inserted) + len(recorded), len(rejected)
+
+def drain_queue(batch_size=None, max_batches=None):
+    """
+    Drain the vote queue in batches and return ingestion statistics.
+    Items are acked only after their batch has committed; a batch that
+    fails is put back for the next drain.
+    """
+    batch_size = batch_size or getattr(settings, 'VOTE_INGESTION_BATCH_SIZE', 500)
+    queue = get_vote_queue()
+    stats = {'batches': 0, 'recorded': 0, 'rejected': 0, 'max_lag': 0.0}
+    stats['requeued'] = queue.requeue_stale()
+
+    while max_batches is None or stats['batches'] < max_batches:
+        items = queue.claim(batch_size)
+        if not items:
+            break
+
+        try:
+            recorded, rejected = process_batch(items)
+        except Exception:
+            queue.release(items)
+            raise
+        queue.ack(items)
+        lag = time.time() - min(item['queued_at'] for item in items)
+
+        stats['batches'] += 1
+        stats['recorded'] += recorded
+        stats['rejected'] += rejected
+        stats['max_lag'] = max(stats['max_lag'], lag)
+        logger.info(
+            f"Ingested vote batch: {recorded} recorded, {rejected} rejected, lag {lag:.3f}s"
+        )
+
+    stats['queue_depth'] = len(queue)
+    stats['drained_at'] = time.time()
+    cache.set(STATS_KEY, stats, None)
+    return stats
+
+def get_ingestion_stats():
+    """Latest drain statistics plus the current queue depth"""
+    stats = dict(cache.get(STATS_KEY) or {})
+    stats['queue_depth'] = len(get_vote_queue())
+    return stats
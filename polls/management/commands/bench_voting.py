@@ -0,0 +1,277 @@
+import json
+import math
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from polls.metrics import QueryTimer, timed_queries
+from polls.models import Poll, Position, Candidate
+
+User = get_user_model()
+
+BENCH_PASSWORD = 'Bench-Voting-2026!'
+ENDPOINTS = ['register', 'login', 'poll_detail', 'vote', 'vote_concurrent', 'results']
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+def bench_host():
+    """
+    A host name the settings accept. The test client's default, 'testserver',
+    is only allowed inside the test environment, which this command doesn't
+    set up: that would swap the email backend and password hashers of
+    whatever settings it runs against.
+    """
+    for host in settings.ALLOWED_HOSTS:
+        if host and not host.startswith(('.', '*')):
+            return host
+    return 'localhost'
+
+def summarize(samples, errors, elapsed):
+    """Throughput, latency percentiles (ms) and queries per request"""
+    latencies = sorted(latency for latency, _ in samples)
+    queries = [count for _, count in samples]
+    return {
+        'requests': len(samples) + errors,
+        'errors': errors,
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        },
+        'queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+    }
+
+class Command(BaseCommand):
+    help = 'Benchmark the voting API: throughput, latency percentiles and queries per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Requests sent to each endpoint'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Concurrent clients (vote runs single-client, the rest use this)'
+        )
+        parser.add_argument(
+            '--positions',
+            type=int,
+            default=5,
+            help='Positions on the benchmark poll'
+        )
+        parser.add_argument(
+            '--candidates',
+            type=int,
+            default=4,
+            help='Candidates per position'
+        )
+        parser.add_argument(
+            '--endpoints',
+            nargs='+',
+            choices=ENDPOINTS,
+            default=ENDPOINTS,
+            help='Endpoints to benchmark'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the JSON report to this file'
+        )
+        parser.add_argument(
+            '--baseline',
+            help='JSON report of an earlier run to compare against'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the seeded poll and users instead of deleting them'
+        )
+
+    def handle(self, *args, **options):
+        self.host = bench_host()
+        self.tag = uuid.uuid4().hex[:8]
+        try:
+            self.seed(options['requests'], options['positions'], options['candidates'])
+            report = {
+                'started_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'positions': options['positions'],
+                'candidates': options['candidates'],
+                'endpoints': {},
+            }
+            for name in options['endpoints']:
+                concurrency = 1 if name == 'vote' else options['concurrency']
+                self.stdout.write(f'Benchmarking {name} ({options["requests"]} requests, concurrency {concurrency})')
+                report['endpoints'][name] = self.run(getattr(self, f'request_{name}'), options['requests'], concurrency)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+        self.print_report(report)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                self.compare(report, json.load(f))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
+
+    def seed(self, count, positions, candidates):
+        """One active poll, an admin, and enough voters for every vote request"""
+        self.poll = Poll.objects.create(
+            title=f'Benchmark {self.tag}',
+            start_time=timezone.now() - timezone.timedelta(minutes=5),
+            duration=24,
+        )
+        self.positions = []
+        for p in range(max(positions, 2)):
+            position = Position.objects.create(poll=self.poll, title=f'Position {p}')
+            Candidate.objects.bulk_create([
+                Candidate(position=position, name=f'Candidate {p}-{c}', description='')
+                for c in range(candidates)
+            ])
+            self.positions.append((position.id, list(position.candidates.values_list('id', flat=True))))
+
+        # Hash the password once; every seeded user shares it
+        password = make_password(BENCH_PASSWORD)
+        users = User.objects.bulk_create([
+            User(username=f'bench-{self.tag}-{i}', password=password, email=f'bench-{self.tag}-{i}@example.com')
+            for i in range(count)
+        ] + [User(username=f'bench-{self.tag}-admin', password=password, role=User.Role.ADMIN)])
+        tokens = Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+        self.voters = [(user.username, token.key) for user, token in zip(users[:-1], tokens[:-1])]
+        self.admin_token = tokens[-1].key
+
+    def cleanup(self):
+        Poll.objects.filter(title=f'Benchmark {self.tag}').delete()
+        User.objects.filter(username__startswith=f'bench-{self.tag}-').delete()
+
+    def run(self, request, count, concurrency):
+        """Send ``count`` requests from ``concurrency`` threads, one client each"""
+        indexes = iter(range(count))
+        lock = threading.Lock()
+        samples = []
+        errors = []
+
+        def worker():
+            client = Client(HTTP_HOST=self.host)
+            try:
+                while True:
+                    with lock:
+                        index = next(indexes, None)
+                    if index is None:
+                        return
+                    # Counts queries on every thread serving the request,
+                    # e.g. the pool that checks login passwords
+                    with timed_queries(QueryTimer()) as queries:
+                        started = time.perf_counter()
+                        try:
+                            response = request(client, index)
+                            ok = response.status_code < 400
+                        except Exception:
+                            ok = False
+                        latency = (time.perf_counter() - started) * 1000
+                    with lock:
+                        if ok:
+                            samples.append((round(latency, 3), queries.count))
+                        else:
+                            errors.append(index)
+            finally:
+                # Each thread has its own database connection
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(samples, len(errors), time.perf_counter() - started)
+
+    def auth(self, token):
+        return {'HTTP_AUTHORIZATION': f'Token {token}'}
+
+    def request_register(self, client, index):
+        username = f'bench-{self.tag}-reg-{index}'
+        return client.post(reverse('register'), {
+            'username': username,
+            'password': BENCH_PASSWORD,
+            'password2': BENCH_PASSWORD,
+            'email': f'{username}@example.com',
+            'first_name': 'Bench',
+            'last_name': 'Voter',
+        }, content_type='application/json', secure=True)
+
+    def request_login(self, client, index):
+        username, _ = self.voters[index]
+        return client.post(reverse('login'), {'username': username, 'password': BENCH_PASSWORD},
+                           content_type='application/json', secure=True)
+
+    def request_poll_detail(self, client, index):
+        _, token = self.voters[index]
+        return client.get(reverse('poll-detail', args=[self.poll.id]), secure=True, **self.auth(token))
+
+    def _vote(self, client, index, position):
+        _, token = self.voters[index]
+        position_id, candidate_ids = self.positions[position]
+        return client.post(
+            reverse('poll-vote', args=[self.poll.id]),
+            {'position': position_id, 'candidate': candidate_ids[index % len(candidate_ids)]},
+            content_type='application/json', secure=True, **self.auth(token),
+        )
+
+    def request_vote(self, client, index):
+        return self._vote(client, index, 0)
+
+    def request_vote_concurrent(self, client, index):
+        return self._vote(client, index, 1)
+
+    def request_results(self, client, index):
+        return client.get(reverse('poll-results', args=[self.poll.id]), secure=True, **self.auth(self.admin_token))
+
+    def print_report(self, report):
+        self.stdout.write(
+            f'{"endpoint":<16} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"errors":>7}'
+        )
+        for name, stats in report['endpoints'].items():
+            latency = stats['latency_ms']
+            self.stdout.write(
+                f'{name:<16} {stats["throughput_rps"] or 0:>9.1f} {latency["p50"] or 0:>9.2f} '
+                f'{latency["p95"] or 0:>9.2f} {latency["p99"] or 0:>9.2f} '
+                f'{stats["queries_per_request"]["mean"] or 0:>8.1f} {stats["errors"]:>7}'
+            )
+
+    def compare(self, report, baseline):
+        """Print throughput and p95 changes relative to a baseline report"""
+        self.stdout.write('Compared with baseline:')
+        for name, stats in report['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(name)
+            if not before or not before['throughput_rps'] or not before['latency_ms']['p95']:
+                continue
+            throughput = (stats['throughput_rps'] or 0) / before['throughput_rps'] * 100 - 100
+            p95 = (stats['latency_ms']['p95'] or 0) / before['latency_ms']['p95'] * 100 - 100
+            style = self.style.SUCCESS if p95 <= 0 else self.style.WARNING
+            self.stdout.write(style(f'  {name}: throughput {throughput:+.1f}%, p95 latency {p95:+.1f}%'))
@@ -1,7 +1,24 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from django.db.models import Count
-from polls.models import Poll, Position, Candidate, Vote
+from django.db import connections, router
+from polls.models import Poll
+from polls.results import freeze_poll_results, freeze_poll_by_id
+
+DEFAULT_CELERY_TIMEOUT = 10 * 60
+# Seconds between checks on a Celery group, doubled while nothing finishes
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2.0
+
+def _init_worker():
+    """Set Django up in pool workers started with the spawn method"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
 
 class Command(BaseCommand):
     help = 'Calculate results for ended polls'
@@ -17,12 +34,35 @@ class Command(BaseCommand):
             action='store_true',
             help='Calculate results for all ended polls'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(4, os.cpu_count() or 1),
+            help='Number of worker processes used with --all (1 runs inline; always inline on SQLite)'
+        )
+        parser.add_argument(
+            '--backend',
+            choices=['process', 'celery'],
+            default='process',
+            help='Run --all in a local process pool or as a Celery group'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=DEFAULT_CELERY_TIMEOUT,
+            help='Seconds to wait for a Celery group before reporting unfinished polls as errors'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print a machine-readable summary of --all to stdout'
+        )
 
     def handle(self, *args, **options):
         if options['poll_id']:
             self.calculate_poll_results(options['poll_id'])
         elif options['all']:
-            self.calculate_all_ended_polls()
+            self.calculate_all_ended_polls(options['workers'], options['backend'], options['json'], options['timeout'])
         else:
             self.stdout.write(
                 self.style.WARNING('Please specify --poll-id <id> or --all')
@@ -41,36 +81,31 @@ class Command(BaseCommand):
             
             self.stdout.write(f'Calculating results for poll: {poll.title}')
             
-            results = {}
+            # Freeze the final results; later reads are served from the snapshot
+            snapshot = freeze_poll_results(poll)
+            if snapshot is None:
+                self.stdout.write(
+                    self.style.WARNING(f'Poll "{poll.title}" still has queued votes to write, try again shortly')
+                )
+                return
             
-            # Calculate results for each position
-            for position in poll.positions.all():
-                # Get candidates with vote counts
-                candidates = position.candidates.annotate(
-                    vote_count=Count('votes')
-                ).order_by('-vote_count')
-                
-                # Determine winner
-                winner = candidates.first()
+            for position in snapshot.results['positions']:
+                winner = position['winner']
                 
-                if winner and winner.vote_count > 0:
-                    results[position.title] = {
-                        'winner': winner.name,
-                        'vote_count': winner.vote_count,
-                        'all_candidates': [
-                            {'name': c.name, 'votes': c.vote_count} 
-                            for c in candidates
-                        ]
-                    }
-                    
+                if winner:
                     self.stdout.write(
                         self.style.SUCCESS(
-                            f'  {position.title}: {winner.name} wins with {winner.vote_count} votes'
+                            f'  {position["title"]}: {winner["name"]} wins with {winner["vote_count"]} votes'
                         )
                     )
+                elif position['is_tie']:
+                    leaders = ', '.join(c['name'] for c in position['candidates'] if c['rank'] == 1)
+                    self.stdout.write(
+                        self.style.WARNING(f'  {position["title"]}: Tie between {leaders}')
+                    )
                 else:
                     self.stdout.write(
-                        self.style.WARNING(f'  {position.title}: No votes cast')
+                        self.style.WARNING(f'  {position["title"]}: No votes cast')
                     )
             
             self.stdout.write(
@@ -86,27 +121,121 @@ class Command(BaseCommand):
                 self.style.ERROR(f'Error calculating results: {str(e)}')
             )
 
-    def calculate_all_ended_polls(self):
-        """Calculate results for all ended polls"""
-        ended_polls = Poll.objects.filter(
-            end_time__lt=timezone.now()
-        ).exclude(status='Ended')
-        
-        if not ended_polls.exists():
+    def calculate_all_ended_polls(self, workers=1, backend='process', as_json=False, timeout=DEFAULT_CELERY_TIMEOUT):
+        """
+        Freeze results for every ended poll that has no snapshot yet.
+
+        The snapshot is the completion marker, so an interrupted run can
+        simply be started again: frozen polls are not selected twice.
+        """
+        # Progress goes to stderr when stdout carries the JSON summary
+        self.progress = self.stderr if as_json else self.stdout
+        self.timeout = timeout
+
+        poll_ids = list(
+            Poll.objects.ended()
+            .filter(result_snapshot__isnull=True)
+            .order_by('end_time')
+            .values_list('id', flat=True)
+        )
+        started = time.monotonic()
+        summaries = []
+
+        if not poll_ids:
+            self.progress.write(self.style.WARNING('No ended polls found'))
+        else:
+            self.progress.write(f'Found {len(poll_ids)} ended polls')
+            if backend == 'process' and workers > 1 and connections[router.db_for_write(Poll)].vendor == 'sqlite':
+                # SQLite takes one writer at a time; parallel freezes fail with
+                # "database is locked"
+                self.progress.write(self.style.WARNING('SQLite database: freezing polls one at a time'))
+                workers = 1
+            if backend == 'celery':
+                runner = self._run_celery
+            elif workers > 1 and len(poll_ids) > 1:
+                runner = self._run_process_pool
+            else:
+                runner = self._run_inline
+            for summary in runner(poll_ids, workers):
+                summaries.append(summary)
+                self._report(summary, len(summaries), len(poll_ids), started)
+
+        counts = {}
+        for summary in summaries:
+            counts[summary['status']] = counts.get(summary['status'], 0) + 1
+        report = {
+            'total': len(poll_ids),
+            'counts': counts,
+            'seconds': round(time.monotonic() - started, 3),
+            'polls': summaries,
+        }
+
+        if as_json:
+            self.stdout.write(json.dumps(report))
+        else:
+            breakdown = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
             self.stdout.write(
-                self.style.WARNING('No ended polls found')
+                self.style.SUCCESS(f'All ended polls processed in {report["seconds"]}s ({breakdown or "none"})')
             )
-            return
-        
-        self.stdout.write(f'Found {ended_polls.count()} ended polls')
-        
-        for poll in ended_polls:
-            self.calculate_poll_results(poll.id)
-            # Update poll status to 'Ended'
-            poll.status = 'Ended'
-            poll.save()
-            self.stdout.write(f'Updated poll "{poll.title}" status to Ended')
-        
-        self.stdout.write(
-            self.style.SUCCESS('All ended polls processed')
-        )
+        return report
+
+    def _run_inline(self, poll_ids, workers):
+        for poll_id in poll_ids:
+            yield freeze_poll_by_id(poll_id)
+
+    def _run_process_pool(self, poll_ids, workers):
+        # Forked workers must not inherit the parent's open database
+        # connections; each one opens its own on first use
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = {executor.submit(freeze_poll_by_id, poll_id): poll_id for poll_id in poll_ids}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield {'poll': futures[future], 'status': 'error', 'error': str(e)}
+
+    def _run_celery(self, poll_ids, workers):
+        from celery import group
+        from polls.tasks import freeze_results
+
+        result = group(freeze_results.s(poll_id) for poll_id in poll_ids).apply_async()
+        deadline = time.monotonic() + self.timeout
+        interval = POLL_INTERVAL
+        reported = set()
+        while len(reported) < len(poll_ids):
+            finished = False
+            for index, child in enumerate(result.results):
+                if index in reported or not child.ready():
+                    continue
+                reported.add(index)
+                finished = True
+                if child.successful():
+                    yield child.result
+                else:
+                    yield {'poll': poll_ids[index], 'status': 'error', 'error': str(child.result)}
+            if len(reported) == len(poll_ids):
+                break
+            if time.monotonic() >= deadline:
+                # The tasks may still finish; a later run skips polls they froze
+                for index in sorted(set(range(len(poll_ids))) - reported):
+                    yield {'poll': poll_ids[index], 'status': 'error',
+                           'error': f'No result from Celery within {self.timeout:g}s'}
+                return
+            interval = POLL_INTERVAL if finished else min(interval * 2, MAX_POLL_INTERVAL)
+            time.sleep(min(interval, max(0, deadline - time.monotonic())))
+
+    def _report(self, summary, done, total, started):
+        elapsed = time.monotonic() - started
+        eta = elapsed / done * (total - done)
+        line = f'[{done}/{total}] Poll {summary["poll"]}: {summary["status"]}'
+        if 'total_votes' in summary:
+            line += f' ({summary["total_votes"]} votes, turnout {summary["turnout"]})'
+        if 'error' in summary:
+            line += f' - {summary["error"]}'
+        line += f' ETA {eta:.1f}s'
+
+        if summary['status'] == 'error':
+            self.progress.write(self.style.ERROR(line))
+        else:
+            self.progress.write(line)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from polls.models import Candidate
+from polls.images import process_candidate_image, needs_processing
+
+class Command(BaseCommand):
+    help = 'Generate resized picture variants for candidates uploaded before variants existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate variants even where they are up to date'
+        )
+
+    def handle(self, *args, **options):
+        candidates = Candidate.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        processed = skipped = failed = 0
+        
+        for candidate in candidates.order_by('id').iterator(chunk_size=500):
+            if not options['force'] and not needs_processing(candidate):
+                skipped += 1
+                continue
+            try:
+                process_candidate_image(candidate, force=True)
+                processed += 1
+                self.stdout.write(f'  {candidate.name}: {candidate.profile_picture.name}')
+            except Exception as e:
+                # A missing or unreadable file shouldn't stop the backfill
+                failed += 1
+                self.stdout.write(
+                    self.style.ERROR(f'  {candidate.name}: could not process {candidate.profile_picture.name}: {str(e)}')
+                )
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Processed {processed} pictures ({skipped} already up to date, {failed} failed)')
+        )
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from polls.turnout import roll_up_votes, get_settle_seconds
+
+class Command(BaseCommand):
+    help = 'Add votes cast since the last run to the turnout minute buckets (what the Celery beat job does)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--settle',
+            type=float,
+            help='Seconds to let in-flight votes commit (default: TURNOUT_ROLLUP_SETTLE); '
+                 '0 rolls up everything visible, only safe when no votes are being written'
+        )
+
+    def handle(self, *args, **options):
+        settle = get_settle_seconds() if options['settle'] is None else options['settle']
+        processed = roll_up_votes(settle=settle)
+        if settle:
+            # The first pass only notes the newest vote; catch up to it once it has settled
+            time.sleep(settle)
+            processed += roll_up_votes(settle=settle)
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {processed} votes'))
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from polls.timers import run_due_timers
+
+class Command(BaseCommand):
+    help = 'Open and close polls whose timers are due (what the Celery beat sweep does)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep sweeping until interrupted; several of these may run at once'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=15,
+            help='Seconds between sweeps with --loop'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            claimed = run_due_timers()
+            if claimed:
+                self.stdout.write(self.style.SUCCESS(f'Ran {claimed} poll timers'))
+            if not options['loop']:
+                if not claimed:
+                    self.stdout.write('No poll timers are due')
+                return
+            close_old_connections()
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
@@ -0,0 +1,229 @@
+import bisect
+import csv
+import io
+import itertools
+import random
+import time
+from collections import Counter
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from polls.models import Poll, Position, Candidate, Vote, VoteTally
+from polls.cache import bump_poll_list_version
+from polls.timers import schedule_poll_timers
+
+User = get_user_model()
+
+# Written straight to the table: going through the ORM would stamp every
+# vote with the current time, since Vote.timestamp is auto_now_add
+VOTE_COLUMNS = ('voter', 'position', 'candidate', 'timestamp')
+
+def vote_columns():
+    return ', '.join(connection.ops.quote_name(Vote._meta.get_field(name).column) for name in VOTE_COLUMNS)
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic election (voters, polls, candidates and votes) for local testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--voters', type=int, default=10000, help='Number of voter accounts')
+        parser.add_argument('--polls', type=int, default=1, help='Number of polls')
+        parser.add_argument('--positions', type=int, default=5, help='Positions per poll')
+        parser.add_argument('--candidates', type=int, default=10, help='Candidates per position')
+        parser.add_argument('--duration', type=int, default=24, help='Poll duration in hours')
+        parser.add_argument(
+            '--turnout',
+            type=float,
+            default=0.6,
+            help='Fraction of voters who take part in each poll'
+        )
+        parser.add_argument(
+            '--abstain',
+            type=float,
+            default=0.05,
+            help='Chance a participating voter skips a given position'
+        )
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=1.1,
+            help='Zipf exponent of candidate popularity (0 gives a uniform race)'
+        )
+        parser.add_argument(
+            '--active',
+            action='store_true',
+            help='Leave the newest poll open; the others have ended'
+        )
+        parser.add_argument('--password', default='password123', help='Password shared by every seeded voter')
+        parser.add_argument('--prefix', default='seed', help='Username prefix of seeded voters')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per insert')
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Insert votes with batched INSERTs even on PostgreSQL'
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        started = time.monotonic()
+
+        voter_ids = self.create_voters(options['voters'], options['prefix'], options['password'])
+        total_votes = 0
+        now = timezone.now().replace(microsecond=0)
+
+        for index in range(options['polls']):
+            poll = self.create_poll(index, now, options)
+            positions = self.create_ballot(poll, options['positions'], options['candidates'])
+            votes = self.cast_votes(poll, positions, voter_ids, now, options)
+            total_votes += votes
+            self.stdout.write(f'Poll "{poll.title}" ({poll.status}): {votes} votes')
+
+        bump_poll_list_version()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Seeded {len(voter_ids)} voters, {options["polls"]} polls and {total_votes} votes '
+                f'in {elapsed:.1f}s ({total_votes / elapsed:.0f} votes/s)'
+            )
+        )
+
+    def create_voters(self, count, prefix, password):
+        """Create missing voter accounts; every one shares a single password hash"""
+        hashed = make_password(password)
+        users = (
+            User(
+                username=f'{prefix}-{i}',
+                email=f'{prefix}-{i}@example.com',
+                password=hashed,
+                role=User.Role.VOTER,
+            )
+            for i in range(count)
+        )
+        for chunk in chunked(users, self.chunk_size):
+            # Reruns with the same prefix reuse the existing accounts
+            User.objects.bulk_create(chunk, ignore_conflicts=True)
+
+        usernames = {f'{prefix}-{i}' for i in range(count)}
+        return [
+            pk for pk, username in
+            User.objects.filter(username__startswith=f'{prefix}-').order_by('id').values_list('id', 'username')
+            if username in usernames
+        ]
+
+    def create_poll(self, index, now, options):
+        duration = timezone.timedelta(hours=options['duration'])
+        if options['active']:
+            # Newest poll is half way through; older ones end back to back
+            end_time = now + duration / 2 - index * duration
+        else:
+            end_time = now - index * duration
+        start_time = end_time - duration
+
+        # bulk_create skips the save signals (cache invalidation is pointless
+        # for freshly generated polls); the lifecycle timers are added below
+        poll = Poll(
+            title=f'Synthetic election {self.rng.randrange(10 ** 6):06d}',
+            description='Generated by seed_election',
+            start_time=start_time,
+            duration=options['duration'],
+        )
+        Poll.objects.bulk_create([poll])
+        if poll.pk is None:
+            poll = Poll.objects.filter(title=poll.title).latest('id')
+        schedule_poll_timers(poll)
+        return poll
+
+    def create_ballot(self, poll, position_count, candidate_count):
+        """Returns [(position_id, candidate_ids)] for the poll"""
+        Position.objects.bulk_create([
+            Position(poll=poll, title=f'Position {p + 1}') for p in range(position_count)
+        ])
+        positions = list(Position.objects.filter(poll=poll).order_by('id'))
+        candidates = (
+            Candidate(position=position, name=f'Candidate {position.pk}-{c + 1}', description='Synthetic candidate')
+            for position in positions for c in range(candidate_count)
+        )
+        for chunk in chunked(candidates, self.chunk_size):
+            Candidate.objects.bulk_create(chunk)
+
+        ballot = {position.pk: [] for position in positions}
+        for position_id, candidate_id in (
+            Candidate.objects.filter(position__poll=poll).order_by('id').values_list('position_id', 'id')
+        ):
+            ballot[position_id].append(candidate_id)
+        return list(ballot.items())
+
+    def popularity(self, count, skew):
+        """Cumulative Zipf weights over a shuffled candidate order"""
+        weights = [1 / (rank + 1) ** skew for rank in range(count)]
+        self.rng.shuffle(weights)
+        return list(itertools.accumulate(weights))
+
+    def cast_votes(self, poll, positions, voter_ids, now, options):
+        participants = self.rng.sample(voter_ids, int(len(voter_ids) * options['turnout']))
+        participants.sort()
+        window = (min(poll.end_time, now) - poll.start_time).total_seconds()
+        tally = Counter()
+
+        def votes():
+            for position_id, candidate_ids in positions:
+                if not candidate_ids:
+                    continue
+                cumulative = self.popularity(len(candidate_ids), options['skew'])
+                total = cumulative[-1]
+                for voter_id in participants:
+                    if self.rng.random() < options['abstain']:
+                        continue
+                    candidate_id = candidate_ids[
+                        min(bisect.bisect(cumulative, self.rng.random() * total), len(candidate_ids) - 1)
+                    ]
+                    # Turnout is heaviest soon after opening with a long tail
+                    offset = self.rng.betavariate(1.3, 3.0) * window
+                    tally[candidate_id] += 1
+                    # One vote per voter per position keeps unique_together intact
+                    yield voter_id, position_id, candidate_id, poll.start_time + timezone.timedelta(seconds=offset)
+
+        written = 0
+        for chunk in chunked(votes(), self.chunk_size):
+            with transaction.atomic():
+                if self.use_copy:
+                    self.copy_votes(chunk)
+                else:
+                    self.insert_votes(chunk)
+            written += len(chunk)
+
+        VoteTally.objects.bulk_create(
+            (VoteTally(candidate_id=candidate_id, shard=0, count=count) for candidate_id, count in tally.items()),
+            batch_size=self.chunk_size,
+        )
+        return written
+
+    def insert_votes(self, rows):
+        """Insert a chunk of votes with one batched INSERT statement"""
+        sql = f'INSERT INTO {connection.ops.quote_name(Vote._meta.db_table)} ({vote_columns()}) VALUES (%s, %s, %s, %s)'
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (voter, position, candidate, connection.ops.adapt_datetimefield_value(timestamp))
+                for voter, position, candidate, timestamp in rows
+            ])
+
+    def copy_votes(self, rows):
+        """Stream a chunk of votes into PostgreSQL with COPY"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for voter, position, candidate, timestamp in rows:
+            writer.writerow((voter, position, candidate, timestamp.isoformat()))
+        buffer.seek(0)
+
+        sql = f'COPY {connection.ops.quote_name(Vote._meta.db_table)} ({vote_columns()}) FROM STDIN WITH (FORMAT csv)'
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, buffer)
@@ -0,0 +1,327 @@
+"""
+Request and task metrics.
+
+``MetricsMiddleware`` times every request and counts its queries and
+database time; the totals are aggregated per resolved URL name and reported
+back in a ``Server-Timing`` header. Every database connection, in every
+thread, carries an ``execute_wrapper`` that charges its queries to the
+timer in the current context, and ``sync_to_async`` carries that context
+into the threads where sync views and ORM calls run under ASGI. The
+middleware runs natively in both sync and async stacks, so async views are
+served without a thread hop. Celery tasks are measured the same way through
+task signals. ``metrics_view`` renders everything in the Prometheus text
+exposition format. Off unless ``METRICS_ENABLED`` is set.
+
+Each process aggregates in memory and periodically publishes a snapshot to
+the shared cache, so with a Redis cache one scrape covers every web and
+worker process.
+"""
+import ipaddress
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROCESSES_KEY = 'polls:metrics:processes'
+SNAPSHOT_TIMEOUT = 5 * 60
+
+class QueryTimer:
+    """Counts queries and their time, from any number of threads"""
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.seconds += seconds
+            self.count += 1
+
+# The timers queries in this context are charged to, innermost last
+_query_timers = ContextVar('metrics_query_timers', default=())
+
+def _time_query(execute, sql, params, many, context):
+    timers = _query_timers.get()
+    if not timers:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for timer in timers:
+            timer.record(elapsed)
+
+def install_query_timing(connection, **kwargs):
+    """Add the timing hook to a connection; connected to ``connection_created``"""
+    if _time_query not in connection.execute_wrappers:
+        # First, so execute_wrapper() blocks open around a reconnect still
+        # pop their own wrapper
+        connection.execute_wrappers.insert(0, _time_query)
+
+def connect_query_timing():
+    connection_created.connect(install_query_timing, weak=False)
+    for conn in connections.all(initialized_only=True):
+        install_query_timing(conn)
+
+@contextmanager
+def timed_queries(timer):
+    """
+    Charge the queries run in this context, on any database, to ``timer``
+    as well as to any timers of enclosing contexts
+    """
+    token = _query_timers.set(_query_timers.get() + (timer,))
+    try:
+        yield timer
+    finally:
+        _query_timers.reset(token)
+
+class MetricsRegistry:
+    """
+    In-process metric families keyed by ``(name, labels)``. Histograms are
+    stored as ``[cumulative bucket counts..., sum, count]``.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._flushed_at = 0.0
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def publish_due(self):
+        return time.monotonic() - self._flushed_at >= getattr(settings, 'METRICS_PUBLISH_INTERVAL', 10)
+
+    def publish(self, force=False):
+        """Share this process's totals through the cache, at most once per interval"""
+        if not force and not self.publish_due():
+            return
+        self._flushed_at = time.monotonic()
+
+        process = f'{socket.gethostname()}:{os.getpid()}'
+        try:
+            cache.set(f'polls:metrics:{process}', self.snapshot(), SNAPSHOT_TIMEOUT)
+            processes = cache.get(PROCESSES_KEY) or []
+            if process not in processes:
+                cache.set(PROCESSES_KEY, [*processes, process][-256:], None)
+        except Exception:
+            # Metrics must never break the request that reports them
+            pass
+
+    def record_request(self, view, method, status, seconds, queries, db_seconds, size):
+        labels = (('view', view), ('method', method))
+        self.observe('http_request_duration_seconds', labels, seconds)
+        self.inc('http_requests_total', labels + (('status', str(status)),))
+        self.inc('http_request_db_queries_total', labels, queries)
+        self.inc('http_request_db_seconds_total', labels, db_seconds)
+        if size is not None:
+            self.inc('http_response_size_bytes_total', labels, size)
+
+    def record_task(self, task, state, seconds, queries, db_seconds):
+        labels = (('task', task),)
+        self.observe('celery_task_duration_seconds', labels, seconds)
+        self.inc('celery_tasks_total', labels + (('state', state),))
+        self.inc('celery_task_db_queries_total', labels, queries)
+        self.inc('celery_task_db_seconds_total', labels, db_seconds)
+        self.publish()
+
+registry = MetricsRegistry()
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', False)
+
+class MetricsMiddleware:
+    """
+    Records duration, query count, database time and response size per
+    resolved URL name, and adds a ``Server-Timing`` header
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not metrics_enabled():
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with timed_queries(timer):
+            response = self.get_response(request)
+        self.record(request, response, timer, time.perf_counter() - started)
+        registry.publish()
+        return response
+
+    async def __acall__(self, request):
+        if not metrics_enabled():
+            return await self.get_response(request)
+
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with timed_queries(timer):
+            response = await self.get_response(request)
+        self.record(request, response, timer, time.perf_counter() - started)
+        # Only the periodic publish touches the cache
+        if registry.publish_due():
+            await sync_to_async(registry.publish)()
+        return response
+
+    def record(self, request, response, timer, seconds):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unresolved'
+        size = None if response.streaming else len(response.content)
+        registry.record_request(view, request.method, response.status_code, seconds,
+                                timer.count, timer.seconds, size)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timer.seconds * 1000:.2f};desc="{timer.count} queries"',
+            f'app;dur={(seconds - timer.seconds) * 1000:.2f}',
+            f'total;dur={seconds * 1000:.2f}',
+        ])
+
+# Celery tasks: measured between the prerun and postrun signals
+_running_tasks = {}
+
+def _task_prerun(task_id=None, task=None, **kwargs):
+    if not metrics_enabled():
+        return
+    timer = QueryTimer()
+    # Prerun and postrun are sent from the thread that runs the task
+    token = _query_timers.set(_query_timers.get() + (timer,))
+    _running_tasks[task_id] = (time.perf_counter(), timer, token)
+
+def _task_postrun(task_id=None, task=None, state=None, **kwargs):
+    running = _running_tasks.pop(task_id, None)
+    if running is None:
+        return
+    started, timer, token = running
+    _query_timers.reset(token)
+    registry.record_task(task.name, state or 'UNKNOWN', time.perf_counter() - started,
+                         timer.count, timer.seconds)
+
+def connect_task_signals():
+    from celery.signals import task_prerun, task_postrun
+
+    task_prerun.connect(_task_prerun, weak=False)
+    task_postrun.connect(_task_postrun, weak=False)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+def collect():
+    """Totals summed over every process that published a recent snapshot"""
+    registry.publish(force=True)
+    snapshots = []
+    for process in cache.get(PROCESSES_KEY) or []:
+        snapshot = cache.get(f'polls:metrics:{process}')
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    if not snapshots:
+        snapshots = [registry.snapshot()]
+
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+def render_metrics():
+    counters, histograms = collect()
+    lines = []
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(DURATION_BUCKETS, values):
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {values[-1]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {values[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+
+    return '\n'.join(lines) + '\n'
+
+def is_allowed_ip(address):
+    """Whether ``address`` is in one of the ``METRICS_ALLOWED_IPS`` networks"""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    )
+
+def can_scrape(request):
+    """
+    Scrapers must send ``Authorization: Bearer <METRICS_TOKEN>`` or connect
+    from an allowlisted address; everything else is denied unless ``DEBUG``
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        return True
+    return settings.DEBUG or is_allowed_ip(request.META.get('REMOTE_ADDR', ''))
+
+def metrics_view(request):
+    """Prometheus text exposition of request and task metrics"""
+    if not can_scrape(request):
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
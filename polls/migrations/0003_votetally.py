@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_tallies(apps, schema_editor):
+    """Seed shard 0 of every candidate's tally with its existing vote count"""
+    Candidate = apps.get_model('polls', 'Candidate')
+    VoteTally = apps.get_model('polls', 'VoteTally')
+    
+    candidates = Candidate.objects.annotate(vote_count=Count('votes')).filter(vote_count__gt=0)
+    VoteTally.objects.bulk_create(
+        VoteTally(candidate_id=c.id, shard=0, count=c.vote_count)
+        for c in candidates.only('id')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0002_remove_candidate_poll_alter_vote_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='polls.candidate')),
+            ],
+            options={
+                'unique_together': {('candidate', 'shard')},
+            },
+        ),
+        migrations.RunPython(backfill_tallies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_votetally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollResultSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('results', models.JSONField(help_text='Per position/candidate counts, ranks and winners')),
+                ('total_votes', models.PositiveIntegerField()),
+                ('turnout', models.PositiveIntegerField(help_text='Number of distinct voters')),
+                ('etag', models.CharField(max_length=64)),
+                ('computed_at', models.DateTimeField(auto_now_add=True)),
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result_snapshot', to='polls.poll')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:20
+
+import polls.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_pollresultsnapshot'),
+    ]
+
+    # Generated by the database from start_time and duration, so existing
+    # polls get theirs when the column is added
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='end_time',
+            field=models.GeneratedField(db_persist=True, expression=polls.models.AddHours('start_time', 'duration'), output_field=models.DateTimeField()),
+        ),
+        migrations.AddIndex(
+            model_name='poll',
+            index=models.Index(fields=['start_time', 'id'], name='poll_start_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='poll',
+            index=models.Index(fields=['end_time'], name='poll_end_time_idx'),
+        ),
+    ]
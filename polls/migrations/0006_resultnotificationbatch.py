@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_poll_end_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultNotificationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_voter_id', models.PositiveBigIntegerField()),
+                ('last_voter_id', models.PositiveBigIntegerField()),
+                ('recipients', models.PositiveIntegerField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_batches', to='polls.poll')),
+            ],
+            options={
+                'unique_together': {('poll', 'first_voter_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_candidate_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['timestamp'], name='vote_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['position', 'timestamp'], name='vote_position_time_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_vote_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCursor',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_id', models.PositiveBigIntegerField(default=0)),
+                ('seen_id', models.PositiveBigIntegerField(default=0)),
+                ('seen_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TurnoutBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField(help_text='Start of the minute (UTC)')),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_buckets', to='polls.poll')),
+                ('position', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_buckets', to='polls.position')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['poll', 'minute'], name='turnout_poll_minute_idx')],
+                'unique_together': {('position', 'minute')},
+            },
+        ),
+    ]
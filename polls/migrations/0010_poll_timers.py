@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_timers(apps, schema_editor):
+    """
+    Timers for existing polls. Openings already passed and closes of polls
+    whose results were frozen are recorded as done; anything else runs on
+    the first sweep.
+    """
+    Poll = apps.get_model('polls', 'Poll')
+    PollTimer = apps.get_model('polls', 'PollTimer')
+    PollResultSnapshot = apps.get_model('polls', 'PollResultSnapshot')
+    now = timezone.now()
+    frozen = set(PollResultSnapshot.objects.values_list('poll_id', flat=True))
+
+    timers = []
+    for poll in Poll.objects.only('start_time', 'end_time').iterator(chunk_size=500):
+        timers.append(PollTimer(
+            poll_id=poll.id, event='open', due_at=poll.start_time, run_at=poll.start_time,
+            status='done' if poll.start_time <= now else 'pending',
+        ))
+        timers.append(PollTimer(
+            poll_id=poll.id, event='close', due_at=poll.end_time, run_at=poll.end_time,
+            status='done' if poll.id in frozen else 'pending',
+        ))
+    PollTimer.objects.bulk_create(timers, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_turnout_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollTimer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('open', 'Open'), ('close', 'Close')], max_length=10)),
+                ('due_at', models.DateTimeField(help_text='When the event happens')),
+                ('run_at', models.DateTimeField(help_text='When the sweeper may next run it (later after a failure)')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('fired_at', models.DateTimeField(blank=True, null=True)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timers', to='polls.poll')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_at'], name='polltimer_due_idx')],
+                'unique_together': {('poll', 'event')},
+            },
+        ),
+        migrations.RunPython(create_timers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_poll_timers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultnotificationbatch',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,82 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+class AddHours(models.Func):
+    """
+    ``start + hours``, in a form databases accept in a generated column.
+    PostgreSQL requires those to be immutable, and ``timestamptz + interval``
+    is only stable, so there the hours are added to the epoch instead.
+    SQLite uses Django's deterministic datetime helper (microseconds).
+    """
+    output_field = models.DateTimeField()
+    templates = {
+        'postgresql': "to_timestamp(extract(epoch FROM (%(start)s - TIMESTAMPTZ 'epoch')) + %(hours)s * 3600)",
+        'sqlite': "django_format_dtdelta('+', %(start)s, %(hours)s * 3600000000)",
+        None: "(%(start)s + %(hours)s * INTERVAL '1' HOUR)",
+    }
+    
+    def __init__(self, start, hours, **extra):
+        super().__init__(start, hours, **extra)
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        (start, start_params), (hours, hours_params) = (
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        )
+        template = self.templates.get(connection.vendor, self.templates[None])
+        return template % {'start': start, 'hours': hours}, (*start_params, *hours_params)
+
+# Positions of the polls being deleted in the current context
+_deleted_positions = ContextVar('deleted_positions', default=frozenset())
+
+@contextmanager
+def deleting_polls(poll_ids):
+    """
+    Mark the positions of polls about to be deleted, so per-vote cleanup
+    (tallies, caches, live deltas) can skip the votes that go with them
+    """
+    positions = Position.objects.filter(poll__in=poll_ids).values_list('pk', flat=True)
+    token = _deleted_positions.set(_deleted_positions.get() | frozenset(positions))
+    try:
+        yield
+    finally:
+        _deleted_positions.reset(token)
+
+def is_position_being_deleted(position_id):
+    return position_id in _deleted_positions.get()
+
+class PollQuerySet(models.QuerySet):
+    """
+    Lifecycle filters evaluated in SQL against the stored end_time
+    """
+    def active(self, now=None):
+        now = now or timezone.now()
+        return self.filter(start_time__lte=now, end_time__gte=now)
+    
+    def upcoming(self, now=None):
+        return self.filter(start_time__gt=now or timezone.now())
+    
+    def ended(self, now=None):
+        return self.filter(end_time__lt=now or timezone.now())
+    
+    def with_status(self, status, now=None):
+        """Filter by 'active', 'upcoming' or 'ended' (case-insensitive)"""
+        return {
+            'active': self.active,
+            'upcoming': self.upcoming,
+            'ended': self.ended,
+        }[status.lower()](now)
+    
+    def delete(self):
+        with deleting_polls(self.values('pk')):
+            return super().delete()
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+
 class Poll(models.Model):
     """
     Model for managing elections/polls
@@ -11,33 +85,53 @@ class Poll(models.Model):
     description = models.TextField(blank=True)
     start_time = models.DateTimeField()
     duration = models.PositiveIntegerField(help_text="Duration in hours")
+    # Computed by the database so lifecycle filters run in SQL and can't drift
+    end_time = models.GeneratedField(
+        expression=AddHours('start_time', 'duration'),
+        output_field=models.DateTimeField(),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = PollQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_time', 'id'], name='poll_start_time_idx'),
+            models.Index(fields=['end_time'], name='poll_end_time_idx'),
+        ]
+    
     def __str__(self):
         return str(self.title)
     
-    @property
-    def end_time(self):
+    def compute_end_time(self):
         if self.start_time is None or self.duration is None:
             return None
         return self.start_time + timezone.timedelta(hours=self.duration)
     
+    def save(self, *args, **kwargs):
+        # Inserts return the generated end_time, updates don't: defer it so
+        # the next read (e.g. the timer signal) loads the recomputed value
+        update_fields = kwargs.get('update_fields')
+        if not self._state.adding and (update_fields is None or {'start_time', 'duration'} & set(update_fields)):
+            self.__dict__.pop('end_time', None)
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with deleting_polls([self.pk]):
+            return super().delete(*args, **kwargs)
+    
     @property
     def is_active(self):
-        if self.start_time is None or self.duration is None:
-            return False
-        now = timezone.now()
-        end_time = self.end_time
+        end_time = self.compute_end_time()
         if end_time is None:
             return False
-        return self.start_time <= now <= end_time
+        return self.start_time <= timezone.now() <= end_time
     
     @property
     def has_ended(self):
-        if self.start_time is None or self.duration is None:
-            return False
-        end_time = self.end_time
+        end_time = self.compute_end_time()
         if end_time is None:
             return False
         return timezone.now() > end_time
@@ -69,6 +163,8 @@ class Candidate(models.Model):
     position = models.ForeignKey(Position, on_delete=models.CASCADE, related_name='candidates')
     name = models.CharField(max_length=255)
     profile_picture = models.ImageField(upload_to='candidates/', blank=True, null=True)
+    # Resized copies of profile_picture, see polls.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField()
     
     def __str__(self):
@@ -91,6 +187,11 @@ class Vote(models.Model):
     class Meta:
         # Ensure a voter can only vote once per position
         unique_together = ('voter', 'position')
+        indexes = [
+            # Admin date filter, and a position's votes over time
+            models.Index(fields=['timestamp'], name='vote_timestamp_idx'),
+            models.Index(fields=['position', 'timestamp'], name='vote_position_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.voter.username} voted for {self.candidate.name}"
@@ -109,6 +210,134 @@ class Vote(models.Model):
         if not self.poll.is_active:
             raise ValidationError("Voting is not allowed for this poll at this time.")
     
+    def save(self, *args, validate=True, **kwargs):
+        # Callers that have already checked these rules (e.g. VoteSerializer
+        # against cached ballot metadata) pass validate=False
+        if validate:
+            self.clean()
+        super().save(*args, **kwargs)
+
+class VoteTally(models.Model):
+    """
+    Running vote count for a candidate, split across shard rows so that
+    concurrent votes for the same candidate don't contend on one counter
+    """
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='tallies')
+    shard = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('candidate', 'shard')
+    
+    def __str__(self):
+        return f"{self.candidate.name} (shard {self.shard}): {self.count}"
+
+
+class PollResultSnapshot(models.Model):
+    """
+    Final results of a poll, frozen once it has ended. Never updated.
+    """
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, related_name='result_snapshot')
+    results = models.JSONField(help_text="Per position/candidate counts, ranks and winners")
+    total_votes = models.PositiveIntegerField()
+    turnout = models.PositiveIntegerField(help_text="Number of distinct voters")
+    etag = models.CharField(max_length=64)
+    computed_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Results of {self.poll.title}"
+    
     def save(self, *args, **kwargs):
-        self.clean()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        if not self._state.adding:
+            raise ValidationError("Poll result snapshots are immutable.")
+        super().save(*args, **kwargs)
+
+class ResultNotificationBatch(models.Model):
+    """
+    A contiguous range of a poll's voters (by user id) to be told the
+    results. Claimed by the worker sending it and marked sent once its
+    emails are out, so a retried dispatch only re-sends batches that never
+    completed and no batch is sent by two workers at once.
+    """
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='notification_batches')
+    first_voter_id = models.PositiveBigIntegerField()
+    last_voter_id = models.PositiveBigIntegerField()
+    recipients = models.PositiveIntegerField()
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('poll', 'first_voter_id')
+    
+    def __str__(self):
+        return f"{self.poll.title}: voters {self.first_voter_id}-{self.last_voter_id}"
+
+class TurnoutBucket(models.Model):
+    """
+    Votes cast for a position during one minute, rolled up from Vote by
+    polls.turnout so turnout charts never scan the vote table
+    """
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='turnout_buckets')
+    position = models.ForeignKey(Position, on_delete=models.CASCADE, related_name='turnout_buckets')
+    minute = models.DateTimeField(help_text="Start of the minute (UTC)")
+    votes = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('position', 'minute')
+        indexes = [
+            models.Index(fields=['poll', 'minute'], name='turnout_poll_minute_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.position_id} @ {self.minute:%Y-%m-%d %H:%M}: {self.votes}"
+
+class RollupCursor(models.Model):
+    """
+    High-water mark of a rollup over an append-only table: rows up to
+    ``last_id`` have been processed. ``seen_id`` is the newest id observed
+    at ``seen_at``; rows are only processed up to it once it is old enough
+    that every transaction that wrote a lower id has committed.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.PositiveBigIntegerField(default=0)
+    seen_id = models.PositiveBigIntegerField(default=0)
+    seen_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+class PollTimer(models.Model):
+    """
+    A poll's opening or closing, run by the sweeper in polls.timers once
+    due. One row per poll and event: editing the poll moves the row rather
+    than adding another.
+    """
+    class Event(models.TextChoices):
+        OPEN = 'open', 'Open'
+        CLOSE = 'close', 'Close'
+    
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+    
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='timers')
+    event = models.CharField(max_length=10, choices=Event.choices)
+    due_at = models.DateTimeField(help_text="When the event happens")
+    run_at = models.DateTimeField(help_text="When the sweeper may next run it (later after a failure)")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    fired_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ('poll', 'event')
+        indexes = [
+            # The sweeper's scan for due timers
+            models.Index(fields=['status', 'run_at'], name='polltimer_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_event_display()} {self.poll_id} at {self.due_at:%Y-%m-%d %H:%M}"
@@ -0,0 +1,158 @@
+"""
+Results notification emails.
+
+Voters are streamed from the database in user id order and split into
+fixed-size batches; each batch is sent by its own task over a single SMTP
+connection. Only one batch of voter ids is held in memory at a time,
+however many people voted. Dispatches of a poll are serialized on its row
+and each batch is claimed before it is sent, so overlapping dispatches (a
+retried task, a second close) never email a voter twice.
+"""
+import logging
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from .models import Poll, Vote, ResultNotificationBatch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CLAIM_TIMEOUT = 15 * 60
+
+def get_chunk_size():
+    return getattr(settings, 'RESULTS_NOTIFICATION_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+def get_claim_timeout():
+    return getattr(settings, 'RESULTS_NOTIFICATION_CLAIM_TIMEOUT', DEFAULT_CLAIM_TIMEOUT)
+
+def poll_voters(poll_id):
+    """Users who voted in the poll and have an email address, by id"""
+    voter_ids = Vote.objects.filter(position__poll_id=poll_id).values('voter_id')
+    return (
+        get_user_model().objects
+        .filter(id__in=voter_ids)
+        .exclude(email='')
+        .order_by('id')
+    )
+
+def dispatch_results_notification(poll_id, send_batch):
+    """
+    Split a poll's voters into notification batches and hand each unsent
+    batch to ``send_batch(batch_id)``.
+
+    Safe to call again after a failure: unsent batches are handed out
+    again and voter streaming resumes after the last recorded batch.
+    Batches are handed out once committed, so ``send_batch`` may queue a
+    task that reads them. Returns the number of batches handed out.
+    """
+    with transaction.atomic():
+        # A concurrent dispatch waits here, then only sees committed batches
+        Poll.objects.select_for_update().filter(pk=poll_id).exists()
+        batches = ResultNotificationBatch.objects.filter(poll_id=poll_id)
+        batch_ids = list(batches.filter(sent_at__isnull=True).values_list('id', flat=True))
+
+        after = batches.aggregate(last=Max('last_voter_id'))['last'] or 0
+        chunk_size = get_chunk_size()
+        chunk = []
+
+        def flush():
+            batch = ResultNotificationBatch.objects.create(
+                poll_id=poll_id,
+                first_voter_id=chunk[0],
+                last_voter_id=chunk[-1],
+                recipients=len(chunk),
+            )
+            batch_ids.append(batch.id)
+            chunk.clear()
+
+        voters = poll_voters(poll_id).filter(id__gt=after).values_list('id', flat=True)
+        for voter_id in voters.iterator(chunk_size=chunk_size):
+            chunk.append(voter_id)
+            if len(chunk) == chunk_size:
+                flush()
+        if chunk:
+            flush()
+
+    for batch_id in batch_ids:
+        send_batch(batch_id)
+    return len(batch_ids)
+
+def claim_batch(batch_id):
+    """
+    Claim an unsent batch for this worker. Returns the claim time, or None if
+    it was sent or another worker claimed it less than
+    ``RESULTS_NOTIFICATION_CLAIM_TIMEOUT`` seconds ago (a claim that old is
+    taken to belong to a worker that died).
+    """
+    now = timezone.now()
+    expired = now - timezone.timedelta(seconds=get_claim_timeout())
+    claimed = (
+        ResultNotificationBatch.objects
+        .filter(pk=batch_id, sent_at__isnull=True)
+        .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=expired))
+        .update(claimed_at=now)
+    )
+    return now if claimed else None
+
+def format_results_message(poll, results):
+    """Subject and body of the results email for a frozen results payload"""
+    subject = f"Results for {poll.title}"
+    lines = [f"The results for {poll.title} are in!", ""]
+    for position in results['positions']:
+        lines.append(f"{position['title']}:")
+        winner = position['winner']
+        if winner:
+            lines.append(f"Winner: {winner['name']} with {winner['vote_count']} votes")
+        elif position['is_tie']:
+            lines.append("Result: tie")
+        else:
+            lines.append("Result: no votes cast")
+        lines.append("All candidates:")
+        for candidate in position['candidates']:
+            lines.append(f"- {candidate['name']}: {candidate['vote_count']} votes")
+        lines.append("")
+    return subject, "\n".join(lines)
+
+def send_notification_batch(batch_id):
+    """
+    Email one batch of voters over a single connection and mark it sent.
+
+    Returns the number of messages sent; a batch that was already sent, or
+    is being sent by another worker, is skipped. Delivery is at-least-once:
+    a failure part way through a batch means the whole batch is sent again
+    on retry.
+    """
+    claimed_at = claim_batch(batch_id)
+    if claimed_at is None:
+        return 0
+
+    try:
+        return _send_batch(batch_id)
+    except Exception:
+        # Release the claim so the task's retry can take it straight away
+        ResultNotificationBatch.objects.filter(pk=batch_id, claimed_at=claimed_at).update(claimed_at=None)
+        raise
+
+def _send_batch(batch_id):
+    batch = ResultNotificationBatch.objects.select_related('poll__result_snapshot').get(pk=batch_id)
+    poll = batch.poll
+    subject, body = format_results_message(poll, poll.result_snapshot.results)
+    emails = (
+        poll_voters(poll.id)
+        .filter(id__range=(batch.first_voter_id, batch.last_voter_id))
+        .values_list('email', flat=True)
+    )
+    messages = [
+        EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [email])
+        for email in emails
+    ]
+
+    with get_connection() as connection:
+        sent = connection.send_messages(messages) or 0
+
+    ResultNotificationBatch.objects.filter(pk=batch.pk).update(sent_at=timezone.now())
+    logger.info(f"Sent {sent} result notifications for poll {poll.id} (batch {batch.pk})")
+    return sent
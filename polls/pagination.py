@@ -0,0 +1,109 @@
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+DEFAULT_EXACT_COUNT_LIMIT = 100000
+
+class PollCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (start_time, id), backed by poll_start_time_idx,
+    so deep pages cost the same as the first one.
+
+    DRF's cursor only keeps the first ordering field and falls back to an
+    offset across rows that share it, which repeats or skips polls created
+    while a client is paging. Here the cursor holds the whole (unique) key
+    and each page starts strictly after the previous one's last row.
+    """
+    ordering = ('-start_time', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+        
+        ordering = [(field.lstrip('-'), field.startswith('-') != reverse) for field in self.ordering]
+        queryset = queryset.order_by(*[f'-{name}' if descending else name for name, descending in ordering])
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(ordering, position))
+            except (ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) if len(results) > len(self.page) else None
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None or offset > 0, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None or offset > 0, position
+        
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+    
+    def after(self, ordering, position):
+        """Rows past ``position`` in ``ordering``: (a, b) > (x, y) as a Q"""
+        values = json.loads(position)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError("Cursor doesn't match the ordering")
+        
+        condition = Q()
+        for index in reversed(range(len(ordering))):
+            name, descending = ordering[index]
+            step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[index]})
+            condition = step | (Q(**{name: values[index]}) & condition) if condition else step
+        return condition
+    
+    def _get_position_from_instance(self, instance, ordering):
+        values = [
+            instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            for name in (field.lstrip('-') for field in ordering)
+        ]
+        return json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+
+def estimate_count(queryset):
+    """
+    The query planner's row estimate for a queryset, or None where the
+    database can't provide one cheaply (anything but PostgreSQL)
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator that skips ``COUNT(*)`` on big result sets. Counts the
+    planner estimates above ``ADMIN_EXACT_COUNT_LIMIT`` rows are used as is;
+    smaller ones, and every count on databases without estimates, are exact.
+    """
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', DEFAULT_EXACT_COUNT_LIMIT)
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate > limit:
+            return estimate
+        return self.object_list.count()
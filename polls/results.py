@@ -0,0 +1,175 @@
+import hashlib
+import json
+import time
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, Rank
+from .models import Poll, Position, Vote, VoteTally, PollResultSnapshot
+from .routing import use_primary
+
+def hide_outcome(results):
+    """Blank out winners and ties, for results of a poll that is still running"""
+    for position in results['positions']:
+        position['winner'] = None
+        position['is_tie'] = False
+    return results
+
+def compute_poll_results(poll):
+    """
+    Compute results for every position of a poll in a single query.
+
+    Vote counts come from the candidate tally shards and each candidate is
+    ranked within its position by a window function, so the cost is
+    O(candidates) no matter how many votes or positions the poll has.
+    Positions without candidates are included with an empty candidate list.
+    """
+    # Summed in a correlated subquery: the outer query can't GROUP BY and
+    # rank over the same aggregate
+    tally = (
+        VoteTally.objects
+        .filter(candidate=OuterRef('candidates__id'))
+        .values('candidate')
+        .annotate(total=Sum('count'))
+        .values('total')
+    )
+    rows = (
+        Position.objects
+        .filter(poll=poll)
+        .values('id', 'title', 'candidates__id', 'candidates__name')
+        .annotate(vote_count=Coalesce(Subquery(tally), 0))
+        .annotate(
+            rank=Window(
+                expression=Rank(),
+                partition_by=[F('id')],
+                order_by=F('vote_count').desc(),
+            ),
+        )
+        .order_by('id', 'rank', 'candidates__id')
+    )
+
+    positions = {}
+    for row in rows:
+        position = positions.setdefault(row['id'], {
+            'id': row['id'],
+            'title': row['title'],
+            'total_votes': 0,
+            'is_tie': False,
+            'winner': None,
+            'candidates': [],
+        })
+        if row['candidates__id'] is None:
+            continue
+        position['total_votes'] += row['vote_count']
+        position['candidates'].append({
+            'id': row['candidates__id'],
+            'name': row['candidates__name'],
+            'vote_count': row['vote_count'],
+            'rank': row['rank'],
+        })
+
+    for position in positions.values():
+        leaders = [c for c in position['candidates'] if c['rank'] == 1]
+        # A position nobody voted for has neither a winner nor a tie
+        if not leaders or leaders[0]['vote_count'] == 0:
+            continue
+        if len(leaders) > 1:
+            position['is_tie'] = True
+        else:
+            position['winner'] = leaders[0]
+
+    return {
+        'id': poll.id,
+        'title': poll.title,
+        'status': poll.status,
+        'total_votes': sum(p['total_votes'] for p in positions.values()),
+        'positions': list(positions.values()),
+    }
+
+def freeze_poll_results(poll):
+    """
+    Store the final results of an ended poll as an immutable snapshot.
+
+    Returns the existing snapshot if one was already taken, so it is safe to
+    call from the close task, the admin and the management command alike.
+    Returns None if the poll hasn't ended, or if votes queued before it
+    ended may still be waiting to be written.
+    """
+    # Final results must not come from a replica that is still catching up
+    with use_primary():
+        return _freeze_poll_results(poll)
+
+def _freeze_poll_results(poll):
+    from .ingest import ingestion_settled
+
+    snapshot = PollResultSnapshot.objects.filter(poll=poll).first()
+    if snapshot is not None or not poll.has_ended or not ingestion_settled(poll):
+        return snapshot
+
+    try:
+        with transaction.atomic():
+            # Queued ingestion takes the same lock before writing, so a late
+            # vote is either counted here or rejected, never written behind
+            # the snapshot
+            Poll.objects.select_for_update().filter(pk=poll.pk).exists()
+            snapshot = PollResultSnapshot.objects.filter(poll=poll).first()
+            return snapshot or _take_snapshot(poll)
+    except IntegrityError:
+        # Frozen concurrently by another worker
+        return PollResultSnapshot.objects.get(poll=poll)
+
+def _take_snapshot(poll):
+
+    results = compute_poll_results(poll)
+    turnout = (
+        Vote.objects
+        .filter(position__poll=poll)
+        .values('voter_id')
+        .distinct()
+        .count()
+    )
+    payload = json.dumps(results, sort_keys=True)
+
+    return PollResultSnapshot.objects.create(
+        poll=poll,
+        results=results,
+        total_votes=results['total_votes'],
+        turnout=turnout,
+        etag=hashlib.sha256(payload.encode()).hexdigest(),
+    )
+
+def freeze_poll_by_id(poll_id):
+    """
+    Freeze one poll's results and return a JSON-serializable summary.
+
+    Idempotent: the snapshot doubles as the completion marker, so polls
+    that were already frozen are reported as ``skipped``. Used by the
+    calculate_results command's process pool and Celery fan-out.
+    """
+    started = time.monotonic()
+    summary = {'poll': poll_id}
+
+    try:
+        poll = Poll.objects.filter(pk=poll_id).first()
+        if poll is None:
+            summary['status'] = 'missing'
+        elif not poll.has_ended:
+            summary['status'] = 'not_ended'
+        else:
+            already_frozen = PollResultSnapshot.objects.filter(poll=poll).exists()
+            snapshot = freeze_poll_results(poll)
+            if snapshot is None:
+                summary['status'] = 'draining'
+                summary['seconds'] = round(time.monotonic() - started, 3)
+                return summary
+            summary.update(
+                status='skipped' if already_frozen else 'frozen',
+                title=poll.title,
+                total_votes=snapshot.total_votes,
+                turnout=snapshot.turnout,
+                computed_at=snapshot.computed_at.isoformat(),
+            )
+    except Exception as e:
+        summary.update(status='error', error=str(e))
+
+    summary['seconds'] = round(time.monotonic() - started, 3)
+    return summary
@@ -0,0 +1,178 @@
+"""
+Read replica routing.
+
+``ReplicaRoutingMiddleware`` marks read-only requests (GET, HEAD, OPTIONS).
+Within them, ``ReplicaRouter`` sends reads of the poll and result models in
+``REPLICA_READ_MODELS`` to one of ``settings.DATABASE_REPLICAS``, chosen
+once per request among those that are reachable. Everything else (writes,
+other models, Celery tasks, management commands and code inside
+``use_primary()``) goes to the primary.
+
+After a user's successful write request their reads stay on the primary for
+``REPLICA_PIN_SECONDS``, so a voter sees their own vote straight away even
+if the replicas lag behind. Pins are per user, so anything built for the
+shared cache (ballot metadata, detail payloads, list validators, live
+results) is read inside ``use_primary()``: a lagging replica would
+otherwise store pre-edit data under the new version for every user.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PIN_SECONDS = 15
+DEFAULT_RETRY_SECONDS = 30
+
+# Models whose reads may lag the primary by a few seconds
+REPLICA_READ_MODELS = {
+    'polls.poll', 'polls.position', 'polls.candidate', 'polls.votetally',
+    'polls.pollresultsnapshot', 'polls.turnoutbucket',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# The read-only request being served, if any
+_current_request = ContextVar('replica_request', default=None)
+_force_primary = ContextVar('replica_force_primary', default=False)
+
+# Replica alias -> time.monotonic() until which it is skipped
+_unavailable = {}
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+def pin_key(user_id):
+    return f'polls:primary-pin:{user_id}'
+
+def pin_to_primary(user_id):
+    """Read from the primary for this user's next few requests"""
+    cache.set(pin_key(user_id), True, getattr(settings, 'REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS))
+
+def is_pinned(user_id):
+    return bool(cache.get(pin_key(user_id)))
+
+@contextmanager
+def use_primary():
+    """Read from the primary, e.g. for reads that decide a write"""
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+def is_available(alias):
+    if _unavailable.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError as e:
+        _unavailable[alias] = time.monotonic() + getattr(settings, 'REPLICA_RETRY_SECONDS', DEFAULT_RETRY_SECONDS)
+        logger.warning(f"Replica {alias} is unavailable, reading from the primary: {e}")
+        return False
+    return True
+
+def choose_replica():
+    """A reachable replica at random, or None"""
+    replicas = list(get_replicas())
+    random.shuffle(replicas)
+    return next((alias for alias in replicas if is_available(alias)), None)
+
+def _read_alias(request):
+    """Replica for this request's reads, or None for the primary"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        pins = request.__dict__.setdefault('_primary_pins', {})
+        if user.pk not in pins:
+            pins[user.pk] = is_pinned(user.pk)
+        if pins[user.pk]:
+            return None
+    if not hasattr(request, '_read_replica'):
+        request._read_replica = choose_replica()
+    return request._read_replica
+
+class ReplicaRouter:
+    """
+    Database router for ``settings.DATABASE_REPLICAS``; a no-op without
+    replicas
+    """
+    def db_for_read(self, model, **hints):
+        request = _current_request.get()
+        if request is None or _force_primary.get() or model._meta.label_lower not in REPLICA_READ_MODELS:
+            return None
+        return _read_alias(request)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in get_replicas():
+            return False
+        return None
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets read-only requests read from replicas, and pins users who have
+    just written to the primary. Works in both sync and async stacks;
+    database reads in async views go through sync_to_async, which carries
+    the request's context to the router.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not get_replicas():
+            return self.get_response(request)
+
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            self.pin_writer(request, response)
+            return response
+
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        if not get_replicas():
+            return await self.get_response(request)
+
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            await sync_to_async(self.pin_writer)(request, response)
+            return response
+
+        token = _current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+    def pin_writer(self, request, response):
+        user = getattr(request, 'user', None)
+        if response.status_code < 400 and user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
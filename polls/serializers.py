@@ -1,12 +1,37 @@
 from rest_framework import serializers
 from .models import Poll, Position, Candidate, Vote
+from .tallies import increment_tally, record_votes
+from .cache import add_voted_positions
+from .events import publish_tally_deltas
+from .images import variant_urls
 from django.utils import timezone
-from django.db.models import Count
+from django.db import IntegrityError, transaction
+from rest_framework.settings import api_settings
+from drf_spectacular.utils import extend_schema_field
+
+class ImageVariantSerializer(serializers.Serializer):
+    src = serializers.CharField()
+    srcset = serializers.CharField()
+
+class CandidateImagesSerializer(serializers.Serializer):
+    """
+    Shape of the payload built by ``polls.images.variant_urls``
+    """
+    webp = ImageVariantSerializer(required=False)
+    jpeg = ImageVariantSerializer(required=False)
 
 class CandidateSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+    
     class Meta:
         model = Candidate
-        fields = ['id', 'name', 'profile_picture', 'description']
+        fields = ['id', 'name', 'profile_picture', 'images', 'description']
+    
+    @extend_schema_field(CandidateImagesSerializer(allow_null=True))
+    def get_images(self, obj):
+        """Resized WebP and JPEG variants as src/srcset pairs, once generated"""
+        request = self.context.get('request')
+        return variant_urls(obj, request.build_absolute_uri if request else None)
 
 class PositionSerializer(serializers.ModelSerializer):
     candidates = CandidateSerializer(many=True, read_only=True)
@@ -32,68 +57,190 @@ class PollDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description', 'start_time', 'duration', 'end_time', 'status', 'positions']
 
 class VoteSerializer(serializers.ModelSerializer):
+    """
+    Validates a single vote against the poll's cached ballot metadata.
+
+    Expects ``ballot`` (a ``polls.cache.BallotMetadata``) and ``request`` in
+    the serializer context. Duplicate votes are caught by the
+    ('voter', 'position') unique constraint rather than a pre-check.
+    """
+    position = serializers.IntegerField(source='position_id')
+    candidate = serializers.IntegerField(source='candidate_id')
+    
     class Meta:
         model = Vote
         fields = ['id', 'position', 'candidate']
         read_only_fields = ['voter']
     
     def validate(self, attrs):
-        position = attrs['position']
-        candidate = attrs['candidate']
-        poll = position.poll
+        ballot = self.context['ballot']
+        position_id = attrs['position_id']
+        candidate_id = attrs['candidate_id']
+        
+        if position_id not in ballot.positions:
+            raise serializers.ValidationError({"position": "This position does not belong to this poll."})
         
         # Check if poll is active
-        if not poll.is_active:
+        if not ballot.is_active():
             raise serializers.ValidationError("This poll is not currently active.")
         
         # Check if candidate belongs to position
-        if candidate.position != position:
+        if ballot.candidate_position(candidate_id) != position_id:
             raise serializers.ValidationError("This candidate does not belong to the specified position.")
         
-        # Check if user has already voted for this position
-        voter = self.context['request'].user
-        if Vote.objects.filter(voter=voter, position=position).exists():
-            raise serializers.ValidationError("You have already voted for this position.")
-        
         return attrs
     
     def create(self, validated_data):
-        validated_data['voter'] = self.context['request'].user
-        return super().create(validated_data)
+        voter = self.context['request'].user
+        vote = Vote(voter=voter, **validated_data)
+        
+        # Keep the candidate's tally in step with the vote row. The
+        # serializer already enforced Vote.clean() via the ballot metadata.
+        try:
+            with transaction.atomic():
+                vote.save(validate=False)
+                increment_tally(vote.candidate_id)
+                publish_tally_deltas(self.context['ballot'].poll_id, [vote.candidate_id])
+        except IntegrityError:
+            # Usually the unique constraint; otherwise the ballot changed
+            # under the cached metadata (e.g. the candidate was deleted)
+            if Vote.objects.filter(voter=voter, position_id=vote.position_id).exists():
+                message = "You have already voted for this position."
+            elif not Candidate.objects.filter(pk=vote.candidate_id, position_id=vote.position_id).exists():
+                message = "This candidate does not belong to the specified position."
+            else:
+                message = "Your vote could not be recorded."
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+        
+        add_voted_positions(self.context['ballot'].poll_id, voter.id, [vote.position_id])
+        return vote
 
-class CandidateResultSerializer(serializers.ModelSerializer):
-    vote_count = serializers.IntegerField(read_only=True)
-    
-    class Meta:
-        model = Candidate
-        fields = ['id', 'name', 'vote_count']
+class BallotChoiceSerializer(serializers.Serializer):
+    position = serializers.IntegerField()
+    candidate = serializers.IntegerField()
 
-class PositionResultSerializer(serializers.ModelSerializer):
-    candidates = serializers.SerializerMethodField()
-    winner = serializers.SerializerMethodField()
+class BallotSerializer(serializers.Serializer):
+    """
+    A whole ballot: one candidate choice per position of a poll.
+
+    Validation uses a fixed number of queries however many positions the
+    ballot covers, and all votes are written together or not at all.
+    Expects ``poll`` and ``request`` in the serializer context.
+    """
+    votes = BallotChoiceSerializer(many=True, allow_empty=False)
     
-    class Meta:
-        model = Position
-        fields = ['id', 'title', 'candidates', 'winner']
+    def validate_votes(self, votes):
+        position_ids = [choice['position'] for choice in votes]
+        if len(set(position_ids)) != len(position_ids):
+            raise serializers.ValidationError("Each position can only be voted for once per ballot.")
+        return votes
     
-    def get_candidates(self, obj):
-        candidates = obj.candidates.annotate(vote_count=Count('votes')).order_by('-vote_count')
-        return CandidateResultSerializer(candidates, many=True).data
+    def validate(self, attrs):
+        poll = self.context['poll']
+        voter = self.context['request'].user
+        votes = attrs['votes']
+        
+        # Check if poll is active
+        if not poll.is_active:
+            raise serializers.ValidationError("This poll is not currently active.")
+        
+        # Check every candidate belongs to the chosen position of this poll
+        candidate_positions = dict(
+            Candidate.objects
+            .filter(pk__in=[choice['candidate'] for choice in votes], position__poll=poll)
+            .values_list('id', 'position_id')
+        )
+        invalid = [
+            choice for choice in votes
+            if candidate_positions.get(choice['candidate']) != choice['position']
+        ]
+        if invalid:
+            raise serializers.ValidationError({
+                "votes": [
+                    f"Candidate {choice['candidate']} does not belong to position {choice['position']} of this poll."
+                    for choice in invalid
+                ]
+            })
+        
+        # Check if user has already voted for any of these positions
+        already_voted = list(
+            Vote.objects
+            .filter(voter=voter, position_id__in=[choice['position'] for choice in votes])
+            .values_list('position_id', flat=True)
+        )
+        if already_voted:
+            raise serializers.ValidationError({
+                "votes": [f"You have already voted for position {pk}." for pk in already_voted]
+            })
+        
+        return attrs
     
-    def get_winner(self, obj):
-        poll = obj.poll
-        if not poll.has_ended:
-            return None
+    def create(self, validated_data):
+        voter = self.context['request'].user
+        votes = [
+            Vote(voter=voter, position_id=choice['position'], candidate_id=choice['candidate'])
+            for choice in validated_data['votes']
+        ]
         
-        winner = obj.candidates.annotate(vote_count=Count('votes')).order_by('-vote_count').first()
-        if winner:
-            return CandidateResultSerializer(winner).data
-        return None
-
-class PollResultSerializer(serializers.ModelSerializer):
-    positions = PositionResultSerializer(many=True, read_only=True)
-    status = serializers.CharField(read_only=True)
+        with transaction.atomic():
+            Vote.objects.bulk_create(votes)
+            record_votes(vote.candidate_id for vote in votes)
+            publish_tally_deltas(self.context['poll'].id, [vote.candidate_id for vote in votes])
+        
+        add_voted_positions(self.context['poll'].id, voter.id, [vote.position_id for vote in votes])
+        return votes
     
-    class Meta:
-        model = Poll
-        fields = ['id', 'title', 'status', 'positions']
\ No newline at end of file
+    def to_representation(self, instance):
+        return {"votes": VoteSerializer(instance, many=True).data}
+
+class CandidateResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    vote_count = serializers.IntegerField()
+    rank = serializers.IntegerField()
+
+class PositionResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    total_votes = serializers.IntegerField()
+    is_tie = serializers.BooleanField()
+    winner = CandidateResultSerializer(allow_null=True)
+    candidates = CandidateResultSerializer(many=True)
+
+class PollResultSerializer(serializers.Serializer):
+    """
+    Shape of the payload built by ``polls.results.compute_poll_results``.
+    Frozen results of ended polls also carry turnout and computed_at.
+    """
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    status = serializers.CharField()
+    total_votes = serializers.IntegerField()
+    turnout = serializers.IntegerField(required=False)
+    computed_at = serializers.DateTimeField(required=False)
+    positions = PositionResultSerializer(many=True)
+
+class TurnoutPointSerializer(serializers.Serializer):
+    time = serializers.DateTimeField()
+    votes = serializers.IntegerField()
+
+class StreamTokenSerializer(serializers.Serializer):
+    """
+    Short-lived token for opening a poll's live results stream
+    """
+    token = serializers.CharField()
+    expires_in = serializers.IntegerField(help_text="Seconds the token can be used to connect")
+    url = serializers.URLField(help_text="The stream's URL with the token")
+
+class TurnoutSeriesSerializer(serializers.Serializer):
+    """
+    Shape of the payload built by ``polls.turnout.turnout_series``
+    """
+    poll = serializers.IntegerField()
+    position = serializers.IntegerField(allow_null=True)
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    interval_minutes = serializers.IntegerField()
+    total = serializers.IntegerField()
+    points = TurnoutPointSerializer(many=True)
+    updated_at = serializers.DateTimeField(allow_null=True, help_text="When the rollups last advanced")
@@ -1,43 +1,97 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.utils import timezone
-from django.conf import settings
-from .models import Poll
-from datetime import timedelta
 import logging
+from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+from .models import Poll, Position, Candidate, Vote, is_position_being_deleted
+from .tallies import decrement_tally
+from .cache import bump_ballot_version, bump_poll_list_version, forget_voted_positions
+from .events import publish_tally_deltas
+from .images import needs_processing
+from .timers import schedule_poll_timers
 
 logger = logging.getLogger(__name__)
 
+def bump_ballot_on_commit(poll_id):
+    """
+    Bump the ballot version once the edit is committed: a ballot rebuilt
+    before then would be cached under the new version with the old rows
+    """
+    transaction.on_commit(lambda: bump_ballot_version(poll_id))
+
+@receiver(post_save, sender=Poll)
+def schedule_poll_lifecycle(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Keep the poll's open/close timers at its start and end times; the
+    sweeper in polls.timers runs them when due
+    """
+    if not created and update_fields is not None and not {'start_time', 'duration', 'end_time'} & set(update_fields):
+        return
+    schedule_poll_timers(instance)
+
+@receiver(post_delete, sender=Vote)
+def remove_deleted_vote(sender, instance, **kwargs):
+    """
+    Keep candidate tallies and the voter's cached voted positions in step
+    when votes are deleted (admin, cascades). Skipped for the votes of a
+    poll being deleted: its tallies and caches go with it.
+    """
+    if is_position_being_deleted(instance.position_id):
+        return
+    
+    decrement_tally(instance.candidate_id)
+    
+    poll_id = Position.objects.filter(pk=instance.position_id).values_list('poll_id', flat=True).first()
+    if poll_id is not None:
+        forget_voted_positions(poll_id, instance.voter_id)
+        publish_tally_deltas(poll_id, [instance.candidate_id], sign=-1)
+
+
 @receiver(post_save, sender=Poll)
-def schedule_poll_results_calculation(sender, instance, created, **kwargs):
-    """
-    Schedule the result calculation task to run after the poll ends
-    """
-    if created or instance.end_time > timezone.now():
-        try:
-            # Try to import and use Celery if available
-            from .tasks import calculate_poll_results
-            
-            # Calculate when the poll will end
-            end_time = instance.start_time + timedelta(hours=instance.duration)
-            
-            # Schedule the task to run at the end time
-            # We use countdown to specify the number of seconds until execution
-            seconds_until_end = max(0, (end_time - timezone.now()).total_seconds())
-            
-            # Schedule the task
-            calculate_poll_results.apply_async(
-                args=[instance.id],
-                countdown=int(seconds_until_end)
-            )
-            logger.info(f"Scheduled poll results calculation for poll {instance.id}")
-            
-        except Exception as e:
-            # If Celery is not available, log the error and continue
-            logger.warning(f"Could not schedule poll results calculation: {str(e)}")
-            logger.info("Poll results will need to be calculated manually or when Celery is available")
-            
-            # In production, you might want to:
-            # 1. Store the poll ID in a database table for manual processing
-            # 2. Send an alert to administrators
-            # 3. Use a different task scheduling mechanism
\ No newline at end of file
+@receiver(post_delete, sender=Poll)
+def invalidate_poll_ballot(sender, instance, **kwargs):
+    """
+    Drop cached ballot payloads and list validators when a poll is edited or removed
+    """
+    bump_ballot_on_commit(instance.pk)
+    # Likewise for the list
+    transaction.on_commit(bump_poll_list_version)
+
+
+@receiver(post_save, sender=Position)
+@receiver(post_delete, sender=Position)
+def invalidate_position_ballot(sender, instance, **kwargs):
+    bump_ballot_on_commit(instance.poll_id)
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+def invalidate_candidate_ballot(sender, instance, **kwargs):
+    # Look the poll up by id: during cascades the related position may be gone
+    poll_id = Position.objects.filter(pk=instance.position_id).values_list('poll_id', flat=True).first()
+    if poll_id is not None:
+        bump_ballot_on_commit(poll_id)
+
+
+@receiver(post_save, sender=Candidate)
+def queue_candidate_picture(sender, instance, **kwargs):
+    """
+    Resize a newly uploaded profile picture in the background once the
+    upload is committed
+    """
+    if needs_processing(instance):
+        transaction.on_commit(lambda: queue_picture_processing(instance.pk))
+
+def queue_picture_processing(candidate_id):
+    """
+    Runs after the upload has committed, so a broker outage must not fail
+    the save; the original picture is served until variants exist
+    """
+    from .tasks import process_candidate_picture
+
+    try:
+        process_candidate_picture.delay(candidate_id)
+    except Exception as e:
+        logger.error(
+            f"Could not queue picture processing for candidate {candidate_id}, "
+            f"run process_candidate_images to catch up: {e}"
+        )
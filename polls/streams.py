@@ -0,0 +1,119 @@
+"""
+Server-Sent Events endpoints.
+
+These are plain async Django views so they can hold a connection open
+without tying up a worker thread; serve the project through ``asgi.py``
+(e.g. ``uvicorn alx-project-nexus.asgi:application``) to stream.
+
+EventSource can't send headers, so browsers authenticate with a stream
+token in the URL instead of their API token: signed, valid for one poll's
+stream, and only for ``RESULTS_STREAM_TOKEN_MAX_AGE`` seconds, so one that
+ends up in an access log is of little use.
+"""
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from accounts.authentication import CachedTokenAuthentication, get_auth_version
+from accounts.models import User
+from .models import Poll
+from .events import get_results_hub
+
+DEFAULT_HEARTBEAT_INTERVAL = 15
+DEFAULT_STREAM_TOKEN_MAX_AGE = 60
+
+STREAM_TOKEN_SALT = 'polls.results-stream'
+
+def get_stream_token_max_age():
+    return getattr(settings, 'RESULTS_STREAM_TOKEN_MAX_AGE', DEFAULT_STREAM_TOKEN_MAX_AGE)
+
+def make_stream_token(user, poll_id):
+    """Token that lets ``user`` open the poll's results stream for a short while"""
+    payload = {'user': user.pk, 'poll': poll_id, 'auth': get_auth_version(user.pk)}
+    return signing.dumps(payload, salt=STREAM_TOKEN_SALT)
+
+def read_stream_token(token, poll_id):
+    """
+    The user a stream token was issued to, or None if it is forged, expired,
+    for another poll, or the user has logged out since
+    """
+    try:
+        payload = signing.loads(token, salt=STREAM_TOKEN_SALT, max_age=get_stream_token_max_age())
+    except signing.BadSignature:
+        return None
+    if payload.get('poll') != poll_id or payload.get('auth') != get_auth_version(payload.get('user')):
+        return None
+    return User.objects.filter(pk=payload['user'], is_active=True).first()
+
+def _authenticate(request, poll_id):
+    """
+    Resolve the user from a DRF token in the Authorization header or a
+    stream token in ``?token=``
+    """
+    auth = get_authorization_header(request).split()
+    if len(auth) == 2 and auth[0].lower() == b'token':
+        try:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(auth[1].decode())
+        except AuthenticationFailed:
+            return None
+        return user
+
+    token = request.GET.get('token')
+    return read_stream_token(token, poll_id) if token else None
+
+def _format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def poll_results_stream(request, pk):
+    """
+    Stream live results of a poll to admins.
+
+    Sends a ``snapshot`` event with the full results, then a ``delta`` event
+    for every committed change to a candidate's count. Periodic snapshots
+    resynchronise dashboards and comment lines keep idle connections open.
+    As on the results endpoint, winners and ties stay hidden until the poll
+    ends.
+    """
+    user = await sync_to_async(_authenticate)(request, pk)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    if not user.is_admin():
+        return JsonResponse({"error": "Live results are only available to admins"}, status=403)
+
+    poll = await Poll.objects.filter(pk=pk).afirst()
+    if poll is None:
+        return JsonResponse({"detail": "No Poll matches the given query."}, status=404)
+
+    heartbeat = getattr(settings, 'RESULTS_STREAM_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+    hub = get_results_hub()
+
+    async def event_stream():
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        snapshot = await sync_to_async(hub.subscribe)(poll, loop, queue)
+        next_resync = loop.time() + heartbeat
+        try:
+            yield _format_event('snapshot', snapshot)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                    yield _format_event(event['type'], event['data'])
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                # The hub only recomputes once per resync interval, whichever
+                # stream asks first
+                if loop.time() >= next_resync:
+                    await sync_to_async(hub.resync)(poll)
+                    next_resync = loop.time() + heartbeat
+        finally:
+            hub.unsubscribe(poll.id, loop, queue)
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,72 @@
+import random
+from collections import Counter
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+from .models import VoteTally
+
+DEFAULT_TALLY_SHARDS = 8
+
+def get_shard_count():
+    """Number of shard rows each candidate's tally is spread across"""
+    return max(1, int(getattr(settings, 'VOTE_TALLY_SHARDS', DEFAULT_TALLY_SHARDS)))
+
+def increment_tally(candidate_id, amount=1):
+    """
+    Add ``amount`` votes to a random shard of the candidate's tally.
+
+    Must be called inside the transaction that writes the votes so the
+    tally and the vote rows commit (or roll back) together.
+    """
+    shard = random.randrange(get_shard_count())
+    shard_rows = VoteTally.objects.filter(candidate_id=candidate_id, shard=shard)
+
+    if shard_rows.update(count=F('count') + amount):
+        return
+
+    # First vote landing on this shard: create the row, falling back to an
+    # update if a concurrent writer created it first
+    try:
+        with transaction.atomic():
+            VoteTally.objects.create(candidate_id=candidate_id, shard=shard, count=amount)
+    except IntegrityError:
+        shard_rows.update(count=F('count') + amount)
+
+def decrement_tally(candidate_id, amount=1):
+    """
+    Remove ``amount`` votes from one of the candidate's non-empty shards.
+
+    Never creates shard rows, so it is safe to call while the candidate
+    itself is being cascade-deleted.
+    """
+    shard_id = (
+        VoteTally.objects
+        .filter(candidate_id=candidate_id, count__gte=amount)
+        .values_list('pk', flat=True)
+        .first()
+    )
+    if shard_id is not None:
+        VoteTally.objects.filter(pk=shard_id, count__gte=amount).update(count=F('count') - amount)
+
+def record_votes(candidate_ids):
+    """Increment tallies for a batch of votes, one update per candidate"""
+    for candidate_id, amount in Counter(candidate_ids).items():
+        increment_tally(candidate_id, amount)
+
+def annotate_vote_counts(candidates):
+    """Annotate a Candidate queryset with ``vote_count`` summed from its tally shards"""
+    return candidates.annotate(vote_count=Coalesce(Sum('tallies__count'), 0))
+
+def rebuild_tallies(candidates):
+    """
+    Recompute tallies for the given Candidate queryset from the Vote table.
+
+    Used to repair counters after out-of-band writes; not on any hot path.
+    """
+    with transaction.atomic():
+        VoteTally.objects.filter(candidate__in=candidates).delete()
+        VoteTally.objects.bulk_create(
+            VoteTally(candidate_id=c.id, shard=0, count=c.vote_count)
+            for c in candidates.annotate(vote_count=Count('votes')).filter(vote_count__gt=0)
+        )
@@ -1,14 +1,18 @@
 from celery import shared_task
-from django.utils import timezone
-from django.db.models import Count
-from django.core.mail import send_mail
-from django.conf import settings
-from .models import Poll, Position, Candidate, Vote
+from .models import Poll, Candidate, PollResultSnapshot
+from .results import freeze_poll_results, freeze_poll_by_id
+from .ingest import drain_queue
+from .notifications import dispatch_results_notification, send_notification_batch
+from .images import process_candidate_image
+from .turnout import roll_up_votes
+from .timers import run_due_timers
 
 @shared_task
 def calculate_poll_results(poll_id):
     """
-    Calculate the final results for a poll and send notifications
+    Calculate the final results for a poll and send notifications.
+    Polls are now closed by the timer sweeper; this stays registered for
+    jobs queued before it existed.
     """
     try:
         poll = Poll.objects.get(pk=poll_id)
@@ -17,28 +21,15 @@ def calculate_poll_results(poll_id):
         if not poll.has_ended:
             return "Poll has not ended yet"
         
-        results = {}
+        already_frozen = PollResultSnapshot.objects.filter(poll=poll).exists()
         
-        # Calculate results for each position
-        for position in poll.positions.all():
-            # Get candidates with vote counts
-            candidates = position.candidates.annotate(vote_count=Count('votes')).order_by('-vote_count')
-            
-            # Determine winner
-            winner = candidates.first()
-            
-            if winner:
-                results[position.title] = {
-                    'winner': winner.name,
-                    'vote_count': winner.vote_count,
-                    'all_candidates': [
-                        {'name': c.name, 'votes': c.vote_count} 
-                        for c in candidates
-                    ]
-                }
+        # Freeze the final results; later reads are served from the snapshot
+        if freeze_poll_results(poll) is None:
+            return "Poll still has queued votes to write"
         
-        # Send notifications to all voters
-        send_results_notification(poll, results)
+        # Tell the voters once, one batch of recipients per task
+        if not already_frozen:
+            notify_poll_results.delay(poll.id)
         
         return f"Results calculated for poll: {poll.title}"
     
@@ -47,39 +38,62 @@ def calculate_poll_results(poll_id):
     except Exception as e:
         return f"Error calculating results: {str(e)}"
 
-def send_results_notification(poll, results):
+@shared_task
+def freeze_results(poll_id):
     """
-    Send notification to all voters about the poll results
+    Freeze one poll's results; used by calculate_results to fan out
     """
-    # In a real application, you would send emails or push notifications
-    # For this example, we'll just print the notification
-    
-    # Get all voters who participated in this poll
-    voters = set(Vote.objects.filter(poll=poll).values_list('voter__email', flat=True))
-    
-    # Prepare the notification message
-    subject = f"Results for {poll.title}"
-    message = f"The results for {poll.title} are in!\n\n"
-    
-    for position, result in results.items():
-        message += f"\n{position}:\n"
-        message += f"Winner: {result['winner']} with {result['vote_count']} votes\n"
-        message += "All candidates:\n"
-        for candidate in result['all_candidates']:
-            message += f"- {candidate['name']}: {candidate['votes']} votes\n"
-    
-    # In a real application, you would send actual emails
-    # For now, we'll just print the message
-    print(f"Subject: {subject}")
-    print(f"To: {', '.join(voters)}")
-    print(f"Message: {message}")
-    
-    # Uncomment this to send actual emails in production
-    # for voter_email in voters:
-    #     send_mail(
-    #         subject,
-    #         message,
-    #         settings.DEFAULT_FROM_EMAIL,
-    #         [voter_email],
-    #         fail_silently=False,
-    #     )
\ No newline at end of file
+    return freeze_poll_by_id(poll_id)
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def notify_poll_results(self, poll_id):
+    """
+    Email a poll's voters its results, fanning batches out to subtasks.
+    Retries resume: batches that were already sent are not sent again.
+    """
+    try:
+        return dispatch_results_notification(poll_id, send_results_batch.delay)
+    except Exception as e:
+        raise self.retry(exc=e)
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def send_results_batch(self, batch_id):
+    """
+    Email one batch of voters over a single SMTP connection
+    """
+    try:
+        return send_notification_batch(batch_id)
+    except Exception as e:
+        raise self.retry(exc=e)
+
+@shared_task
+def process_candidate_picture(candidate_id):
+    """
+    Generate resized variants of a candidate's newly uploaded picture
+    """
+    candidate = Candidate.objects.filter(pk=candidate_id).first()
+    if candidate is None:
+        return f"Candidate with ID {candidate_id} does not exist"
+    process_candidate_image(candidate)
+    return f"Processed picture of candidate {candidate_id}"
+
+@shared_task
+def drain_vote_queue():
+    """
+    Write queued votes to the database in batches (queued ingestion mode)
+    """
+    return drain_queue()
+
+@shared_task
+def roll_up_turnout():
+    """
+    Add votes cast since the last run to the turnout minute buckets
+    """
+    return roll_up_votes()
+
+@shared_task
+def sweep_poll_timers():
+    """
+    Run due poll open/close timers
+    """
+    return run_due_timers()
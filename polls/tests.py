@@ -1,3 +1,1477 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import math
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Max, Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from accounts.authentication import bump_auth_version
+from accounts.models import User
+from .models import (
+    Poll, Position, Candidate, Vote, VoteTally, PollResultSnapshot, ResultNotificationBatch,
+    TurnoutBucket, RollupCursor, PollTimer,
+)
+from .results import compute_poll_results, freeze_poll_results
+from .notifications import claim_batch, dispatch_results_notification, send_notification_batch
+from .ingest import check_vote_queue, drain_queue, enqueue_vote, get_ticket, get_vote_queue
+from .cache import bump_poll_list_version, get_ballot_metadata
+from .events import InMemoryResultsBus, LiveResultsHub
+from .streams import _authenticate, read_stream_token
+from .tallies import record_votes
+from .metrics import MetricsMiddleware, MetricsRegistry, QueryTimer, timed_queries
+from .tasks import freeze_results
+from .images import process_candidate_image, serve_media
+from .serializers import CandidateSerializer
+from .exports import iter_votes
+from .pagination import EstimatedCountPaginator
+from .turnout import roll_up_votes
+from .timers import run_due_timers
+from .routing import ReplicaRouter, ReplicaRoutingMiddleware, use_primary
+from PIL import Image
+from .management.commands.bench_voting import Command as BenchVotingCommand, bench_host, summarize
 
-# Create your tests here.
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class PollTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_poll(self, positions=1, candidates=2, ended=False):
+        start = timezone.now() - timezone.timedelta(hours=3 if ended else 1)
+        poll = Poll.objects.create(title='Election', start_time=start, duration=2)
+        for p in range(positions):
+            position = Position.objects.create(poll=poll, title=f'Position {p}')
+            for c in range(candidates):
+                Candidate.objects.create(position=position, name=f'Candidate {p}-{c}', description='')
+        return poll
+
+    def cast_votes(self, candidate, count):
+        offset = User.objects.count()
+        votes = [
+            Vote(voter=User.objects.create_user(f'voter-{offset + i}'),
+                 position_id=candidate.position_id, candidate=candidate)
+            for i in range(count)
+        ]
+        Vote.objects.bulk_create(votes)
+        record_votes(v.candidate_id for v in votes)
+
+
+class PollResultsTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.admin = User.objects.create_user('admin', role=User.Role.ADMIN)
+        self.client.force_authenticate(self.admin)
+
+    def test_results_rank_candidates_and_pick_winner(self):
+        poll = self.create_poll(ended=True)
+        first, second = Candidate.objects.order_by('id')
+        self.cast_votes(first, 3)
+        self.cast_votes(second, 1)
+
+        position = compute_poll_results(poll)['positions'][0]
+
+        self.assertEqual(position['total_votes'], 4)
+        self.assertFalse(position['is_tie'])
+        self.assertEqual(position['winner']['id'], first.id)
+        self.assertEqual(
+            [(c['id'], c['vote_count'], c['rank']) for c in position['candidates']],
+            [(first.id, 3, 1), (second.id, 1, 2)],
+        )
+
+    def test_results_flag_ties(self):
+        poll = self.create_poll(ended=True)
+        for candidate in Candidate.objects.all():
+            self.cast_votes(candidate, 2)
+
+        position = compute_poll_results(poll)['positions'][0]
+
+        self.assertTrue(position['is_tie'])
+        self.assertIsNone(position['winner'])
+
+    def test_tied_candidates_share_a_rank_and_the_next_rank_is_skipped(self):
+        poll = self.create_poll(ended=True, candidates=4)
+        candidates = list(Candidate.objects.order_by('id'))
+        for candidate, votes in zip(candidates, (2, 5, 5, 0)):
+            self.cast_votes(candidate, votes)
+
+        position = compute_poll_results(poll)['positions'][0]
+
+        self.assertEqual(
+            [(c['id'], c['vote_count'], c['rank']) for c in position['candidates']],
+            [(candidates[1].id, 5, 1), (candidates[2].id, 5, 1), (candidates[0].id, 2, 3), (candidates[3].id, 0, 4)],
+        )
+        self.assertEqual(position['total_votes'], 12)
+        self.assertTrue(position['is_tie'])
+        self.assertIsNone(position['winner'])
+
+    def test_positions_nobody_voted_for_have_no_winner_or_tie(self):
+        poll = self.create_poll(ended=True, positions=2)
+        voted, unvoted = poll.positions.order_by('id')
+        self.cast_votes(voted.candidates.first(), 1)
+
+        results = compute_poll_results(poll)
+        position = results['positions'][1]
+
+        self.assertEqual(position['id'], unvoted.id)
+        self.assertEqual(position['total_votes'], 0)
+        self.assertIsNone(position['winner'])
+        self.assertFalse(position['is_tie'])
+        # Every candidate is level on zero
+        self.assertEqual([(c['vote_count'], c['rank']) for c in position['candidates']], [(0, 1), (0, 1)])
+        self.assertEqual(results['total_votes'], 1)
+
+    def test_positions_without_candidates_are_listed_empty(self):
+        poll = self.create_poll(ended=True)
+        empty = Position.objects.create(poll=poll, title='Vacant')
+        self.cast_votes(Candidate.objects.first(), 2)
+
+        results = compute_poll_results(poll)
+
+        position_ids = list(poll.positions.order_by('id').values_list('id', flat=True))
+        self.assertEqual([p['id'] for p in results['positions']], position_ids)
+        self.assertEqual(
+            results['positions'][1],
+            {'id': empty.id, 'title': 'Vacant', 'total_votes': 0, 'is_tie': False, 'winner': None, 'candidates': []},
+        )
+        self.assertEqual(results['total_votes'], 2)
+
+    def test_vote_counts_are_summed_across_tally_shards(self):
+        poll = self.create_poll(ended=True)
+        sharded, single = Candidate.objects.order_by('id')
+        VoteTally.objects.bulk_create(
+            [VoteTally(candidate=sharded, shard=shard, count=3) for shard in range(4)]
+            + [VoteTally(candidate=single, shard=0, count=10)]
+        )
+
+        with self.assertNumQueries(1):
+            position = compute_poll_results(poll)['positions'][0]
+
+        self.assertEqual(
+            [(c['id'], c['vote_count'], c['rank']) for c in position['candidates']],
+            [(sharded.id, 12, 1), (single.id, 10, 2)],
+        )
+        self.assertEqual(position['total_votes'], 22)
+        self.assertEqual(position['winner']['id'], sharded.id)
+
+    def test_results_query_count_is_independent_of_position_count(self):
+        small = self.create_poll(positions=1)
+        large = self.create_poll(positions=8, candidates=4)
+
+        for poll in (small, large):
+            with self.assertNumQueries(1):
+                compute_poll_results(poll)
+
+        counts = []
+        for poll in (small, large):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('poll-results', args=[poll.id]))
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_live_results_etag_changes_when_a_candidate_is_edited(self):
+        poll = self.create_poll()
+        candidate = Candidate.objects.first()
+        url = reverse('poll-results', args=[poll.id])
+
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            candidate.name = 'Renamed'
+            candidate.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['positions'][0]['candidates'][0]['name'], 'Renamed')
+
+    def test_ended_poll_results_are_frozen_and_revalidated_by_etag(self):
+        poll = self.create_poll(ended=True)
+        candidate = Candidate.objects.first()
+        self.cast_votes(candidate, 2)
+        url = reverse('poll-results', args=[poll.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['turnout'], 2)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        # Later changes don't alter an ended poll's results
+        self.cast_votes(candidate, 1)
+        self.assertEqual(self.client.get(url).json()['total_votes'], 2)
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(PollResultSnapshot.objects.count(), 1)
+
+
+class CalculateResultsCommandTests(PollTestCase):
+    module = 'polls.management.commands.calculate_results'
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('calculate_results', '--all', *(args or ('--workers', '1')), '--json',
+                     stdout=out, stderr=StringIO())
+        return json.loads(out.getvalue())
+
+    def test_all_freezes_ended_polls_once(self):
+        ended = self.create_poll(ended=True)
+        self.create_poll()
+        self.cast_votes(Candidate.objects.filter(position__poll=ended).first(), 2)
+
+        report = self.run_command()
+
+        self.assertEqual(report['counts'], {'frozen': 1})
+        self.assertEqual(report['polls'][0]['poll'], ended.id)
+        self.assertEqual(report['polls'][0]['turnout'], 2)
+        # Frozen polls are not picked up again
+        self.assertEqual(self.run_command()['total'], 0)
+        self.assertEqual(PollResultSnapshot.objects.count(), 1)
+
+    def test_sqlite_freezes_inline_whatever_the_worker_count(self):
+        self.create_poll(ended=True)
+        self.create_poll(ended=True)
+
+        with mock.patch(f'{self.module}.ProcessPoolExecutor') as pool:
+            report = self.run_command('--workers', '4')
+
+        pool.assert_not_called()
+        self.assertEqual(report['counts'], {'frozen': 2})
+
+    def test_process_pool_reports_each_poll_and_worker_errors(self):
+        ok, failing = self.create_poll(ended=True), self.create_poll(ended=True)
+
+        def freeze(poll_id):
+            if poll_id == failing.id:
+                raise DatabaseError('database is locked')
+            return {'poll': poll_id, 'status': 'frozen'}
+
+        # Threads stand in for worker processes so the patched freeze is used
+        with mock.patch.object(type(connections['default']), 'vendor', 'postgresql'), \
+                mock.patch(f'{self.module}.ProcessPoolExecutor', ThreadPoolExecutor), \
+                mock.patch(f'{self.module}.connections.close_all'), \
+                mock.patch(f'{self.module}.freeze_poll_by_id', side_effect=freeze):
+            report = self.run_command('--workers', '2')
+
+        self.assertEqual(report['counts'], {'frozen': 1, 'error': 1})
+        errors = [summary for summary in report['polls'] if summary['status'] == 'error']
+        self.assertEqual(errors, [{'poll': failing.id, 'status': 'error', 'error': 'database is locked'}])
+        self.assertIn({'poll': ok.id, 'status': 'frozen'}, report['polls'])
+
+    def test_celery_group_results_and_timeout(self):
+        done, failed, stuck = (self.create_poll(ended=True) for _ in range(3))
+
+        def child(ready, successful=True, result=None):
+            return mock.Mock(ready=mock.Mock(return_value=ready),
+                             successful=mock.Mock(return_value=successful), result=result)
+
+        results = [
+            child(True, result={'poll': done.id, 'status': 'frozen'}),
+            child(True, successful=False, result=RuntimeError('boom')),
+            child(False),
+        ]
+        with mock.patch('celery.group') as group:
+            group.return_value.apply_async.return_value.results = results
+            started = time.monotonic()
+            report = self.run_command('--backend', 'celery', '--timeout', '0.3')
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(report['polls'], [
+            {'poll': done.id, 'status': 'frozen'},
+            {'poll': failed.id, 'status': 'error', 'error': 'boom'},
+            {'poll': stuck.id, 'status': 'error', 'error': 'No result from Celery within 0.3s'},
+        ])
+
+
+@override_settings(RESULTS_NOTIFICATION_CHUNK_SIZE=2)
+class ResultsNotificationTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = self.create_poll(ended=True)
+        self.candidate = Candidate.objects.first()
+        self.cast_votes(self.candidate, 5)
+        User.objects.filter(votes__isnull=False).update(email='voter@example.com')
+        freeze_poll_results(self.poll)
+
+    def test_voters_are_emailed_in_batches_over_one_connection_each(self):
+        connections = []
+
+        def send(batch_id):
+            with mock.patch('polls.notifications.get_connection', wraps=mail.get_connection) as get_connection:
+                send_notification_batch(batch_id)
+            connections.append(get_connection.call_count)
+
+        self.assertEqual(dispatch_results_notification(self.poll.id, send), 3)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(connections, [1, 1, 1])
+        self.assertIn(self.candidate.name, mail.outbox[0].body)
+
+    def test_retry_resumes_without_resending(self):
+        def fail_after_first(batch_id):
+            if ResultNotificationBatch.objects.filter(sent_at__isnull=False).exists():
+                raise RuntimeError('worker lost')
+            send_notification_batch(batch_id)
+
+        with self.assertRaises(RuntimeError):
+            dispatch_results_notification(self.poll.id, fail_after_first)
+        self.assertEqual(len(mail.outbox), 2)
+
+        dispatch_results_notification(self.poll.id, send_notification_batch)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(ResultNotificationBatch.objects.filter(sent_at__isnull=True).exists())
+
+    def test_overlapping_dispatches_email_each_voter_once(self):
+        handed_out = []
+        dispatch_results_notification(self.poll.id, handed_out.append)
+        dispatch_results_notification(self.poll.id, handed_out.append)
+        self.assertEqual(len(handed_out), 6)
+
+        # A worker is part way through the first batch when its duplicate arrives
+        self.assertIsNotNone(claim_batch(handed_out[0]))
+        self.assertEqual([send_notification_batch(batch_id) for batch_id in handed_out], [0, 2, 1, 0, 0, 0])
+        self.assertEqual(len(mail.outbox), 3)
+
+        # Until the claim expires, taken to mean its worker died
+        with override_settings(RESULTS_NOTIFICATION_CLAIM_TIMEOUT=0):
+            self.assertEqual(send_notification_batch(handed_out[0]), 2)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_failed_send_releases_its_claim(self):
+        handed_out = []
+        dispatch_results_notification(self.poll.id, handed_out.append)
+        batch_id = handed_out[0]
+
+        with mock.patch('polls.notifications.get_connection', side_effect=OSError('smtp down')):
+            with self.assertRaises(OSError):
+                send_notification_batch(batch_id)
+
+        self.assertEqual(send_notification_batch(batch_id), 2)
+
+
+class SeedElectionTests(PollTestCase):
+    def seed(self, prefix):
+        call_command('seed_election', '--seed', '7', '--voters', '40', '--positions', '2', '--candidates', '5',
+                     '--prefix', prefix, '--chunk-size', '16', stdout=StringIO())
+        poll = Poll.objects.latest('id')
+        return sorted(Vote.objects.filter(position__poll=poll).values_list('voter__username', 'candidate__name'))
+
+    def test_seeding_is_deterministic_and_keeps_tallies_in_step(self):
+        first = self.seed('a')
+        second = self.seed('a')
+
+        self.assertTrue(first)
+        # Same voters pick the same candidate slots; reruns reuse the accounts
+        self.assertEqual(
+            [(user, candidate.split('-')[1]) for user, candidate in first],
+            [(user, candidate.split('-')[1]) for user, candidate in second],
+        )
+        self.assertEqual(User.objects.filter(username__startswith='a-').count(), 40)
+        self.assertEqual(sum(VoteTally.objects.values_list('count', flat=True)), Vote.objects.count())
+
+    def test_votes_keep_their_generated_timestamps(self):
+        self.seed('a')
+        poll = Poll.objects.latest('id')
+
+        timestamps = Vote.objects.filter(position__poll=poll).values_list('timestamp', flat=True)
+        self.assertGreater(len(set(timestamps)), 1)
+        self.assertTrue(all(poll.start_time <= timestamp <= poll.end_time for timestamp in timestamps))
+        # Votes cast through the ORM are still stamped with the current time
+        self.assertTrue(Vote._meta.get_field('timestamp').auto_now_add)
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = MetricsRegistry()
+        patcher = mock.patch('polls.metrics.registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_requests_are_timed_per_view_and_exposed(self):
+        poll = self.create_poll()
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('voter'))
+
+        response = client.get(reverse('poll-detail', args=[poll.id]))
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="poll-detail",method="GET"} 1', metrics)
+        self.assertRegex(metrics, r'http_request_db_queries_total\{view="poll-detail",method="GET"\} [1-9]')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint_requires_token_when_configured(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['10.0.0.0/8'])
+    def test_metrics_endpoint_is_closed_unless_allowlisted(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 200)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_async_requests_count_queries_run_on_other_threads(self):
+        main_thread = threading.get_ident()
+        threads = []
+
+        def view(request):
+            # Under ASGI a sync view runs through sync_to_async, on another
+            # thread with its own connection
+            threads.append(threading.get_ident())
+            request.resolver_match = mock.Mock(url_name='sync-view')
+            try:
+                Poll.objects.exists()
+                Position.objects.exists()
+            finally:
+                connection.close()
+            return HttpResponse('ok')
+
+        middleware = MetricsMiddleware(sync_to_async(view, thread_sensitive=False))
+        response = asyncio.run(middleware(RequestFactory().get('/')))
+
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertNotEqual(threads, [main_thread])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        labels = (('view', 'sync-view'), ('method', 'GET'))
+        self.assertEqual(self.registry.counters[('http_request_db_queries_total', labels)], 2)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_requests_are_not_timed_unless_enabled(self):
+        response = APIClient().get(reverse('poll-list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.registry.counters, {})
+
+    def test_nested_timers_each_count_the_queries(self):
+        with timed_queries(QueryTimer()) as outer:
+            Poll.objects.count()
+            with timed_queries(QueryTimer()) as inner:
+                Poll.objects.count()
+
+        self.assertEqual((outer.count, inner.count), (2, 1))
+
+    def test_celery_tasks_are_timed_per_task_and_state(self):
+        poll = self.create_poll(ended=True)
+
+        freeze_results.apply(args=[poll.id])
+        with mock.patch('polls.tasks.freeze_poll_by_id', side_effect=DatabaseError('primary down')):
+            freeze_results.apply(args=[poll.id], throw=False)
+
+        counters = self.registry.counters
+        task = (('task', freeze_results.name),)
+        self.assertEqual(counters[('celery_tasks_total', task + (('state', 'SUCCESS'),))], 1)
+        self.assertEqual(counters[('celery_tasks_total', task + (('state', 'FAILURE'),))], 1)
+        self.assertGreater(counters[('celery_task_db_queries_total', task)], 0)
+        self.assertEqual(self.registry.histograms[('celery_task_duration_seconds', task)][-1], 2)
+
+
+class CandidateImageTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), color=(200, 30, 30)).save(buffer, 'JPEG')
+        position = self.create_poll(candidates=0).positions.get()
+        with mock.patch('polls.tasks.process_candidate_picture.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                candidate = Candidate.objects.create(
+                    position=position, name='Ann', description='',
+                    profile_picture=SimpleUploadedFile('ann.jpg', buffer.getvalue(), content_type='image/jpeg'),
+                )
+        delay.assert_called_once_with(candidate.pk)  # resizing is queued, not done inline
+        return candidate
+
+    def test_variants_are_generated_and_exposed_as_srcset(self):
+        candidate = self.upload()
+        self.assertIsNone(CandidateSerializer(candidate).data['images'])
+
+        self.assertTrue(process_candidate_image(candidate))
+        self.assertFalse(process_candidate_image(candidate))
+
+        images = CandidateSerializer(candidate).data['images']
+        self.assertEqual(set(images), {'webp', 'jpeg'})
+        self.assertEqual(images['webp']['srcset'].count('w,'), 2)
+        with Image.open(candidate.profile_picture.storage.path(candidate.image_variants['jpeg']['150'])) as variant:
+            self.assertEqual(variant.size, (150, 150))
+
+        name = candidate.image_variants['webp']['96']
+        response = serve_media(RequestFactory().get(f'/media/{name}'), name)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_upload_is_kept_when_the_broker_is_down(self):
+        with mock.patch('polls.tasks.process_candidate_picture.delay', side_effect=OSError('broker down')):
+            with self.assertLogs('polls.signals', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    candidate = Candidate.objects.create(
+                        position=self.create_poll(candidates=0).positions.get(), name='Ann', description='',
+                        profile_picture=SimpleUploadedFile('ann.jpg', b'not yet processed', content_type='image/jpeg'),
+                    )
+
+        self.assertTrue(Candidate.objects.filter(pk=candidate.pk).exists())
+        self.assertIsNone(CandidateSerializer(candidate).data['images'])
+
+
+class PollExportTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = self.create_poll(ended=True)
+        self.candidate = Candidate.objects.filter(position__poll=self.poll).first()
+        self.cast_votes(self.candidate, 5)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', role=User.Role.ADMIN))
+        self.url = reverse('poll-export', kwargs={'pk': self.poll.pk})
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_votes_are_read_in_keyset_chunks(self):
+        chunks = list(iter_votes([self.poll.id], chunk_size=2))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        ids = [row[0] for chunk in chunks for row in chunk]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_votes_stream_as_gzipped_csv(self):
+        response = self.client.get(self.url, {'gzip': '1'})
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn(f'poll-{self.poll.pk}-votes.csv.gz', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(gzip.decompress(self.read(response)).decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['candidate'] for row in rows}, {self.candidate.name})
+
+    def test_tallies_stream_as_ndjson(self):
+        response = self.client.get(self.url, {'table': 'tallies', 'output': 'ndjson'})
+
+        rows = [json.loads(line) for line in self.read(response).decode().splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['candidate_id'], self.candidate.id)
+        self.assertEqual((rows[0]['vote_count'], rows[0]['winner']), (5, True))
+
+    def test_export_is_admin_only_and_validates_options(self):
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, 400)
+
+        self.client.force_authenticate(User.objects.create_user('voter'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class AdminScalingTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('root', 'root@example.com', 'pw'))
+        self.poll = self.create_poll()
+
+    def changelist_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_vote_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:polls_vote_changelist')
+        candidate = Candidate.objects.filter(position__poll=self.poll).first()
+        self.cast_votes(candidate, 2)
+        few = self.changelist_queries(url)
+
+        self.cast_votes(candidate, 20)
+        self.assertEqual(self.changelist_queries(url), few)
+
+    def test_position_filter_lists_only_the_chosen_polls_positions(self):
+        other = self.create_poll(positions=2)
+        url = reverse('admin:polls_candidate_changelist')
+
+        response = self.client.get(url)
+        self.assertNotContains(response, f'?position={other.positions.first().id}')
+
+        response = self.client.get(url, {'position__poll__id__exact': other.id})
+        for position in other.positions.all():
+            self.assertContains(response, f'position={position.id}')
+
+    def test_paginator_trusts_large_estimates_only(self):
+        votes = Vote.objects.order_by('id')
+        with mock.patch('polls.pagination.estimate_count', return_value=5_000_000):
+            self.assertEqual(EstimatedCountPaginator(votes, 100).count, 5_000_000)
+        with mock.patch('polls.pagination.estimate_count', return_value=10):
+            self.assertEqual(EstimatedCountPaginator(votes, 100).count, 0)
+        # No planner statistics on SQLite: exact count
+        self.assertEqual(EstimatedCountPaginator(votes, 100).count, 0)
+
+
+class TurnoutRollupTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = self.create_poll(positions=2, candidates=1)
+        self.poll.start_time = self.poll.start_time.replace(second=0, microsecond=0)
+        self.poll.save()
+        self.first, self.second = Candidate.objects.filter(position__poll=self.poll).order_by('id')
+
+    def vote_at(self, candidate, count, minutes):
+        """Cast votes stamped ``minutes`` after the poll started"""
+        before = Vote.objects.aggregate(id=Max('id'))['id'] or 0
+        self.cast_votes(candidate, count)
+        Vote.objects.filter(id__gt=before).update(timestamp=self.poll.start_time + timezone.timedelta(minutes=minutes, seconds=30))
+
+    def test_only_votes_past_the_high_water_mark_are_rolled_up(self):
+        self.vote_at(self.first, 3, minutes=1)
+        self.vote_at(self.second, 2, minutes=1)
+        self.assertEqual(roll_up_votes(settle=0), 5)
+
+        self.vote_at(self.first, 4, minutes=1)
+        self.vote_at(self.first, 1, minutes=7)
+        self.assertEqual(roll_up_votes(settle=0, batch_size=2), 5)
+
+        buckets = TurnoutBucket.objects.filter(position=self.first.position).order_by('minute')
+        self.assertEqual([bucket.votes for bucket in buckets], [7, 1])
+        self.assertEqual(roll_up_votes(settle=0), 0)
+
+    def test_rollup_waits_for_recent_votes_to_settle(self):
+        self.vote_at(self.first, 2, minutes=0)
+
+        self.assertEqual(roll_up_votes(settle=60), 0)
+        self.assertEqual(roll_up_votes(settle=60), 0)
+
+        RollupCursor.objects.update(seen_at=timezone.now() - timezone.timedelta(minutes=2))
+        self.assertEqual(roll_up_votes(settle=60), 2)
+
+    def test_series_is_downsampled_and_zero_filled(self):
+        self.vote_at(self.first, 3, minutes=1)
+        self.vote_at(self.second, 2, minutes=2)
+        self.vote_at(self.first, 1, minutes=9)
+        roll_up_votes(settle=0)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('admin', role=User.Role.ADMIN))
+        url = reverse('poll-turnout', kwargs={'pk': self.poll.pk})
+        end = (self.poll.start_time + timezone.timedelta(minutes=15)).isoformat()
+
+        data = client.get(url, {'interval': 5, 'end': end}).json()
+        self.assertEqual([point['votes'] for point in data['points']], [5, 1, 0])
+        self.assertEqual(data['total'], 6)
+
+        data = client.get(url, {'interval': 5, 'end': end, 'position': self.first.position_id}).json()
+        self.assertEqual([point['votes'] for point in data['points']], [3, 1, 0])
+
+
+@mock.patch('polls.tasks.notify_poll_results.delay')
+class PollTimerTests(PollTestCase):
+    def timers(self, poll):
+        return {timer.event: timer for timer in poll.timers.all()}
+
+    def test_timers_follow_the_poll_schedule(self, notify):
+        poll = self.create_poll()
+        close = self.timers(poll)['close']
+        self.assertEqual(close.due_at, poll.end_time)
+
+        poll.title = 'Renamed'
+        poll.save()
+        poll.save()
+        self.assertEqual(PollTimer.objects.filter(poll=poll).count(), 2)
+
+        poll.duration = 5
+        poll.save()
+        close = self.timers(poll)['close']
+        self.assertEqual((close.due_at, close.run_at), (poll.end_time, poll.end_time))
+
+    def test_reopened_poll_drops_its_frozen_results(self, notify):
+        poll = self.create_poll(ended=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            run_due_timers()
+        self.assertTrue(PollResultSnapshot.objects.filter(poll=poll).exists())
+
+        poll.duration = 5
+        poll.save()
+
+        self.assertFalse(PollResultSnapshot.objects.filter(poll=poll).exists())
+        close = self.timers(poll)['close']
+        self.assertEqual((close.status, close.due_at), (PollTimer.Status.PENDING, poll.end_time))
+
+    def test_close_runs_once(self, notify):
+        poll = self.create_poll(ended=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_due_timers(), 2)
+            self.assertEqual(run_due_timers(), 0)
+
+        self.assertTrue(PollResultSnapshot.objects.filter(poll=poll).exists())
+        notify.assert_called_once_with(poll.id)
+        self.assertEqual({timer.status for timer in self.timers(poll).values()}, {PollTimer.Status.DONE})
+
+    def test_failed_close_is_rolled_back_and_retried_later(self, notify):
+        poll = self.create_poll(ended=True)
+
+        with mock.patch('polls.results.compute_poll_results', side_effect=DatabaseError('deadlock')):
+            with self.assertLogs('polls.timers', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+                run_due_timers()
+
+        close = self.timers(poll)['close']
+        self.assertEqual((close.status, close.attempts), (PollTimer.Status.PENDING, 1))
+        self.assertGreater(close.run_at, timezone.now())
+        self.assertFalse(PollResultSnapshot.objects.filter(poll=poll).exists())
+        notify.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            run_due_timers(now=close.run_at)
+        self.assertEqual(self.timers(poll)['close'].status, PollTimer.Status.DONE)
+        notify.assert_called_once_with(poll.id)
+
+    def test_close_stays_pending_until_results_emails_are_enqueued(self, notify):
+        poll = self.create_poll(ended=True)
+        notify.side_effect = ConnectionError('broker down')
+
+        with self.assertLogs('polls.timers', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            run_due_timers()
+
+        close = self.timers(poll)['close']
+        self.assertEqual((close.status, close.attempts), (PollTimer.Status.PENDING, 1))
+        self.assertEqual(close.last_error, 'broker down')
+        self.assertTrue(PollResultSnapshot.objects.filter(poll=poll).exists())
+
+        notify.side_effect = None
+        with self.captureOnCommitCallbacks(execute=True):
+            run_due_timers(now=close.run_at)
+        self.assertEqual(self.timers(poll)['close'].status, PollTimer.Status.DONE)
+        self.assertEqual(notify.call_count, 2)
+        notify.assert_called_with(poll.id)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+@mock.patch('polls.routing.is_available', return_value=True)
+class ReplicaCacheFillTests(PollTestCase):
+    """Against a replica that lags: a separate database holding an old copy of the polls"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A connection made outside settings.DATABASES isn't wrapped in the
+        # test transaction, so it really doesn't see the tests' writes
+        cls.replica_dir = tempfile.mkdtemp()
+        primary = connections['default']
+        settings_dict = dict(primary.settings_dict, NAME=f'{cls.replica_dir}/replica.sqlite3')
+        connections['replica1'] = primary.__class__(settings_dict, alias='replica1')
+        with connections['replica1'].schema_editor() as editor:
+            for model in (Poll, Position, Candidate):
+                editor.create_model(model)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica1'].close()
+        del connections['replica1']
+        shutil.rmtree(cls.replica_dir)
+        super().tearDownClass()
+
+    def get(self, url):
+        """GET through the routing middleware, as a voter who hasn't written anything"""
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(f'voter-{User.objects.count()}'))
+        with self.modify_settings(MIDDLEWARE={'append': 'polls.routing.ReplicaRoutingMiddleware'}):
+            return client.get(url)
+
+    def test_shared_cache_entries_are_filled_from_the_primary(self, available):
+        poll = self.create_poll()
+        position = poll.positions.get()
+        # The replica has the poll as it was before a candidate was added
+        Poll.objects.using('replica1').bulk_create([poll])
+        Position.objects.using('replica1').bulk_create([position])
+        Candidate.objects.using('replica1').bulk_create(list(position.candidates.all()))
+        with self.captureOnCommitCallbacks(execute=True):
+            added = Candidate.objects.create(position=position, name='Late entry', description='')
+
+        detail = self.get(reverse('poll-detail', args=[poll.id]))
+        self.assertIn(added.id, [c['id'] for c in detail.json()['positions'][0]['candidates']])
+        self.assertEqual(get_ballot_metadata(poll.id).candidate_position(added.id), position.id)
+        # Cache hits for everyone else get the fresh payload too
+        self.assertEqual(self.get(reverse('poll-detail', args=[poll.id])).json(), detail.json())
+
+        # Uncached reads still go to the replica
+        self.assertEqual(self.get(reverse('poll-results', args=[poll.id])).status_code, 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            Poll.objects.filter(pk=poll.pk).update(title='Renamed')
+            bump_poll_list_version()
+        self.assertEqual(self.get(reverse('poll-list')).json()['results'][0]['title'], 'Election')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+@mock.patch('polls.routing.is_available', return_value=True)
+class ReplicaRoutingTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.voter = User.objects.create_user('voter')
+        self.router = ReplicaRouter()
+
+    def request(self, method, user=None, model=Poll, status=200):
+        """Run a request through the middleware; returns where ``model`` was read from"""
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(model))
+            return HttpResponse(status=status)
+
+        request = getattr(RequestFactory(), method)('/api/polls/')
+        request.user = user or AnonymousUser()
+        ReplicaRoutingMiddleware(view)(request)
+        return seen[0]
+
+    def test_read_only_requests_read_polls_from_a_replica(self, available):
+        self.assertEqual(self.request('get'), 'replica1')
+        self.assertIsNone(self.request('get', model=Vote))
+        self.assertIsNone(self.request('post'))
+        self.assertIsNone(self.router.db_for_read(Poll))  # outside requests
+        self.assertFalse(self.router.allow_migrate('replica1', 'polls'))
+
+    def test_users_read_their_own_writes(self, available):
+        other = User.objects.create_user('other')
+        self.assertEqual(self.request('get', self.voter), 'replica1')
+
+        self.request('post', self.voter, status=400)
+        self.assertEqual(self.request('get', self.voter), 'replica1')
+
+        self.request('post', self.voter)
+        self.assertIsNone(self.request('get', self.voter))
+        self.assertEqual(self.request('get', other), 'replica1')
+
+    def test_primary_is_used_when_forced_or_replicas_are_down(self, available):
+        with use_primary():
+            self.assertIsNone(self.request('get'))
+
+        available.return_value = False
+        self.assertIsNone(self.request('get'))
+
+    def test_async_views_are_routed_without_a_thread_hop(self, available):
+        seen = []
+
+        async def view(request):
+            seen.append(await sync_to_async(self.router.db_for_read)(Poll))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        request = RequestFactory().get('/api/polls/')
+        request.user = AnonymousUser()
+        asyncio.run(middleware(request))
+
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertEqual(seen, ['replica1'])
+
+
+class BenchmarkReportTests(TestCase):
+    def test_summary_reports_nearest_rank_percentiles(self):
+        samples = [(float(ms), 3) for ms in range(1, 101)]
+
+        stats = summarize(samples, errors=2, elapsed=2.0)
+
+        self.assertEqual(stats['requests'], 102)
+        self.assertEqual(stats['throughput_rps'], 50.0)
+        self.assertEqual((stats['latency_ms']['p50'], stats['latency_ms']['p95'], stats['latency_ms']['p99']), (50.0, 95.0, 99.0))
+        self.assertEqual(stats['queries_per_request'], {'mean': 3.0, 'max': 3})
+
+    def test_requests_use_a_host_the_settings_allow(self):
+        with override_settings(ALLOWED_HOSTS=['*', '.example.com', 'vote.example.com']):
+            self.assertEqual(bench_host(), 'vote.example.com')
+        with override_settings(ALLOWED_HOSTS=['*']):
+            self.assertEqual(bench_host(), 'localhost')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkRunTests(TransactionTestCase):
+    # Requests are sent from worker threads, which need committed data
+    def test_login_queries_on_the_hashing_pool_are_counted(self):
+        command = BenchVotingCommand()
+        command.host, command.tag = 'localhost', 'test'
+        command.seed(2, positions=1, candidates=2)
+
+        stats = command.run(command.request_login, 2, 1)
+
+        self.assertEqual(stats['errors'], 0)
+        # The user lookup runs on a pool thread, not the request's
+        self.assertGreaterEqual(stats['queries_per_request']['max'], 1)
+
+
+class PollListTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('voter'))
+        self.url = reverse('poll-list')
+
+    def ids(self, **params):
+        return [poll['id'] for poll in self.client.get(self.url, params).json()['results']]
+
+    def test_status_filter_follows_the_generated_end_time(self):
+        active = self.create_poll()
+        ended = self.create_poll(ended=True)
+        upcoming = Poll.objects.create(title='Later', start_time=timezone.now() + timezone.timedelta(days=1), duration=2)
+
+        self.assertEqual(self.ids(status='active'), [active.id])
+        self.assertEqual(self.ids(status='ended'), [ended.id])
+        self.assertEqual(self.ids(status='upcoming'), [upcoming.id])
+        self.assertEqual(self.client.get(self.url, {'status': 'closed'}).status_code, 400)
+
+        # Queryset updates skip save(); the database still recomputes end_time
+        Poll.objects.filter(pk=ended.pk).update(duration=5)
+        self.assertEqual(self.ids(status='active'), [active.id, ended.id])
+        ended.refresh_from_db()
+        self.assertEqual(ended.end_time, ended.compute_end_time())
+
+    def test_cursor_pages_are_stable_across_ties_and_inserts(self):
+        start = timezone.now() - timezone.timedelta(hours=1)
+        polls = [Poll.objects.create(title=f'Poll {i}', start_time=start, duration=2) for i in range(5)]
+
+        first = self.client.get(self.url, {'page_size': 2}).json()
+        # A poll created while paging lands before the cursor, not on a later page
+        Poll.objects.create(title='Newest', start_time=timezone.now(), duration=2)
+        pages = [first]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+
+        seen = [poll['id'] for page in pages for poll in page['results']]
+        self.assertEqual(seen, sorted((poll.id for poll in polls), reverse=True))
+        self.assertEqual(self.client.get(pages[-1]['previous']).json()['results'], pages[-2]['results'])
+        self.assertEqual(self.client.get(self.url, {'cursor': 'cD1bInNvb24iLDFd'}).status_code, 404)
+
+
+class MigrationTestCase(TransactionTestCase):
+    def migrate(self, *targets):
+        executor = MigrationExecutor(connection)
+        targets = list(targets) or executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+
+class PollEndTimeMigrationTests(MigrationTestCase):
+    def test_end_time_is_generated_for_existing_polls(self):
+        start = timezone.now().replace(microsecond=123456) - timezone.timedelta(days=3)
+        end = start + timezone.timedelta(hours=3)
+        apps = self.migrate(('polls', '0004_pollresultsnapshot'))
+        self.addCleanup(self.migrate)
+        poll = apps.get_model('polls', 'Poll').objects.create(title='Old', start_time=start, duration=3)
+
+        apps = self.migrate(('polls', '0005_poll_end_time'))
+        self.assertEqual(apps.get_model('polls', 'Poll').objects.get(pk=poll.pk).end_time, end)
+
+        self.migrate()
+        self.assertEqual(Poll.objects.get(pk=poll.pk).end_time, end)
+        self.assertEqual(list(Poll.objects.ended()), [Poll.objects.get(pk=poll.pk)])
+
+
+class VoteTallyMigrationTests(MigrationTestCase):
+    def test_tallies_are_backfilled_from_existing_votes(self):
+        apps = self.migrate(('polls', '0002_remove_candidate_poll_alter_vote_unique_together_and_more'))
+        self.addCleanup(self.migrate)
+        model = apps.get_model
+        poll = model('polls', 'Poll').objects.create(title='Old', start_time=timezone.now(), duration=3)
+        position = model('polls', 'Position').objects.create(poll=poll, title='Chair')
+        voted, _ = (model('polls', 'Candidate').objects.create(position=position, name=name) for name in 'AB')
+        model('polls', 'Vote').objects.bulk_create(
+            model('polls', 'Vote')(voter=model('accounts', 'User').objects.create(username=f'voter-{i}'),
+                                   position=position, candidate=voted)
+            for i in range(3)
+        )
+
+        apps = self.migrate(('polls', '0003_votetally'))
+
+        self.assertEqual(
+            list(apps.get_model('polls', 'VoteTally').objects.values_list('candidate_id', 'shard', 'count')),
+            [(voted.id, 0, 3)],
+        )
+
+
+class PollDetailCacheTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('voter'))
+
+    def test_detail_is_served_from_cache_until_ballot_changes(self):
+        poll = self.create_poll(positions=3, candidates=3)
+        url = reverse('poll-detail', args=[poll.id])
+
+        # Ballot metadata (for the ETag) plus one prefetched detail load
+        with self.assertNumQueries(5):
+            first = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(first.json(), cached.json())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Candidate.objects.filter(position__poll=poll).first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(len(p['candidates']) for p in response.json()['positions']), 8)
+
+    def test_list_validator_changes_once_poll_edit_commits(self):
+        poll = self.create_poll()
+        url = reverse('poll-list')
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            poll.title = 'Renamed'
+            poll.save()
+            # A list read before the commit still sees the old version
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['title'], 'Renamed')
+
+    def test_list_is_revalidated_by_last_modified_until_an_edit_commits(self):
+        poll = self.create_poll()
+        url = reverse('poll-list')
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        # A second later, as HTTP dates only have whole seconds
+        with mock.patch('polls.cache.time.time', return_value=time.time() + 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                poll.title = 'Renamed'
+                poll.save()
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(parse_http_date(response['Last-Modified']), parse_http_date(last_modified))
+
+    def test_list_validators_change_when_a_poll_opens(self):
+        start = timezone.now() + timezone.timedelta(minutes=5)
+        Poll.objects.create(title='Upcoming', start_time=start, duration=2)
+        url = reverse('poll-list')
+        first = self.client.get(url, {'status': 'active'})
+        self.assertEqual(first.json()['results'], [])
+
+        later = start + timezone.timedelta(seconds=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            with self.assertNumQueries(2):  # the schedule aggregate, then the page
+                response = self.client.get(
+                    url, {'status': 'active'},
+                    HTTP_IF_NONE_MATCH=first['ETag'], HTTP_IF_MODIFIED_SINCE=first['Last-Modified'],
+                )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([poll['title'] for poll in response.json()['results']], ['Upcoming'])
+        self.assertEqual(parse_http_date(response['Last-Modified']), math.ceil(start.timestamp()))
+
+    def test_detail_is_revalidated_by_last_modified_until_the_ballot_changes(self):
+        poll = self.create_poll()
+        url = reverse('poll-detail', args=[poll.id])
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        with mock.patch('polls.cache.time.time', return_value=time.time() + 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                Candidate.objects.create(position=poll.positions.get(), name='Late entry', description='')
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['positions'][0]['candidates']), 3)
+
+
+@override_settings(VOTE_INGESTION_MODE='queued', VOTE_INGESTION_QUEUE_URL='memory://', CELERY_TASK_ALWAYS_EAGER=True)
+class QueuedVoteIngestionTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('polls.ingest._queue', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.poll = self.create_poll()
+        self.position = self.poll.positions.get()
+        self.candidate = self.position.candidates.first()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('voter'))
+
+    def vote(self):
+        return self.client.post(
+            reverse('poll-vote', args=[self.poll.id]),
+            {'position': self.position.id, 'candidate': self.candidate.id},
+            format='json',
+        )
+
+    def test_queued_votes_are_written_on_drain_and_duplicates_rejected(self):
+        accepted = self.vote()
+        duplicate = self.vote()
+        self.assertEqual(accepted.status_code, 202)
+        self.assertEqual(duplicate.status_code, 202)
+        self.assertFalse(Vote.objects.exists())
+
+        stats = drain_queue(batch_size=10)
+
+        self.assertEqual((stats['recorded'], stats['rejected']), (1, 1))
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(compute_poll_results(self.poll)['total_votes'], 1)
+        statuses = [self.client.get(r.json()['status_url']).json()['status'] for r in (accepted, duplicate)]
+        self.assertEqual(statuses, ['recorded', 'rejected'])
+
+    def test_ticket_is_returned_even_if_the_cache_drops_it(self):
+        with mock.patch('polls.ingest.cache.set'):
+            response = self.vote()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(len(get_vote_queue()), 1)
+
+    def test_memory_queue_is_refused_when_workers_run_elsewhere(self):
+        self.assertEqual(check_vote_queue(), [])
+
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=False):
+            self.assertEqual([error.id for error in check_vote_queue()], ['polls.E001'])
+            with self.assertRaises(ImproperlyConfigured):
+                get_vote_queue()
+            with override_settings(VOTE_INGESTION_QUEUE_URL='redis://localhost:6379/0'):
+                self.assertEqual(check_vote_queue(), [])
+
+    def test_votes_claimed_by_a_dead_drain_are_redelivered(self):
+        response = self.vote()
+        queue = get_vote_queue()
+        # A drain that claims the vote and dies before acking it
+        queue.claim(10)
+        self.assertEqual(len(queue), 0)
+
+        with override_settings(VOTE_INGESTION_CLAIM_TIMEOUT=0):
+            stats = drain_queue(batch_size=10)
+
+        self.assertEqual((stats['requeued'], stats['recorded']), (1, 1))
+        self.assertEqual(self.client.get(response.json()['status_url']).json()['status'], 'recorded')
+        self.assertEqual(drain_queue(batch_size=10)['requeued'], 0)
+
+    def test_failed_batches_are_put_back(self):
+        self.vote()
+
+        with mock.patch('polls.ingest.process_batch', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                drain_queue(batch_size=10)
+
+        self.assertEqual(drain_queue(batch_size=10)['recorded'], 1)
+
+    def test_results_freeze_after_queued_votes_drain(self):
+        poll = self.create_poll(ended=True)
+        position = poll.positions.get()
+        candidate = position.candidates.first()
+        voter = User.objects.get(username='voter')
+        with mock.patch('polls.ingest.time.time', return_value=(poll.end_time - timezone.timedelta(minutes=1)).timestamp()):
+            enqueue_vote(poll.id, voter.id, position.id, candidate.id)
+
+        with override_settings(VOTE_INGESTION_CLOSE_GRACE=2 * 60 * 60):
+            self.assertIsNone(freeze_poll_results(poll))
+        drain_queue(batch_size=10)
+        snapshot = freeze_poll_results(poll)
+
+        self.assertEqual(snapshot.total_votes, 1)
+
+    def test_votes_drained_after_freeze_are_rejected(self):
+        poll = self.create_poll(ended=True)
+        position = poll.positions.get()
+        candidate = position.candidates.first()
+        voter = User.objects.get(username='voter')
+        with mock.patch('polls.ingest.time.time', return_value=(poll.end_time - timezone.timedelta(minutes=1)).timestamp()):
+            ticket = enqueue_vote(poll.id, voter.id, position.id, candidate.id)['ticket']
+        snapshot = freeze_poll_results(poll)
+
+        stats = drain_queue(batch_size=10)
+
+        self.assertEqual((stats['recorded'], stats['rejected']), (0, 1))
+        self.assertEqual(get_ticket(ticket)['error'], "Voting has closed for this poll.")
+        self.assertFalse(Vote.objects.filter(position=position).exists())
+        self.assertEqual(PollResultSnapshot.objects.get(poll=poll).etag, snapshot.etag)
+
+    def test_rejections_report_their_reason(self):
+        response = self.vote()
+        self.candidate.delete()
+
+        drain_queue(batch_size=10)
+
+        state = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(state['status'], 'rejected')
+        self.assertEqual(state['error'], "This candidate does not belong to the specified position.")
+
+
+class BallotSubmissionTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = self.create_poll(positions=3)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('voter'))
+        self.url = reverse('poll-ballot', args=[self.poll.id])
+
+    def ballot(self):
+        return [
+            {'position': position.id, 'candidate': position.candidates.first().id}
+            for position in self.poll.positions.order_by('id')
+        ]
+
+    def test_ballot_records_every_position(self):
+        response = self.client.post(self.url, {'votes': self.ballot()}, format='json')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(response.json()['votes']), 3)
+        self.assertEqual(compute_poll_results(self.poll)['total_votes'], 3)
+
+    def test_invalid_choice_rejects_whole_ballot(self):
+        votes = self.ballot()
+        votes[-1]['candidate'] = votes[0]['candidate']
+
+        response = self.client.post(self.url, {'votes': votes}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Vote.objects.exists())
+
+
+class VoteCreateTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = self.create_poll()
+        self.position = self.poll.positions.get()
+        self.candidate = self.position.candidates.first()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('voter'))
+
+    def vote(self):
+        return self.client.post(
+            reverse('poll-vote', args=[self.poll.id]),
+            {'position': self.position.id, 'candidate': self.candidate.id},
+            format='json',
+        )
+
+    def test_vote_writes_without_lookups_once_ballot_is_cached(self):
+        get_ballot_metadata(self.poll.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.vote()
+
+        self.assertEqual(response.status_code, 201, response.content)
+        statements = [q['sql'].split()[0] for q in queries.captured_queries]
+        self.assertNotIn('SELECT', statements)
+        self.assertEqual(statements.count('INSERT'), 2)  # vote + first row of its tally shard
+
+    def test_vote_for_candidate_added_after_ballot_was_cached(self):
+        get_ballot_metadata(self.poll.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.candidate = Candidate.objects.create(position=self.position, name='Late entry', description='')
+
+        response = self.vote()
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Vote.objects.get().candidate, self.candidate)
+
+    @override_settings(BALLOT_METADATA_TTL=0)
+    def test_ballot_metadata_expires_without_a_signal(self):
+        get_ballot_metadata(self.poll.id)
+        # bulk_create sends no post_save, so only expiry picks this up
+        self.candidate, = Candidate.objects.bulk_create(
+            [Candidate(position=self.position, name='Late entry', description='')]
+        )
+
+        self.assertEqual(self.vote().status_code, 201)
+
+    def test_duplicate_vote_is_rejected_by_constraint(self):
+        self.assertEqual(self.vote().status_code, 201)
+        response = self.vote()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'non_field_errors': ['You have already voted for this position.']})
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_other_integrity_errors_are_not_reported_as_duplicates(self):
+        # e.g. a foreign key check failing on PostgreSQL
+        with mock.patch.object(Vote, 'save', side_effect=IntegrityError('foreign key violation')):
+            response = self.vote()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'non_field_errors': ['Your vote could not be recorded.']})
+
+        Candidate.objects.filter(pk=self.candidate.pk).delete()
+        with mock.patch.object(Vote, 'save', side_effect=IntegrityError('foreign key violation')):
+            response = self.vote()
+        self.assertEqual(response.json(),
+                         {'non_field_errors': ['This candidate does not belong to the specified position.']})
+
+
+class VoteTallyTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = self.create_poll()
+        self.candidate = Candidate.objects.first()
+
+    def tally(self):
+        return VoteTally.objects.filter(candidate=self.candidate).aggregate(total=Sum('count'))['total'] or 0
+
+    def test_tally_is_written_in_the_vote_transaction(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('voter'))
+
+        def vote():
+            return client.post(reverse('poll-vote', args=[self.poll.id]),
+                               {'position': self.candidate.position_id, 'candidate': self.candidate.id},
+                               format='json')
+
+        # A failure after the increment takes the vote and its tally down together
+        with mock.patch('polls.serializers.publish_tally_deltas', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            vote()
+        self.assertEqual((Vote.objects.count(), self.tally()), (0, 0))
+
+        self.assertEqual(vote().status_code, 201)
+        self.assertEqual((Vote.objects.count(), self.tally()), (1, 1))
+
+    def test_deleted_votes_are_taken_off_the_tally(self):
+        self.cast_votes(self.candidate, 3)
+
+        Vote.objects.first().delete()
+        self.assertEqual(self.tally(), 2)
+
+        Vote.objects.all().delete()
+        self.assertEqual(self.tally(), 0)
+
+    def test_deleting_a_poll_skips_per_vote_cleanup(self):
+        counts = []
+        for votes in (1, 5):
+            poll = self.create_poll()
+            self.cast_votes(Candidate.objects.filter(position__poll=poll).first(), votes)
+            with CaptureQueriesContext(connection) as queries:
+                Poll.objects.filter(pk=poll.pk).delete()
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        # Other polls' votes are still cleaned up one by one
+        self.cast_votes(self.candidate, 1)
+        Vote.objects.filter(candidate=self.candidate).delete()
+        self.assertEqual(self.tally(), 0)
+
+
+class VotedPositionsTests(PollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poll = self.create_poll(positions=2)
+        self.voter = User.objects.create_user('voter')
+        self.client = APIClient()
+        self.client.force_authenticate(self.voter)
+        self.url = reverse('poll-detail', args=[self.poll.id]) + '?include=voted_positions'
+
+    def test_detail_includes_positions_voted_for(self):
+        first = self.poll.positions.order_by('id').first()
+        self.assertEqual(self.client.get(self.url).json()['voted_positions'], [])
+
+        self.client.post(
+            reverse('poll-vote', args=[self.poll.id]),
+            {'position': first.id, 'candidate': first.candidates.first().id},
+            format='json',
+        )
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()['voted_positions'], [first.id])
+        self.assertNotIn('voted_positions', self.client.get(reverse('poll-detail', args=[self.poll.id])).json())
+
+
+class LiveResultsTests(PollTestCase):
+    def test_hub_streams_committed_vote_deltas(self):
+        poll = self.create_poll()
+        candidate = Candidate.objects.first()
+        bus = InMemoryResultsBus()
+        hub = LiveResultsHub(bus)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        queue = asyncio.Queue()
+
+        with mock.patch('polls.events.get_results_bus', return_value=bus):
+            snapshot = hub.subscribe(poll, loop, queue)
+            client = APIClient()
+            client.force_authenticate(User.objects.create_user('voter'))
+            with self.captureOnCommitCallbacks(execute=True):
+                client.post(
+                    reverse('poll-vote', args=[poll.id]),
+                    {'position': candidate.position_id, 'candidate': candidate.id},
+                    format='json',
+                )
+
+        event = loop.run_until_complete(asyncio.wait_for(queue.get(), timeout=1))
+        self.assertEqual(snapshot['total_votes'], 0)
+        self.assertEqual(event['type'], 'delta')
+        self.assertEqual(event['data']['candidate'], candidate.id)
+        self.assertEqual(event['data']['vote_count'], 1)
+
+    def test_deltas_published_while_the_snapshot_loads_are_not_counted_twice(self):
+        poll = self.create_poll()
+        candidate = Candidate.objects.first()
+        bus = InMemoryResultsBus()
+        hub = LiveResultsHub(bus)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        def compute(poll):
+            # A vote commits and its delta arrives before the snapshot query
+            self.cast_votes(candidate, 1)
+            bus.publish({'poll': poll.id, 'deltas': {str(candidate.id): 1}})
+            return compute_poll_results(poll)
+
+        with mock.patch('polls.events.compute_poll_results', side_effect=compute):
+            snapshot = hub.subscribe(poll, loop, asyncio.Queue())
+
+        self.assertEqual(snapshot['total_votes'], 1)
+        self.assertEqual(snapshot['positions'][0]['candidates'][0]['vote_count'], 1)
+
+    def test_hub_hides_the_outcome_until_the_poll_ends(self):
+        running, ended = self.create_poll(), self.create_poll(ended=True)
+        for poll in (running, ended):
+            self.cast_votes(Candidate.objects.filter(position__poll=poll).first(), 2)
+        hub = LiveResultsHub(InMemoryResultsBus())
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        live = hub.subscribe(running, loop, asyncio.Queue())['positions'][0]
+        final = hub.subscribe(ended, loop, asyncio.Queue())['positions'][0]
+
+        self.assertEqual((live['winner'], live['is_tie'], live['total_votes']), (None, False, 2))
+        self.assertEqual(final['winner']['vote_count'], 2)
+
+    def test_streams_are_opened_with_short_lived_stream_tokens(self):
+        poll, other = self.create_poll(), self.create_poll()
+        admin = User.objects.create_user('admin', role=User.Role.ADMIN)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.post(reverse('poll-results-stream-token', args=[poll.id]))
+        self.assertEqual(response.status_code, 200)
+        token = response.json()['token']
+        self.assertTrue(response.json()['url'].endswith(f'/results/stream/?token={token}'))
+
+        self.assertEqual(_authenticate(RequestFactory().get(f'/?token={token}'), poll.id), admin)
+        self.assertIsNone(read_stream_token(token, other.id))
+        with override_settings(RESULTS_STREAM_TOKEN_MAX_AGE=-1):
+            self.assertIsNone(read_stream_token(token, poll.id))
+        # Long-lived API tokens are no longer accepted in the URL
+        api_token = Token.objects.create(user=admin)
+        self.assertIsNone(_authenticate(RequestFactory().get(f'/?token={api_token.key}'), poll.id))
+        # Logging out revokes stream tokens along with API tokens
+        bump_auth_version(admin.pk)
+        self.assertIsNone(read_stream_token(token, poll.id))
+
+        client.force_authenticate(User.objects.create_user('voter'))
+        self.assertEqual(client.post(reverse('poll-results-stream-token', args=[poll.id])).status_code, 403)
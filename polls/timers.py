@@ -0,0 +1,157 @@
+"""
+Poll lifecycle timers.
+
+Every poll has an open and a close ``PollTimer`` row, kept in step with its
+start and end times on save. A sweeper (the ``sweep_poll_timers`` beat task
+or the ``run_poll_timers`` command) claims due timers one at a time with
+``SELECT ... FOR UPDATE SKIP LOCKED`` and runs the event's work in the same
+transaction that marks the timer done. Concurrent sweepers therefore never
+run the same timer, and work that fails rolls back and is retried with a
+backoff. Nothing waits in the broker, so timers survive broker outages and
+restarts however far ahead they are due. Follow-up work (cache bumps, the
+results emails) is handed on only once the timer's transaction commits; a
+close whose emails can't be enqueued is put back to be retried. Extending
+a poll that has already closed reopens it: its frozen results are dropped
+and taken again at the new close.
+"""
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import PollResultSnapshot, PollTimer
+from .results import freeze_poll_results
+from .cache import bump_ballot_version, bump_poll_list_version
+from .ingest import DEFAULT_CLOSE_GRACE, is_queued_ingestion_enabled
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_SWEEP_LIMIT = 500
+# Seconds before a failed timer is retried, doubled on every attempt
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+
+def first_run_at(event, due_at):
+    """When a timer first runs: closes wait for queued votes to drain"""
+    if event == PollTimer.Event.CLOSE and is_queued_ingestion_enabled():
+        grace = getattr(settings, 'VOTE_INGESTION_CLOSE_GRACE', DEFAULT_CLOSE_GRACE)
+        return due_at + timezone.timedelta(seconds=grace)
+    return due_at
+
+def schedule_poll_timers(poll):
+    """
+    Create the poll's timers, or move them if its start or end changed.
+    Moving a timer re-arms it; a timer that is already due where it is is
+    left alone, so unrelated edits don't schedule anything.
+    """
+    due = {PollTimer.Event.OPEN: poll.start_time, PollTimer.Event.CLOSE: poll.end_time}
+    PollTimer.objects.bulk_create(
+        [
+            PollTimer(poll=poll, event=event, due_at=due_at, run_at=first_run_at(event, due_at))
+            for event, due_at in due.items()
+        ],
+        ignore_conflicts=True,
+    )
+    moved = {}
+    for event, due_at in due.items():
+        # Blocks while a sweeper holds the timer, then re-arms it if it moved
+        moved[event] = PollTimer.objects.filter(poll=poll, event=event).exclude(due_at=due_at).update(
+            due_at=due_at, run_at=first_run_at(event, due_at), status=PollTimer.Status.PENDING,
+            attempts=0, last_error='', fired_at=None,
+        )
+    if moved[PollTimer.Event.CLOSE] and poll.end_time > timezone.now():
+        # Reopened: the frozen results aren't final any more, and would keep
+        # being served (and reject queued votes) until the new close
+        PollResultSnapshot.objects.filter(poll=poll).delete()
+
+def bump_versions_on_commit(poll_id):
+    transaction.on_commit(lambda: bump_ballot_version(poll_id))
+    transaction.on_commit(bump_poll_list_version)
+
+def open_poll(poll):
+    """Rebuild cached ballots and lists now that voting has started"""
+    bump_versions_on_commit(poll.id)
+
+def close_poll(poll):
+    """Freeze the final results and tell the voters"""
+    if freeze_poll_results(poll) is None:
+        # Swept at the very instant it ends, or queued votes are still
+        # draining; the retry finds it ready
+        raise RuntimeError("Poll has not ended or still has queued votes to write")
+    bump_versions_on_commit(poll.id)
+    # Only once the snapshot the emails are built from has committed. Sent
+    # batches are never sent again, so a close that runs twice (a retry, or
+    # a poll frozen early by a results request) doesn't email anyone twice.
+    transaction.on_commit(lambda: notify_closed_poll(poll.id))
+
+def notify_closed_poll(poll_id):
+    """
+    Enqueue the results emails. If the broker is down the close timer goes
+    back to pending, so the sweeper runs the close (and this) again later.
+    """
+    from .tasks import notify_poll_results
+
+    try:
+        notify_poll_results.delay(poll_id)
+    except Exception as e:
+        with transaction.atomic():
+            timer = PollTimer.objects.select_for_update().get(poll_id=poll_id, event=PollTimer.Event.CLOSE)
+            record_failure(timer, e, timezone.now())
+            if timer.status != PollTimer.Status.FAILED:
+                timer.status = PollTimer.Status.PENDING
+            timer.save(update_fields=['status', 'attempts', 'last_error', 'run_at'])
+
+HANDLERS = {
+    PollTimer.Event.OPEN: open_poll,
+    PollTimer.Event.CLOSE: close_poll,
+}
+
+def retry_delay(attempts):
+    return timezone.timedelta(seconds=min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+
+def record_failure(timer, error, now):
+    """Schedule a retry of a failed timer, or give up after too many attempts"""
+    timer.attempts += 1
+    timer.last_error = str(error)
+    if timer.attempts >= getattr(settings, 'POLL_TIMER_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        timer.status = PollTimer.Status.FAILED
+        logger.error(f"Giving up on {timer}: {error}")
+    else:
+        timer.run_at = now + retry_delay(timer.attempts)
+        logger.warning(f"{timer} failed (attempt {timer.attempts}), retrying: {error}")
+
+def run_due_timers(limit=None, now=None):
+    """
+    Run up to ``limit`` due timers, each in its own transaction. Returns
+    the number of timers claimed.
+    """
+    limit = limit or getattr(settings, 'POLL_TIMER_SWEEP_LIMIT', DEFAULT_SWEEP_LIMIT)
+    claimed = 0
+
+    while claimed < limit:
+        current = now or timezone.now()
+        with transaction.atomic():
+            timer = (
+                PollTimer.objects
+                .select_for_update(skip_locked=True, of=('self',))
+                .select_related('poll')
+                .filter(status=PollTimer.Status.PENDING, run_at__lte=current)
+                .order_by('run_at', 'id')
+                .first()
+            )
+            if timer is None:
+                break
+            claimed += 1
+
+            try:
+                # Savepoint: a failed event undoes its own work, not the bookkeeping
+                with transaction.atomic():
+                    HANDLERS[timer.event](timer.poll)
+            except Exception as e:
+                record_failure(timer, e, current)
+            else:
+                timer.status = PollTimer.Status.DONE
+                timer.fired_at = current
+            timer.save(update_fields=['status', 'attempts', 'last_error', 'run_at', 'fired_at'])
+
+    return claimed
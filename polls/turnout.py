@@ -0,0 +1,133 @@
+"""
+Turnout time series.
+
+Votes are rolled up into per-position minute buckets (``TurnoutBucket``) by
+a periodic job that only reads votes past a high-water mark, so a run costs
+O(new votes) and a chart reads O(buckets) rows instead of grouping the
+vote table.
+
+Vote ids are handed out when a row is inserted, not when its transaction
+commits, so a lower id can become visible after a higher one. The job
+therefore only rolls up to the newest id it saw on an earlier run at least
+``TURNOUT_ROLLUP_SETTLE`` seconds ago.
+"""
+import math
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+from .models import Vote, TurnoutBucket, RollupCursor
+
+CURSOR_NAME = 'turnout'
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_SETTLE_SECONDS = 5
+MAX_POINTS = 500
+
+def minute_of(timestamp):
+    return timestamp.replace(second=0, microsecond=0)
+
+def get_settle_seconds():
+    return getattr(settings, 'TURNOUT_ROLLUP_SETTLE', DEFAULT_SETTLE_SECONDS)
+
+def _add_to_buckets(rows):
+    """Add ``(id, poll_id, position_id, timestamp)`` vote rows to their buckets"""
+    counts = Counter((poll_id, position_id, minute_of(timestamp)) for _, poll_id, position_id, timestamp in rows)
+    minutes = [minute for _, _, minute in counts]
+    existing = {
+        (bucket.position_id, bucket.minute): bucket
+        for bucket in TurnoutBucket.objects.filter(
+            position_id__in={position_id for _, position_id, _ in counts},
+            minute__range=(min(minutes), max(minutes)),
+        )
+    }
+
+    changed, created = [], []
+    for (poll_id, position_id, minute), votes in counts.items():
+        bucket = existing.get((position_id, minute))
+        if bucket is None:
+            created.append(TurnoutBucket(poll_id=poll_id, position_id=position_id, minute=minute, votes=votes))
+        else:
+            bucket.votes += votes
+            changed.append(bucket)
+    TurnoutBucket.objects.bulk_update(changed, ['votes'], batch_size=500)
+    TurnoutBucket.objects.bulk_create(created, batch_size=500)
+
+def roll_up_votes(batch_size=None, settle=None):
+    """
+    Add votes past the high-water mark to their minute buckets, one batch
+    per transaction. ``settle=0`` rolls up every vote that is visible now,
+    which is only safe while no votes are being written. Returns the
+    number of votes rolled up.
+    """
+    batch_size = batch_size or getattr(settings, 'TURNOUT_ROLLUP_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    settle = get_settle_seconds() if settle is None else settle
+    now = timezone.now()
+    newest = Vote.objects.aggregate(newest=Max('id'))['newest'] or 0
+
+    cursor, _ = RollupCursor.objects.get_or_create(name=CURSOR_NAME)
+    settled = cursor.seen_at is not None and cursor.seen_at <= now - timezone.timedelta(seconds=settle)
+    if not settle:
+        target = newest
+    elif settled:
+        target = cursor.seen_id
+    else:
+        target = cursor.last_id
+
+    processed = 0
+    while True:
+        with transaction.atomic():
+            # Serializes concurrent runs; each batch moves the mark with its counts
+            cursor = RollupCursor.objects.select_for_update().get(name=CURSOR_NAME)
+            if cursor.last_id >= target:
+                break
+            rows = list(
+                Vote.objects
+                .filter(id__gt=cursor.last_id, id__lte=target)
+                .order_by('id')
+                .values_list('id', 'position__poll_id', 'position_id', 'timestamp')[:batch_size]
+            )
+            if rows:
+                _add_to_buckets(rows)
+            cursor.last_id = rows[-1][0] if rows else target
+            cursor.save(update_fields=['last_id', 'updated_at'])
+            processed += len(rows)
+
+    # Note the newest id for a later run, once the previous note is used up
+    if settle and (cursor.seen_at is None or settled):
+        RollupCursor.objects.filter(name=CURSOR_NAME).update(seen_id=newest, seen_at=now)
+    return processed
+
+def turnout_series(poll, start=None, end=None, interval=None, position_id=None):
+    """
+    Votes per ``interval`` minutes from ``start`` to ``end`` (the poll's
+    start to now or its end by default), for the whole poll or one
+    position. Intervals widen so the series has at most ``MAX_POINTS``
+    points; empty intervals are included as zeros.
+    """
+    start = minute_of(start or poll.start_time)
+    end = end or min(timezone.now(), poll.end_time)
+    span = max(0, math.ceil((end - start).total_seconds() / 60))
+    interval = max(interval or 1, math.ceil(span / MAX_POINTS))
+
+    buckets = TurnoutBucket.objects.filter(poll=poll, minute__gte=start, minute__lt=end)
+    if position_id is not None:
+        buckets = buckets.filter(position_id=position_id)
+    points = [0] * math.ceil(span / interval)
+    for minute, votes in buckets.values_list('minute').annotate(votes=Sum('votes')).order_by('minute'):
+        points[int((minute - start).total_seconds() // 60) // interval] += votes
+
+    cursor = RollupCursor.objects.filter(name=CURSOR_NAME).first()
+    return {
+        'poll': poll.id,
+        'position': position_id,
+        'start': start,
+        'end': end,
+        'interval_minutes': interval,
+        'total': sum(points),
+        'points': [
+            {'time': start + timezone.timedelta(minutes=i * interval), 'votes': votes}
+            for i, votes in enumerate(points)
+        ],
+        'updated_at': cursor.updated_at if cursor else None,
+    }
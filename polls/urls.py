@@ -1,9 +1,18 @@
 from django.urls import path
-from .views import PollListView, PollDetailView, VoteCreateView, PollResultsView
+from .streams import poll_results_stream
+from .metrics import metrics_view
+from .views import PollListView, PollDetailView, VoteCreateView, PollResultsView, VoteStatusView, BallotCreateView, PollExportView, PollTurnoutView, PollResultsStreamTokenView
 
 urlpatterns = [
     path('polls/', PollListView.as_view(), name='poll-list'),
     path('polls/<int:pk>/', PollDetailView.as_view(), name='poll-detail'),
     path('polls/<int:pk>/vote/', VoteCreateView.as_view(), name='poll-vote'),
+    path('polls/<int:pk>/ballot/', BallotCreateView.as_view(), name='poll-ballot'),
     path('polls/<int:pk>/results/', PollResultsView.as_view(), name='poll-results'),
+    path('polls/<int:pk>/turnout/', PollTurnoutView.as_view(), name='poll-turnout'),
+    path('polls/<int:pk>/export/', PollExportView.as_view(), name='poll-export'),
+    path('polls/<int:pk>/results/stream/', poll_results_stream, name='poll-results-stream'),
+    path('polls/<int:pk>/results/stream/token/', PollResultsStreamTokenView.as_view(), name='poll-results-stream-token'),
+    path('votes/<uuid:ticket>/', VoteStatusView.as_view(), name='vote-status'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,15 +1,41 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.reverse import reverse
 from django.shortcuts import get_object_or_404
+from django.http import Http404
+from django.db import IntegrityError
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+import hashlib
+import math
 from django.db.models import Count
 from .models import Poll, Position, Candidate, Vote
+from .results import compute_poll_results, freeze_poll_results, hide_outcome
+from .streams import get_stream_token_max_age, make_stream_token
+from .exports import export_response, TABLES, OUTPUTS
+from .turnout import turnout_series
+from .cache import (
+    poll_detail_cache_key, poll_detail_timeout, get_ballot_metadata, get_voted_positions,
+    get_poll_list_validators, get_results_version, get_ballot_version, get_ballot_modified,
+    passed_boundaries, last_passed_boundary
+)
+from .routing import use_primary
+from .ingest import enqueue_vote, get_ticket, is_queued_ingestion_enabled
+from .filters import PollFilter
+from .pagination import PollCursorPagination
 from .serializers import (
     PollListSerializer, PollDetailSerializer, VoteSerializer, 
-    PollResultSerializer
+    PollResultSerializer, BallotSerializer, TurnoutSeriesSerializer, StreamTokenSerializer
 )
+from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Frozen results never change, so clients may keep them for a year
+SNAPSHOT_MAX_AGE = 60 * 60 * 24 * 365
 
 class IsVoter(permissions.BasePermission):
     """
@@ -18,35 +44,124 @@ class IsVoter(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.is_voter()
 
-class PollListView(generics.ListAPIView):
+class IsPollAdmin(permissions.BasePermission):
+    """
+    Only allow admins
+    """
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.is_admin()
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+class ConditionalGetMixin:
+    """
+    Answer If-None-Match or If-Modified-Since with 304 Not Modified before
+    any serialization.
+
+    Views implement ``get_validators()`` from cheap version counters,
+    returning an ETag and a last-modified timestamp (or None when there is
+    none); clients are told to revalidate on every use so unchanged
+    payloads cost a 304.
+    """
+    def get_validators(self, request):
+        raise NotImplementedError
+    
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return super().get(request, *args, **kwargs)
+        # HTTP dates have whole seconds; rounding up keeps the last change covered
+        if last_modified is not None:
+            last_modified = math.ceil(last_modified)
+        
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class PollListView(ConditionalGetMixin, generics.ListAPIView):
     """
     List all polls
     """
-    queryset = Poll.objects.all().order_by('-start_time')
+    queryset = Poll.objects.all()
     serializer_class = PollListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = PollFilter
+    pagination_class = PollCursorPagination
     
     @extend_schema(
         summary="List all polls",
-        description="Returns a list of all polls with their basic information"
+        description="Returns polls with their basic information, newest first, one cursor page at a time. "
+                    "Filter with status=active|upcoming|ended."
     )
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
+    
+    def get_validators(self, request):
+        # Query parameters (filters, pagination) select different payloads
+        signature, last_modified = get_poll_list_validators()
+        return make_etag('list', signature, request.get_full_path()), last_modified
 
-class PollDetailView(generics.RetrieveAPIView):
+class PollDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     """
     Retrieve a specific poll with its positions and candidates
     """
-    queryset = Poll.objects.all()
+    queryset = Poll.objects.prefetch_related('positions__candidates')
     serializer_class = PollDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     @extend_schema(
         summary="Get poll details",
-        description="Returns detailed information about a specific poll, including positions and candidates"
+        description="Returns detailed information about a specific poll, including positions and candidates. "
+                    "Pass include=voted_positions to also get the IDs of positions the caller has already voted for.",
+        parameters=[
+            OpenApiParameter(name="include", location=OpenApiParameter.QUERY, required=False, type=str,
+                             enum=["voted_positions"])
+        ]
     )
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
+    
+    def get_validators(self, request):
+        ballot = get_ballot_metadata(self.kwargs['pk'])
+        if ballot is None:
+            return None, None
+        
+        parts = ['detail', ballot.poll_id, ballot.version, passed_boundaries(ballot.start_time, ballot.end_time)]
+        if request.query_params.get('include') == 'voted_positions':
+            # Casting a vote leaves no modification time; the ETag covers it
+            parts.append(get_voted_positions(ballot.poll_id, request.user.id))
+            return make_etag(*parts), None
+        
+        boundary = last_passed_boundary(ballot.start_time, ballot.end_time)
+        last_modified = max(get_ballot_modified(ballot.poll_id), boundary.timestamp() if boundary else 0)
+        return make_etag(*parts), last_modified
+    
+    def retrieve(self, request, *args, **kwargs):
+        # The payload is shared by every voter until the ballot is edited, so
+        # it is built from the primary, never a replica that may lag the edit.
+        # Picture URLs are absolute, so entries are kept per host.
+        key = poll_detail_cache_key(self.kwargs['pk'], request.get_host())
+        data = cache.get(key)
+        
+        if data is None:
+            with use_primary():
+                poll = self.get_object()
+                data = dict(self.get_serializer(poll).data)
+            cache.set(key, data, poll_detail_timeout(poll))
+        
+        # Per-user state goes on a copy so the shared payload stays user-agnostic
+        if request.query_params.get('include') == 'voted_positions':
+            data = dict(data, voted_positions=get_voted_positions(data['id'], request.user.id))
+        
+        return Response(data)
 
 class VoteCreateView(generics.CreateAPIView):
     """
@@ -55,6 +170,11 @@ class VoteCreateView(generics.CreateAPIView):
     serializer_class = VoteSerializer
     permission_classes = [IsVoter]
     
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['ballot'] = getattr(self, 'ballot', None)
+        return context
+    
     @extend_schema(
         summary="Cast a vote",
         description="Cast a vote for a candidate in a specific position and poll",
@@ -63,26 +183,116 @@ class VoteCreateView(generics.CreateAPIView):
         ]
     )
     def post(self, request, *args, **kwargs):
-        poll_id = self.kwargs.get('pk')
-        poll = get_object_or_404(Poll, pk=poll_id)
+        # Poll window and candidate/position membership come from the
+        # in-process ballot cache, so a valid vote costs a single INSERT
+        self.ballot = get_ballot_metadata(self.kwargs.get('pk'))
+        if self.ballot is None:
+            raise Http404
         
         # Check if poll is active
-        if not poll.is_active:
+        if not self.ballot.is_active():
             return Response(
                 {"error": "This poll is not currently active"}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Add poll to request data
-        data = request.data.copy()
-        data['poll'] = poll_id
-        
-        serializer = self.get_serializer(data=data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        
+        # Queued mode: acknowledge now, the vote is written by drain_vote_queue
+        if is_queued_ingestion_enabled():
+            ticket = enqueue_vote(
+                self.ballot.poll_id,
+                request.user.id,
+                serializer.validated_data['position_id'],
+                serializer.validated_data['candidate_id'],
+            )
+            return Response({
+                "ticket": ticket['ticket'],
+                "status": ticket['status'],
+                "status_url": reverse('vote-status', args=[ticket['ticket']], request=request),
+            }, status=status.HTTP_202_ACCEPTED)
+        
         serializer.save()
         
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+class BallotCreateView(generics.CreateAPIView):
+    """
+    Cast votes for every position of a poll in one request
+    """
+    serializer_class = BallotSerializer
+    permission_classes = [IsVoter]
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['poll'] = getattr(self, 'poll', None)
+        return context
+    
+    @extend_schema(
+        summary="Submit a ballot",
+        description="Cast one vote per position of a poll in a single request. Either every vote is recorded or none are.",
+        parameters=[
+            OpenApiParameter(name="poll_id", location=OpenApiParameter.PATH, required=True, type=int)
+        ]
+    )
+    def post(self, request, *args, **kwargs):
+        self.poll = get_object_or_404(Poll, pk=self.kwargs.get('pk'))
+        
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        # A concurrent request may have voted for one of the positions since validation
+        try:
+            serializer.save()
+        except IntegrityError:
+            return Response(
+                {"error": "You have already voted for one of these positions."}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+class VoteStatusView(APIView):
+    """
+    Check the final status of a vote accepted in queued ingestion mode
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    @extend_schema(
+        summary="Get queued vote status",
+        description="Returns whether a queued vote is still pending, was recorded or was rejected",
+        responses={200: {"type": "object", "properties": {
+            "ticket": {"type": "string"},
+            "status": {"type": "string", "enum": ["pending", "recorded", "rejected"]},
+            "position": {"type": "integer"},
+            "candidate": {"type": "integer"},
+        }}}
+    )
+    def get(self, request, ticket):
+        state = get_ticket(str(ticket))
+        
+        # Tickets are only visible to the voter who cast them
+        if state is None or state['voter'] != request.user.id:
+            return Response(
+                {"error": "Vote ticket not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        data = {
+            "ticket": state['ticket'],
+            "status": state['status'],
+            "position": state['position'],
+            "candidate": state['candidate'],
+        }
+        if 'vote_id' in state:
+            data['vote_id'] = state['vote_id']
+        if 'processed_at' in state:
+            data['ingestion_lag'] = round(state['processed_at'] - state['queued_at'], 3)
+        if 'error' in state:
+            data['error'] = state['error']
+        return Response(data)
+
 class PollResultsView(generics.RetrieveAPIView):
     """
     Get the results of a poll
@@ -108,4 +318,142 @@ class PollResultsView(generics.RetrieveAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        return super().get(request, *args, **kwargs)
\ No newline at end of file
+        # Ended polls can't change: serve the frozen snapshot, taking it now
+        # if the close task hasn't run yet. Until votes queued before the end
+        # have been written there is no snapshot, and live results are shown.
+        if poll.has_ended:
+            snapshot = freeze_poll_results(poll)
+            if snapshot is not None:
+                return self.snapshot_response(request, snapshot)
+        
+        # Live results for admins while the poll is in progress, revalidated
+        # against the poll's results and ballot versions instead of
+        # re-aggregating; candidate and position edits only bump the latter
+        etag = make_etag('live', poll.id, get_results_version(poll.id), get_ballot_version(poll.id),
+                         poll.updated_at.timestamp())
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if get_conditional_response(request, etag=etag) is not None:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        
+        # Don't announce a winner while the poll is still running.
+        results = hide_outcome(compute_poll_results(poll))
+        
+        serializer = self.get_serializer(results)
+        return Response(serializer.data, headers=headers)
+    
+    def snapshot_response(self, request, snapshot):
+        etag = f'"{snapshot.etag}"'
+        last_modified = snapshot.computed_at.timestamp()
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(last_modified),
+            'Cache-Control': f'private, max-age={SNAPSHOT_MAX_AGE}, immutable',
+        }
+        
+        if get_conditional_response(request, etag=etag, last_modified=last_modified) is not None:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        
+        data = dict(
+            snapshot.results,
+            turnout=snapshot.turnout,
+            computed_at=snapshot.computed_at,
+        )
+        serializer = self.get_serializer(data)
+        return Response(serializer.data, headers=headers)
+
+class PollExportView(APIView):
+    """
+    Stream a poll's votes or tallies for audits
+    """
+    permission_classes = [IsPollAdmin]
+    
+    @extend_schema(
+        summary="Export poll votes or tallies",
+        description="Streams every vote (or the per-candidate tallies) of a poll as CSV or NDJSON, "
+                    "optionally gzipped. Admins only.",
+        parameters=[
+            OpenApiParameter(name="table", type=str, enum=list(TABLES), description="votes (default) or tallies"),
+            OpenApiParameter(name="output", type=str, enum=list(OUTPUTS), description="csv (default) or ndjson"),
+            OpenApiParameter(name="gzip", type=bool, description="Compress the download"),
+        ],
+        responses={(200, 'text/csv'): str, (200, 'application/x-ndjson'): str},
+    )
+    def get(self, request, pk):
+        poll = get_object_or_404(Poll, pk=pk)
+        gzip = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+        try:
+            return export_response(
+                [poll.id],
+                table=request.query_params.get('table', 'votes'),
+                output=request.query_params.get('output', 'csv'),
+                gzip=gzip,
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+class PollResultsStreamTokenView(APIView):
+    """
+    Issue a short-lived token for a poll's live results stream
+    """
+    permission_classes = [IsPollAdmin]
+    
+    @extend_schema(
+        summary="Get a live results stream token",
+        description="Returns a signed token, valid for this poll's results stream only and for "
+                    "RESULTS_STREAM_TOKEN_MAX_AGE seconds, to pass as ?token= when opening the stream "
+                    "with EventSource, which can't send an Authorization header. Admins only.",
+        request=None,
+        responses=StreamTokenSerializer,
+    )
+    def post(self, request, pk):
+        poll = get_object_or_404(Poll, pk=pk)
+        token = make_stream_token(request.user, poll.id)
+        url = reverse('poll-results-stream', args=[poll.id], request=request)
+        data = {'token': token, 'expires_in': get_stream_token_max_age(), 'url': f'{url}?token={token}'}
+        return Response(StreamTokenSerializer(data).data)
+
+class PollTurnoutView(APIView):
+    """
+    Votes per minute over a poll's lifetime, from the turnout rollups
+    """
+    permission_classes = [IsPollAdmin]
+    
+    @extend_schema(
+        summary="Get poll turnout over time",
+        description="Votes cast per interval for the whole poll or one position, read from minute "
+                    "rollups that lag live voting by up to a minute. Admins only.",
+        parameters=[
+            OpenApiParameter(name="start", type=str, description="ISO 8601 start (default: the poll's start)"),
+            OpenApiParameter(name="end", type=str, description="ISO 8601 end (default: now or the poll's end)"),
+            OpenApiParameter(name="interval", type=int, description="Minutes per point; widened to keep at most 500 points"),
+            OpenApiParameter(name="position", type=int, description="Only this position's votes"),
+        ],
+        responses=TurnoutSeriesSerializer,
+    )
+    def get(self, request, pk):
+        poll = get_object_or_404(Poll, pk=pk)
+        params = request.query_params
+        
+        bounds = {}
+        for name in ('start', 'end'):
+            value = params.get(name)
+            if value:
+                bounds[name] = parse_datetime(value)
+                if bounds[name] is None:
+                    return Response({"error": f"{name} must be an ISO 8601 date and time"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                if timezone.is_naive(bounds[name]):
+                    bounds[name] = timezone.make_aware(bounds[name])
+        
+        try:
+            interval = int(params['interval']) if params.get('interval') else None
+            position_id = int(params['position']) if params.get('position') else None
+        except ValueError:
+            return Response({"error": "interval and position must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if interval is not None and interval < 1:
+            return Response({"error": "interval must be at least 1"}, status=status.HTTP_400_BAD_REQUEST)
+        if position_id is not None and not poll.positions.filter(pk=position_id).exists():
+            return Response({"error": "Position not found in this poll"}, status=status.HTTP_404_NOT_FOUND)
+        
+        series = turnout_series(poll, interval=interval, position_id=position_id, **bounds)
+        return Response(TurnoutSeriesSerializer(series).data)
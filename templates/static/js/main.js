@@ -171,7 +171,8 @@ async function getPolls() {
 }
 
 async function getPollDetails(pollId) {
-    return await apiRequest(`/polls/${pollId}/`);
+    // Also ask which positions the current user has already voted for
+    return await apiRequest(`/polls/${pollId}/?include=voted_positions`);
 }
 
 async function getPollResults(pollId) {
@@ -330,19 +331,8 @@ function initLoginPage() {
     });
 }
 
-async function initPollsPage() {
-    const pollsContainer = document.getElementById('polls-container');
-    if (!pollsContainer) return;
-    
-    const polls = await getPolls();
-    if (!polls) return;
-    
-    if (polls.length === 0) {
-        pollsContainer.innerHTML = '<p>No polls available at the moment.</p>';
-        return;
-    }
-    
-    let pollsHTML = '<div class="grid">';
+function renderPollCards(polls) {
+    let pollsHTML = '';
     
     polls.forEach(poll => {
         pollsHTML += `
@@ -361,8 +351,41 @@ async function initPollsPage() {
         `;
     });
     
-    pollsHTML += '</div>';
-    pollsContainer.innerHTML = pollsHTML;
+    return pollsHTML;
+}
+
+async function initPollsPage() {
+    const pollsContainer = document.getElementById('polls-container');
+    if (!pollsContainer) return;
+    
+    const page = await getPolls();
+    if (!page) return;
+    
+    if (page.results.length === 0) {
+        pollsContainer.innerHTML = '<p>No polls available at the moment.</p>';
+        return;
+    }
+    
+    pollsContainer.innerHTML = `
+        <div class="grid">${renderPollCards(page.results)}</div>
+        <div class="mt-3 text-center"><button id="load-more-polls" class="btn">Load More</button></div>
+    `;
+    
+    // The list is cursor-paginated; follow the "next" link on demand
+    const grid = pollsContainer.querySelector('.grid');
+    const loadMoreBtn = document.getElementById('load-more-polls');
+    let nextUrl = page.next;
+    loadMoreBtn.hidden = !nextUrl;
+    
+    loadMoreBtn.addEventListener('click', async () => {
+        const url = new URL(nextUrl);
+        const nextPage = await apiRequest(url.pathname.replace(apiBaseUrl, '') + url.search);
+        if (!nextPage) return;
+        
+        grid.insertAdjacentHTML('beforeend', renderPollCards(nextPage.results));
+        nextUrl = nextPage.next;
+        loadMoreBtn.hidden = !nextUrl;
+    });
 }
 
 async function initPollDetailPage() {
@@ -380,6 +403,8 @@ async function initPollDetailPage() {
     const poll = await getPollDetails(pollId);
     if (!poll) return;
     
+    const votedPositions = new Set(poll.voted_positions || []);
+    
     let detailHTML = `
         <h1>${poll.title}</h1>
         <p class="mb-2">${poll.description || 'No description available.'}</p>
@@ -412,16 +437,26 @@ async function initPollDetailPage() {
             } else {
                 position.candidates.forEach(candidate => {
                     const imgSrc = candidate.profile_picture || 'static/images/default-profile.png';
+                    // Resized variants when available; the original upload otherwise
+                    const images = candidate.images;
+                    const picture = images && images.jpeg ?
+                        `<picture>
+                            ${images.webp ? `<source type="image/webp" srcset="${images.webp.srcset}" sizes="150px">` : ''}
+                            <img src="${images.jpeg.src}" srcset="${images.jpeg.srcset}" sizes="150px" alt="${candidate.name}" class="candidate-image" loading="lazy">
+                        </picture>` :
+                        `<img src="${imgSrc}" alt="${candidate.name}" class="candidate-image">`;
                     
                     detailHTML += `
                         <div class="candidate">
-                            <img src="${imgSrc}" alt="${candidate.name}" class="candidate-image">
+                            ${picture}
                             <div class="candidate-info">
                                 <h3 class="candidate-name">${candidate.name}</h3>
                                 <p class="candidate-description">${candidate.description}</p>
                             </div>
                             ${poll.status === 'Active' ? 
-                                `<button class="btn vote-btn" data-position="${position.id}" data-candidate="${candidate.id}">Vote</button>` : 
+                                (votedPositions.has(position.id) ?
+                                    `<button class="btn vote-btn btn-secondary" data-position="${position.id}" data-candidate="${candidate.id}" disabled>Voted</button>` :
+                                    `<button class="btn vote-btn" data-position="${position.id}" data-candidate="${candidate.id}">Vote</button>`) : 
                                 ''
                             }
                         </div>